@@ -0,0 +1,151 @@
+import sys
+import os
+import argparse
+import nateBackupToolsCommon as common
+import json
+import shutil
+import tempfile
+
+# see https://docs.python.org/dev/library/argparse.html
+argParser = argparse.ArgumentParser(description=
+"""Times each stage of the other scripts on made-up data (see
+\'generateTestData.py\'), and writes the results to a JSON file so runs can
+be compared. Stages that read files use a small tree created on disk; the
+rest use a bigger hash file.
+
+The JSON file is like the one written by the other scripts' --metrics
+option, with "parameters" (the options used), "python" and "platform"
+added. "stages" has one entry per stage: "name", "seconds" (wall clock),
+"cpuSeconds", "peakMemory", "records", "recordsPerSecond", and for stages
+that read files, "bytes" and "bytesPerSecond".""")
+
+argParser.add_argument('outFilePath', help='The path to the JSON file to write')
+
+argParser.add_argument('--files', type=int, default=50000,
+  help='How many files the made-up hash file has (default 50000)')
+
+argParser.add_argument('--tree-files', type=int, default=2000,
+  help='How many files to create on disk for walking and hashing (default 2000)')
+
+argParser.add_argument('--tree-max-size', type=int, default=1024 * 1024,
+  help='The biggest file to create on disk, in bytes (default 1048576)')
+
+argParser.add_argument('--seed', type=int, default=0,
+  help='The random seed for the made-up data (default 0)')
+
+argParser.add_argument('--work-dir', default=None,
+  help='Where to put the made-up data (default a temporary directory, deleted afterwards)')
+
+args = argParser.parse_args()
+
+metrics = common.Metrics()
+
+def timeStage(name, func):
+  # func does the stage's work, and returns (records, bytes or None)
+  print "%s..." % name
+  stage = metrics.startStage(name)
+  (records, byteCount) = func()
+  stage.finish(records, byteCount)
+  print "%s: %.3fs" % (name, stage.seconds)
+
+workDir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix="nateBackupToolsBenchmark")
+try:
+  csvPath = os.path.join(workDir, "hashes.txt")
+  binaryPath = os.path.join(workDir, "hashes.bin")
+  treePath = os.path.join(workDir, "tree")
+  reportPath = os.path.join(workDir, "report.txt")
+
+  # make the data
+  def generateCatalog():
+    writer = common.CsvHashFileWriter(csvPath)
+    for (filePath, contentId, fileSize) in common.generateSyntheticFiles(args.files, seed=args.seed):
+      writer.writeRecord(common.getSyntheticHash(contentId, args.seed), fileSize, filePath, 1500000000.0 + contentId)
+    writer.close()
+    return (args.files, None)
+  timeStage("generate hash file", generateCatalog)
+
+  def generateTree():
+    byteCount = 0
+    for (filePath, contentId, fileSize) in common.generateSyntheticFiles(
+        args.tree_files, maxSize=args.tree_max_size, seed=args.seed):
+      fullPath = os.path.join(treePath, *filePath.split("/"))
+      if not os.path.isdir(os.path.dirname(fullPath)):
+        os.makedirs(os.path.dirname(fullPath))
+      with open(fullPath, "wb") as outFile:
+        outFile.write(common.getSyntheticContents(contentId, fileSize, args.seed))
+      byteCount += fileSize
+    return (args.tree_files, byteCount)
+  timeStage("generate tree", generateTree)
+
+  # stages that touch the disk
+  treeFiles = []
+  def walk():
+    for (filePath, fileStat) in common.walkFiles(treePath):
+      treeFiles.append((filePath, fileStat.st_size))
+    return (len(treeFiles), None)
+  timeStage("walk", walk)
+
+  def hashFiles():
+    for (filePath, fileSize) in treeFiles:
+      common.getFileHash(filePath)
+    return (len(treeFiles), sum(fileSize for (filePath, fileSize) in treeFiles))
+  timeStage("hash", hashFiles)
+
+  # stages that read hash files
+  def parseCsv():
+    return (sum(1 for row in common.readHashFile(csvPath)), os.path.getsize(csvPath))
+  timeStage("parse csv", parseCsv)
+
+  writer = common.BinaryCatalogWriter(binaryPath)
+  for (fileHash, fileSize, filePath, mtime) in common.readHashFile(csvPath):
+    writer.writeRecord(fileHash, fileSize, filePath, mtime)
+  writer.close()
+
+  def parseBinary():
+    return (sum(1 for row in common.readHashFile(binaryPath)), os.path.getsize(binaryPath))
+  timeStage("parse binary", parseBinary)
+
+  loaded = {}
+  def buildTree():
+    loaded['filesByHash'] = common.HashIndex()
+    progress = common.ProgressPrinter("\rLoading record {0}...")
+    loaded['root'] = common.loadCatalogs([(None, csvPath)], loaded['filesByHash'], progress)
+    progress.reportDone()
+    return (args.files, None)
+  timeStage("build tree", buildTree)
+
+  def writeFileReport():
+    common.writeDuplicateFileReport(loaded['filesByHash'], reportPath)
+    return (args.files, None)
+  timeStage("duplicate file report", writeFileReport)
+
+  # folder comparison
+  folderResults = {}
+  def scoreFolders(candidates):
+    def score():
+      matcher = common.FolderMatcher(loaded['filesByHash'], {})
+      if candidates == 'minhash':
+        matcher.lookForDuplicateFoldersByMinHash(loaded['root'], 32, 2)
+      else:
+        matcher.lookForDuplicateFolders(loaded['root'], common.ProgressPrinter("\rProcessing folder {0}..."))
+      folderResults[candidates] = matcher.getSortedStats()
+      return (len(loaded['root'].getAllDirs()), None)
+    return score
+  timeStage("score folders (exact)", scoreFolders('exact'))
+  timeStage("score folders (minhash)", scoreFolders('minhash'))
+
+  def writeFolderReport():
+    common.writeSimilarFolderReport(folderResults['exact'], reportPath)
+    return (len(folderResults['exact']), None)
+  timeStage("similar folder report", writeFolderReport)
+finally:
+  if args.work_dir is None:
+    shutil.rmtree(workDir, ignore_errors=True)
+
+results = metrics.toDict()
+results['parameters'] = vars(args)
+results['python'] = sys.version.split()[0]
+results['platform'] = sys.platform
+with open(args.outFilePath, "wb") as outFile:
+  json.dump(results, outFile, indent=2, sort_keys=True)
+print 'done'
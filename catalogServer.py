@@ -0,0 +1,315 @@
+import sys
+import os
+import argparse
+import nateBackupToolsCommon as common
+import csv
+import json
+import socket
+import binascii
+
+# see https://docs.python.org/dev/library/argparse.html
+argParser = argparse.ArgumentParser(description=
+"""Loads hash files (outputs of \'hashFolderContents.py\') once and keeps
+them in memory, answering questions about them over a Unix socket, so
+each question doesn't have to wait for the hash files to be read again.
+Not available on Windows.
+
+"serve" loads the hash files and answers questions until asked to "stop".
+Questions are answered one at a time. Before each one, hash files that
+changed on disk since they were loaded are loaded again: with several
+labeled hash files, only the changed ones. Replace a hash file in one go
+(write it somewhere else, then rename it) rather than changing it while
+the server might be reading it. In reports from reloaded hash files,
+folders or files that tie can be listed in a different order than
+\'findDuplicateFiles.py\' or \'findDuplicateFolders.py\' would list them.
+
+The other commands ask a running server:
+
+"duplicate-files" and "similar-folders" write the reports of
+\'findDuplicateFiles.py\' and \'findDuplicateFolders.py\' to an output file.
+
+"copies" lists every copy of a file, given its hash or one of its paths,
+as rows <hash> <size> <sizeHumanReadableText> <path>.
+
+"sizes" lists folders and their total sizes, as rows "folder"
+<sizeHumanReadableText> <path>, each folder followed by its subfolders,
+biggest first.
+
+Results are written to stdout as csv with space as the delimiter.""")
+
+argParser.add_argument('socketPath', help='The path to the Unix socket the server listens on')
+
+subParsers = argParser.add_subparsers(dest='command')
+
+serveParser = subParsers.add_parser('serve', help='Load hash files and answer questions about them')
+serveParser.add_argument('hashFilePath',
+  help='The path to the input file (which was generated by \'hashFolderContents.py\'')
+serveParser.add_argument('--jobs', type=int, default=1,
+  help='The number of processes to load hash files and compare folders with (default 1)')
+common.addCatalogArguments(serveParser)
+
+duplicateFilesParser = subParsers.add_parser('duplicate-files', help='Which files are duplicated?')
+duplicateFilesParser.add_argument('outFilePath',
+  help='The path to the output file to populate with detected duplicates')
+duplicateFilesParser.add_argument('--cross-catalog-only', action='store_true',
+  help='Only report duplicates that are in more than one catalog')
+
+similarFoldersParser = subParsers.add_parser('similar-folders', help='Which folders are similar?')
+similarFoldersParser.add_argument('outFilePath',
+  help='The path to the output file to populate with detected duplicates')
+similarFoldersParser.add_argument('--under', metavar='FOLDER', default='',
+  help='Only folders in this folder (as its path is written in the report) and their pairs')
+similarFoldersParser.add_argument('--ignore-common-hashes', type=int, default=None, metavar='COUNT',
+  help='Don\'t pair up folders because of files with more than COUNT copies')
+similarFoldersParser.add_argument('--cross-catalog-only', action='store_true',
+  help='Only report duplicates that are in more than one catalog')
+
+copiesParser = subParsers.add_parser('copies', help='Where are all copies of a file?')
+copiesParser.add_argument('hashOrPath', help='A file hash, or the path of a file in the catalogs')
+
+sizesParser = subParsers.add_parser('sizes', help='How big are the folders?')
+sizesParser.add_argument('--under', metavar='FOLDER', default='',
+  help='Only folders in this folder (as its path is written in the report)')
+sizesParser.add_argument('--depth', type=int, default=1,
+  help='How many levels of subfolders to list (default 1)')
+
+subParsers.add_parser('stop', help='Stop the server')
+
+args = argParser.parse_args()
+
+if not hasattr(socket, 'AF_UNIX'):
+  argParser.error("Unix sockets aren't available on this platform")
+
+# the algorithm of a packed hash, from how long it is
+ALGORITHMS_BY_DIGEST_SIZE = dict((size, algorithm) for (algorithm, size) in common.HASH_DIGEST_SIZES.items())
+
+def getStamp(hashFilePath):
+  # what changes when a hash file is written again
+  fileStat = os.stat(hashFilePath)
+  return (fileStat.st_size, fileStat.st_mtime)
+
+class CatalogServer:
+  # holds the loaded hash files and answers requests (dicts like the client's args) about them
+  def __init__(self, catalogs, cacheDir, jobs):
+    self.catalogs = catalogs
+    self.cacheDir = cacheDir
+    self.jobs = jobs
+    self.stamps = {} # key = hash file path, value = getStamp() when it was loaded
+    self.loadAll()
+
+  def loadAll(self):
+    # (stamped before loading, so changes made while loading are noticed next time)
+    stamps = dict((hashFilePath, getStamp(hashFilePath)) for (label, hashFilePath) in self.catalogs)
+    filesByHash = common.HashIndex()
+    progress = common.ProgressPrinter("\rReading record {0}...")
+    self.root = common.loadCatalogs(self.catalogs, filesByHash, progress, self.cacheDir, jobs=self.jobs)
+    self.filesByHash = filesByHash
+    self.stamps = stamps
+    progress.reportDone()
+
+  def reloadChangedCatalogs(self):
+    # a rewritten hash file might have switched algorithms, which would leave
+    # nothing to compare with the others (the old copy is kept if so)
+    if len(self.catalogs) > 1 and any(getStamp(p) != self.stamps[p] for (label, p) in self.catalogs):
+      common.checkCatalogAlgorithms(hashFilePath for (label, hashFilePath) in self.catalogs)
+    for (label, hashFilePath) in self.catalogs:
+      stamp = getStamp(hashFilePath)
+      if stamp == self.stamps[hashFilePath]:
+        continue
+      print "Reloading %s..." % hashFilePath
+      if label is None:
+        # the only catalog, so there's nothing to keep
+        self.loadAll()
+        continue
+      progress = common.ProgressPrinter("\rReading record {0}...")
+      common.reloadCatalog(self.root, label, hashFilePath, self.filesByHash, progress, self.cacheDir, self.jobs)
+      progress.reportDone()
+      self.stamps[hashFilePath] = stamp
+
+  def findDir(self, dirPath):
+    memDir = self.root
+    dirPath = dirPath.rstrip("\\/")
+    if dirPath == "":
+      return memDir
+    for name in reversed(common.splitFilePath(dirPath)[2]):
+      memDir = memDir.dirs.get(name)
+      if memDir is None:
+        raise ValueError("there's no folder %s in the catalogs" % dirPath)
+    return memDir
+
+  def findFile(self, filePath):
+    (dirPath, name) = common.splitDirPath(filePath)
+    try:
+      memDir = self.findDir(dirPath)
+    except ValueError:
+      return None
+    for memFile in memDir.files:
+      if memFile.name == name:
+        return memFile
+    return None
+
+  def checkCrossCatalogOnly(self, request):
+    if request['cross_catalog_only'] and len(self.catalogs) < 2:
+      raise ValueError("--cross-catalog-only needs more than one catalog")
+
+  def answer(self, request):
+    # returns the rows to send back
+    command = request['command']
+    if command == 'ping':
+      return []
+
+    if command == 'duplicate-files':
+      self.checkCrossCatalogOnly(request)
+      common.writeDuplicateFileReport(self.filesByHash, request['outFilePath'], request['cross_catalog_only'])
+      return []
+
+    if command == 'similar-folders':
+      self.checkCrossCatalogOnly(request)
+      memDir = self.findDir(request['under'])
+      matcher = common.FolderMatcher(self.filesByHash, common.DIR_NAMES_TO_IGNORE,
+                                     request['ignore_common_hashes'], request['cross_catalog_only'])
+      progress = common.ProgressPrinter("\rProcessing folder {0}...")
+      if self.jobs > 1:
+        matcher.lookForDuplicateFoldersInParallel(memDir, progress, self.jobs)
+      else:
+        matcher.lookForDuplicateFolders(memDir, progress)
+      progress.reportDone()
+      common.writeSimilarFolderReport(matcher.getSortedStats(), request['outFilePath'])
+      return []
+
+    if command == 'copies':
+      memFile = self.findFile(request['hashOrPath'])
+      if memFile is not None:
+        fileHash = memFile.hash
+      else:
+        try:
+          fileHash = common.packHash(request['hashOrPath'])
+        except TypeError:
+          raise ValueError("%s is neither a hash nor a file in the catalogs" % request['hashOrPath'])
+      rows = []
+      for memFile in sorted(self.filesByHash.get(fileHash), key=lambda f: f.getPath()):
+        algorithm = ALGORITHMS_BY_DIGEST_SIZE[len(memFile.hash)]
+        rows.append([common.unpackHash(memFile.hash, algorithm), memFile.size,
+                     common.getHumanReadableSize(memFile.size), memFile.getPath()])
+      return rows
+
+    if command == 'sizes':
+      rows = []
+      def listDirs(memDir, depth):
+        if depth > request['depth']:
+          return
+        for childDir in sorted(memDir.dirs.itervalues(), key=lambda d: (-d.size, d.name)):
+          rows.append(["folder", common.getHumanReadableSize(childDir.size), childDir.getPath()])
+          listDirs(childDir, depth + 1)
+      listDirs(self.findDir(request['under']), 1)
+      return rows
+
+    raise ValueError("unknown command: %s" % command)
+
+def encodeRequest(request):
+  # paths are whatever bytes the filesystem gave, which JSON can't hold if they
+  # aren't UTF-8, so strings are sent as hex (like the checkpoint in hashFolderContents.py)
+  return json.dumps(dict((key, binascii.hexlify(value) if isinstance(value, str) else value)
+                         for (key, value) in request.items()))
+
+def decodeRequest(line):
+  return dict((key, binascii.unhexlify(value) if isinstance(value, basestring) else value)
+              for (key, value) in json.loads(line).items())
+
+def describeError(e):
+  # repr() of the message, since it can hold paths that aren't ASCII
+  return repr(e.args[0]) if len(e.args) == 1 else repr(e)
+
+def respond(server, inFile, outFile):
+  # answers one request, and returns whether to keep serving
+  try:
+    request = decodeRequest(inFile.readline())
+    print "Answering %s..." % request['command']
+    if request['command'] == 'stop':
+      outFile.write("ok\n")
+      return False
+    if request['command'] != 'ping':
+      server.reloadChangedCatalogs()
+    rows = server.answer(request)
+  except Exception as e:
+    # whatever went wrong, it's only this request's problem
+    print "Error: %s" % describeError(e)
+    outFile.write("error %s\n" % describeError(e))
+    return True
+  outFile.write("ok\n")
+  csv.writer(outFile, delimiter=' ', strict=True).writerows(rows)
+  return True
+
+def serve():
+  catalogs = common.getCatalogs(args, serveParser)
+  if args.jobs > 1 and sys.platform == 'win32':
+    serveParser.error("--jobs needs fork(), which Windows doesn't have")
+
+  # a socket file left by a server that didn't stop cleanly is removed,
+  # but not one that a server is still listening on
+  if os.path.exists(args.socketPath):
+    try:
+      ask({'command': 'ping'})
+      sys.exit("a server is already listening on " + args.socketPath)
+    except socket.error:
+      os.remove(args.socketPath)
+
+  server = CatalogServer(catalogs, args.cache_dir, args.jobs)
+
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  listener.bind(args.socketPath)
+  listener.listen(5)
+  print "Listening on %s" % args.socketPath
+  try:
+    keepServing = True
+    while keepServing:
+      (connection, address) = listener.accept()
+      # the connection stays open until both files are closed
+      inFile = connection.makefile("rb")
+      outFile = connection.makefile("wb")
+      connection.close()
+      try:
+        keepServing = respond(server, inFile, outFile)
+        outFile.close()
+      except socket.error as e:
+        # the client went away
+        print "Error: %s" % e
+      finally:
+        inFile.close()
+  finally:
+    listener.close()
+    os.remove(args.socketPath)
+  print 'done'
+
+def ask(request):
+  # sends a request to the server, and returns the response's rows as one string.
+  # the response starts with a line that's "ok", or "error <message>"
+  connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    connection.connect(args.socketPath)
+    connection.sendall(encodeRequest(request) + "\n")
+    inFile = connection.makefile("rb")
+    status = inFile.readline()
+    response = inFile.read()
+  finally:
+    connection.close()
+  if status == "":
+    raise socket.error("the server closed the connection without answering")
+  if status != "ok\n":
+    sys.exit(status.rstrip("\n"))
+  return response
+
+if args.command == 'serve':
+  serve()
+else:
+  request = vars(args)
+  if 'outFilePath' in request:
+    # the server might not be running in the same directory
+    request['outFilePath'] = os.path.abspath(request['outFilePath'])
+  try:
+    response = ask(request)
+  except socket.error as e:
+    sys.exit("couldn't ask the server on %s: %s" % (args.socketPath, e))
+  sys.stdout.write(response)
+  if args.command in ('duplicate-files', 'similar-folders', 'stop'):
+    print 'done'
@@ -0,0 +1,58 @@
+import sys
+import os
+import argparse
+import nateBackupToolsCommon as common
+
+# see https://docs.python.org/dev/library/argparse.html
+argParser = argparse.ArgumentParser(description=
+"""Converts the output of \'hashFolderContents.py\' between its csv format
+and a binary catalog format. Binary catalogs hold the same records but
+are much quicker for \'findDuplicateFiles.py\' and \'findDuplicateFolders.py\'
+to load, which they do automatically when given one.
+
+It can also write SQLite catalogs, for \'queryCatalog.py\'. Extra hashes
+(see \'hashFolderContents.py --also-hash\') are kept, so hash files that
+have them can't be converted to binary catalogs, which only hold one hash
+per file.""")
+
+argParser.add_argument('hashFilePath',
+  help='The path to the input file (a csv hash file, a binary catalog or a SQLite catalog)')
+
+argParser.add_argument('outFilePath',
+  help='The path to the output file')
+
+argParser.add_argument('--to', choices=['binary', 'csv', 'sqlite'], default=None,
+  help='The format to write (default: binary for a csv input, otherwise csv)')
+
+common.addMetricsArgument(argParser)
+
+args = argParser.parse_args()
+metrics = common.Metrics()
+
+outFormat = args.to
+if outFormat is None:
+  isCsv = not common.isBinaryCatalog(args.hashFilePath) and not common.isSqliteCatalog(args.hashFilePath)
+  outFormat = 'binary' if isCsv else 'csv'
+
+if outFormat == 'sqlite':
+  writer = common.SqliteCatalogWriter(args.outFilePath)
+elif outFormat == 'binary':
+  writer = common.BinaryCatalogWriter(args.outFilePath)
+else:
+  writer = common.CsvHashFileWriter(args.outFilePath)
+
+progress = metrics.progress("convert", "\rConverting record {0}...")
+try:
+  for (fileHash, fileSize, filePath, mtime, extraHashes) in common.readHashFile(args.hashFilePath,
+                                                                                withExtraHashes=True):
+    progress.report()
+    writer.writeRecord(fileHash, fileSize, filePath, mtime, extraHashes)
+except ValueError as e:
+  # don't leave a cut-off output that looks like a whole catalog
+  writer.close()
+  os.remove(args.outFilePath)
+  progress.reportDone()
+  sys.exit("can't convert %s: %s" % (args.hashFilePath, e))
+writer.close()
+progress.reportDone()
+metrics.write(args.metrics)
@@ -0,0 +1,157 @@
+import sys
+import os
+import argparse
+import nateBackupToolsCommon as common
+import csv
+import shutil
+import tempfile
+
+# see https://docs.python.org/dev/library/argparse.html
+argParser = argparse.ArgumentParser(description=
+"""Compares two scans of the same drive (outputs of \'hashFolderContents.py\',
+older one first) and reports what changed in between, writing it to an
+output file. Give the drive the same way both times, so the paths match.
+
+The output file format is csv with space as the delimiter. Each row is
+<change> <path>, where change is one of:
+"added" - the file is only in the newer scan
+"deleted" - the file is only in the older scan
+"moved" - a file was deleted and a file with the same contents added, so it
+was probably moved or renamed. The row is "moved" <old path> <new path>.
+When several such files have the same contents, they're paired up in path
+order.
+"modified" - the file's contents changed, and so did its size or
+modification time. The row also has the <old hash> and <new hash>.
+"corrupted" - the file's contents changed even though its size and
+modification time didn't, which usually means it got corrupted. The row
+also has the <old hash> and <new hash>.
+Rows are sorted by path (the old path, for moved files).
+
+Neither hash file is loaded into memory: both are sorted on disk (see
+--sort-memory) and compared in one pass, then the deleted and added files
+are sorted by hash and compared to find the moved ones.""")
+
+argParser.add_argument('oldHashFilePath', help='The path to the hash file from the older scan')
+
+argParser.add_argument('newHashFilePath', help='The path to the hash file from the newer scan')
+
+argParser.add_argument('outFilePath',
+  help='The path to the output file to populate with changes')
+
+argParser.add_argument('--sort-memory', type=int, default=1000000, metavar='ROWS',
+  help='How many rows to sort in memory at a time (default 1000000)')
+
+common.addMetricsArgument(argParser)
+
+args = argParser.parse_args()
+metrics = common.Metrics()
+
+# rows are [path, hash, size, mtime or ""], as strings so they can be sorted on disk
+def enumerateRows(hashFilePath, messageFormat):
+  progress = common.ProgressPrinter(messageFormat)
+  for (fileHash, fileSize, filePath, mtime) in common.readHashFile(hashFilePath):
+    progress.report()
+    yield [filePath, fileHash, str(fileSize), "" if mtime is None else common.formatMtime(mtime)]
+  progress.reportDone()
+
+def mergeJoin(oldRows, newRows, key):
+  # yields (old row or None, new row or None) for rows of two streams sorted by key,
+  # pairing up rows with the same key
+  oldRow = next(oldRows, None)
+  newRow = next(newRows, None)
+  while oldRow is not None or newRow is not None:
+    if newRow is None or (oldRow is not None and key(oldRow) < key(newRow)):
+      yield (oldRow, None)
+      oldRow = next(oldRows, None)
+    elif oldRow is None or key(newRow) < key(oldRow):
+      yield (None, newRow)
+      newRow = next(newRows, None)
+    else:
+      yield (oldRow, newRow)
+      oldRow = next(oldRows, None)
+      newRow = next(newRows, None)
+
+def readRows(filePath):
+  with open(filePath, "rb") as inFile:
+    for row in csv.reader(inFile, strict=True):
+      yield row
+
+tempDir = tempfile.mkdtemp(prefix="nateBackupTools")
+try:
+  changedPath = os.path.join(tempDir, "changed.csv")
+  deletedPath = os.path.join(tempDir, "deleted.csv")
+  addedPath = os.path.join(tempDir, "added.csv")
+
+  # pass 1: join the scans by path. files in both with a different hash are changed,
+  # and the rest are put aside to look for moves
+  stage = metrics.startStage("compare paths")
+  byPath = lambda row: row[0]
+  oldRows = common.externalSort(enumerateRows(args.oldHashFilePath, "\rReading old record {0}..."),
+                                byPath, args.sort_memory)
+  newRows = common.externalSort(enumerateRows(args.newHashFilePath, "\rReading new record {0}..."),
+                                byPath, args.sort_memory)
+  with open(changedPath, "wb") as changedFile, open(deletedPath, "wb") as deletedFile, \
+       open(addedPath, "wb") as addedFile:
+    changedOut = csv.writer(changedFile, strict=True)
+    deletedOut = csv.writer(deletedFile, strict=True)
+    addedOut = csv.writer(addedFile, strict=True)
+    checkedAlgorithms = False
+    for (oldRow, newRow) in mergeJoin(oldRows, newRows, byPath):
+      if newRow is None:
+        deletedOut.writerow(oldRow)
+      elif oldRow is None:
+        addedOut.writerow(newRow)
+      else:
+        (filePath, oldHash, oldSize, oldMtime) = oldRow
+        (filePath, newHash, newSize, newMtime) = newRow
+        if not checkedAlgorithms:
+          if common.getHashAlgorithm(oldHash) != common.getHashAlgorithm(newHash):
+            sys.exit("the scans used different hash algorithms (%s and %s), so they can't be compared" % \
+                     (common.getHashAlgorithm(oldHash), common.getHashAlgorithm(newHash)))
+          checkedAlgorithms = True
+        if oldHash == newHash:
+          continue
+        # rows without an mtime can't show that the file wasn't touched
+        if oldSize == newSize and oldMtime != "" and oldMtime == newMtime:
+          changedOut.writerow(["corrupted", filePath, oldHash, newHash])
+        else:
+          changedOut.writerow(["modified", filePath, oldHash, newHash])
+  stage.finish()
+
+  # pass 2: join the deleted and added files by hash, pairing up files with the same
+  # contents in path order. those were moved
+  def enumerateMoves():
+    byHash = lambda row: (row[1], row[0])
+    deletedRows = common.externalSort(readRows(deletedPath), byHash, args.sort_memory)
+    addedRows = common.externalSort(readRows(addedPath), byHash, args.sort_memory)
+    for (deletedRow, addedRow) in mergeJoin(deletedRows, addedRows, lambda row: row[1]):
+      if addedRow is None:
+        yield ["deleted", deletedRow[0]]
+      elif deletedRow is None:
+        yield ["added", addedRow[0]]
+      else:
+        yield ["moved", deletedRow[0], addedRow[0]]
+
+  def enumerateChanges():
+    for row in readRows(changedPath):
+      yield row
+    for row in enumerateMoves():
+      yield row
+
+  # pass 3: put it all in path order
+  counts = {}
+  progress = metrics.progress("find moves and write", "\rWriting change {0}...")
+  with open(args.outFilePath, "wb") as outFile:
+    csvOut = csv.writer(outFile, delimiter=' ', strict=True)
+    for row in common.externalSort(enumerateChanges(), lambda row: row[1], args.sort_memory):
+      progress.report()
+      csvOut.writerow(row)
+      counts[row[0]] = counts.get(row[0], 0) + 1
+  progress.reportDone()
+finally:
+  shutil.rmtree(tempDir, ignore_errors=True)
+
+metrics.write(args.metrics)
+for change in ["corrupted", "modified", "moved", "deleted", "added"]:
+  print "%s: %d" % (change, counts.get(change, 0))
+print 'done'
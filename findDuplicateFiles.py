@@ -12,7 +12,11 @@ first field is "file" identifies a unique file. The following fields are:
 <sizeHumanReadableText> [filename, ...]. 
 All rows after that whose first field is "duplicate" identify the paths
 of all found matching files. The following field is: <path>.
-Empty rows are added for human readability.""")
+Empty rows are added for human readability.
+
+Several hash files (say, one per backup drive) can be searched together
+with --label and --catalog. Paths are then written starting with the
+label of the drive they're on.""")
 
 argParser.add_argument('hashFilePath', 
   help='The path to the input file (which was generated by \'hashFolderContents.py\'')
@@ -20,84 +24,44 @@ argParser.add_argument('hashFilePath',
 argParser.add_argument('outFilePath', 
   help='The path to the output file to populate with detected duplicates')
 
-args = argParser.parse_args()
-
-memRootDir = common.MemDirectory(name="", parentDir=None)
-filesByHash = {}
-progress = common.ProgressPrinter("\rReading record {0}...")
-with open(args.hashFilePath, "rb") as inFile:
-  csvIn = csv.reader(inFile, delimiter=' ', strict=True)
-  for row in csvIn:
-    # report progress once in a while
-    progress.report()
-
-    # parse line data
-    (fileHash, fileSize, fileSizeForHumes, filePath) = [row[0], row[1], row[2], row[3]]
-    fileSize = long(fileSize)
-    (drive, leadingSlashes, reversePathParts) = common.splitFilePath(filePath)
-    common.deduplicate(reversePathParts)
-
-    # build an in-memory tree of the filesystem
-    newFile = memRootDir.add(fileHash, fileSize, reversePathParts)
-
-    # associate all files by hash
-    if newFile.hash in filesByHash:
-      likeFiles = filesByHash[newFile.hash]
-    else:
-      likeFiles = []
-      filesByHash[newFile.hash] = likeFiles
-    likeFiles.append(newFile)
-
-progress.reportDone()
-
-class FilePile:
-  def __init__(self, hash, files):
-    self.hash = hash
-    self.files = files
-    self.firstFileSize = files[0].size
-    self.firstFilePath = files[0].getPath()
+argParser.add_argument('--jobs', type=int, default=1,
+  help='The number of processes to parse a big csv hash file with (default 1). '
+       'The output is the same. Not available on Windows.')
 
-# enumerate all duplicate file piles, sorted first by size then path
-piles = []
-progress = common.ProgressPrinter("\rProcessing unique record {0}...")
-for hash in filesByHash:
-  files = filesByHash[hash]
+common.addCatalogArguments(argParser)
+common.addMetricsArgument(argParser)
 
-  # report progress once in a while
-  progress.report()
+argParser.add_argument('--streaming', action='store_true',
+  help='Sort the hash file on disk instead of loading it all into memory. '
+       'Slower, but works for hash files much bigger than RAM. '
+       'The output is the same.')
 
-  if len(files) > 1:
-    files.sort(key=lambda y: y.getPath())
-    pile = FilePile(hash, files)
-    piles.append(pile)
+argParser.add_argument('--sort-memory', type=int, default=1000000, metavar='ROWS',
+  help='With --streaming, how many rows, or file names and paths of duplicates, to sort in memory at a time (default 1000000)')
 
+args = argParser.parse_args()
+catalogs = common.getCatalogs(args, argParser)
+metrics = common.Metrics()
+
+if args.streaming:
+  stage = metrics.startStage("streaming report")
+  common.streamDuplicateFileReport(catalogs, args.outFilePath, args.sort_memory,
+                                   args.cross_catalog_only, args.cache_dir)
+  stage.finish()
+  metrics.write(args.metrics)
+  print 'done'
+  sys.exit(0)
+
+# build an in-memory tree of the filesystem, and associate all files by hash
+filesByHash = common.HashIndex()
+progress = metrics.progress("load", "\rReading record {0}...")
+# (files with unique hashes aren't reported, so there's no need to load them if it can be avoided)
+memRootDir = common.loadCatalogs(catalogs, filesByHash, progress, args.cache_dir, duplicatesOnly=True,
+                                 jobs=args.jobs)
 progress.reportDone()
 
-print "Sorting duplicate file data..."
-piles.sort(key=lambda x: (x.firstFileSize, x.firstFilePath), reverse=True)
-
-progress = common.ProgressPrinter("\rWriting duplicate file data {0}...")
-with open(args.outFilePath, "wb") as outFile:
-  csvOut = csv.writer(outFile, delimiter=' ', strict=True)
-  for filePile in piles:
-    # report progress once in a while
-    progress.report()
-
-    # sanity check for hash collisions
-    if not all(x.size == filePile.firstFileSize for x in filePile.files):
-      raise ValueError('Files with same hash had different size!')
-  
-    # write a row with file size and all unique file names 
-    fileSizeForHumes = common.getHumanReadableSize(filePile.firstFileSize)
-    orderedFileNames = sorted(set([x.name for x in filePile.files]))
-    csvOut.writerow(["file", fileSizeForHumes] + orderedFileNames)
-
-    # write a row with each found file path
-    for f in filePile.files:
-      csvOut.writerow(["duplicate", f.getPath()])
-
-    # write a blank row for readability
-    csvOut.writerow([])
-
-progress.reportDone()
+stage = metrics.startStage("report")
+common.writeDuplicateFileReport(filesByHash, args.outFilePath, args.cross_catalog_only)
+stage.finish(len(filesByHash))
+metrics.write(args.metrics)
 print 'done'
@@ -21,7 +21,35 @@ in the rows are: <index> <sizeHumanReadableText> <similarity> <path>.
 index indicates which other "folder" or "file" rows are correlated.
 similarity is one of "same", "like", or "diff".
 
-Empty rows are added between duplicate folders for human readability.""")
+Empty rows are added between duplicate folders for human readability.
+
+Pairs are sorted by the size of the files they have in common, biggest
+first. --top and --min-size leave out the rest, which is faster than
+writing them all when only the first few hundred will be read.
+
+With --subtrees, only folders whose entire contents (all files and
+subfolders, all the way down) are identical are reported, and only the
+topmost copies: a row whose first field is "subtree" has the field
+<sizeHumanReadableText>, and is followed by one row per copy whose first
+field is "copy" and whose next field is <path>.
+
+Each folder is only reported with the folder most like it, so a folder
+copied five times doesn't show up five times over. With --clusters,
+folders are grouped instead: any two folders that would be paired join
+the same cluster, and so do the folders paired with those, and so on.
+A row whose first field is "cluster" has the fields <folderCount>
+<sizeHumanReadableText>, the size of the files found in more than one of
+the folders (counting each once). It's followed by one row per folder
+whose first field is "member", with the fields <sizeHumanReadableText>
+<sharedSizeHumanReadableText> <otherSizeHumanReadableText> <path>:
+the folder's size, then the size of its own files that are shared with
+other folders in the cluster and of those that aren't. Clusters are
+sorted by shared size. Since a cluster can be a chain, two of its folders
+can have little in common.
+
+Several hash files (say, one per backup drive) can be searched together
+with --label and --catalog. Paths are then written starting with the
+label of the drive they're on.""")
 
 argParser.add_argument('hashFilePath', 
   help='The path to the input file (which was generated by \'hashFolderContents.py\'')
@@ -29,380 +57,176 @@ argParser.add_argument('hashFilePath',
 argParser.add_argument('outFilePath', 
   help='The path to the output file to populate with detected duplicates')
 
-args = argParser.parse_args()
+argParser.add_argument('--subtrees', action='store_true',
+  help='Report folders whose whole contents are identical, instead of similar folders')
+
+argParser.add_argument('--ignore-names', action='store_true',
+  help='With --subtrees, treat folders as identical even if file and folder names differ')
+
+argParser.add_argument('--top', type=int, default=None, metavar='N',
+  help='Only report the N pairs of folders with the most in common')
+
+argParser.add_argument('--min-size', type=int, default=None, metavar='BYTES',
+  help='Only report pairs of folders with at least this many bytes of files in common')
+
+argParser.add_argument('--clusters', action='store_true',
+  help='Report groups of similar folders instead of pairs')
+
+argParser.add_argument('--candidates', choices=['exact', 'minhash'], default='exact',
+  help='How to pick folder pairs to compare: "exact" compares every pair of folders '
+       'sharing any file; "minhash" only compares pairs whose MinHash signatures '
+       'say they are likely similar, which is much faster on big catalogs but can '
+       'miss pairs that share only a small part of their files (default exact)')
+
+argParser.add_argument('--minhash-bands', type=int, default=32,
+  help='With --candidates minhash, how many bands to split signatures into. '
+       'More bands find more pairs (default 32)')
+
+argParser.add_argument('--minhash-rows', type=int, default=2,
+  help='With --candidates minhash, how many signature numbers per band. '
+       'More rows find fewer, more similar pairs (default 2)')
+
+argParser.add_argument('--ignore-common-hashes', type=int, default=None, metavar='COUNT',
+  help='Don\'t pair up folders because of files with more than COUNT copies '
+       '(like empty files or Thumbs.db). They still count toward similarity.')
 
-memRootDir = common.MemDirectory(name="", parentDir=None)
-filesByHash = {}
-progress = common.ProgressPrinter("\rReading record {0}...")
-with open(args.hashFilePath, "rb") as inFile:
-  csvIn = csv.reader(inFile, delimiter=' ', strict=True)
-  for row in csvIn:
-    # report progress once in a while
-    progress.report()
-
-    # parse line data
-    (fileHash, fileSize, fileSizeForHumes, filePath) = [row[0], row[1], row[2], row[3]]
-    fileSize = long(fileSize)
-    (drive, leadingSlashes, reversePathParts) = common.splitFilePath(filePath)
-    common.deduplicate(reversePathParts)
-
-    # build an in-memory tree of the filesystem
-    newFile = memRootDir.add(fileHash, fileSize, reversePathParts)
-
-    # associate all files by hash
-    if newFile.hash in filesByHash:
-      likeFiles = filesByHash[newFile.hash]
-    else:
-      likeFiles = []
-      filesByHash[newFile.hash] = likeFiles
-    likeFiles.append(newFile)
-
-    # sanity check for hash collisions
-    if not likeFiles[0].size == newFile.size:
-      raise ValueError('Files with same hash had different size!')
+argParser.add_argument('--streaming', action='store_true',
+  help='Keep only the folder tree in memory, not the files, by splitting the hash '
+       'file into partitions on disk and counting the files folders share one '
+       'partition at a time. Slower, but works for hash files with far more files '
+       'than fit in memory. The output is the same.')
 
+argParser.add_argument('--sort-memory', type=int, default=1000000, metavar='ROWS',
+  help='With --streaming, how many rows (or folder pairs) to hold in memory at a time '
+       '(default 1000000)')
+
+argParser.add_argument('--partitions', type=int, default=16,
+  help='With --streaming, how many partitions to split the files into (default 16)')
+
+argParser.add_argument('--jobs', type=int, default=1,
+  help='The number of processes to load the hash file and compare folders with (default 1). '
+       'The output is the same. Not available on Windows.')
+
+common.addCatalogArguments(argParser)
+common.addMetricsArgument(argParser)
+
+args = argParser.parse_args()
+catalogs = common.getCatalogs(args, argParser)
+if args.jobs > 1 and sys.platform == 'win32':
+  argParser.error("--jobs needs fork(), which Windows doesn't have")
+if args.streaming and (args.subtrees or args.candidates != 'exact' or args.jobs > 1):
+  argParser.error("--streaming can't be combined with --subtrees, --candidates minhash or --jobs")
+if args.clusters and (args.subtrees or args.streaming):
+  argParser.error("--clusters can't be combined with --subtrees or --streaming")
+if (args.top is not None or args.min_size is not None) and (args.subtrees or args.clusters):
+  argParser.error("--top and --min-size can't be combined with --subtrees or --clusters")
+metrics = common.Metrics()
+
+dirNamesToIgnore = common.DIR_NAMES_TO_IGNORE
+
+if args.streaming:
+  stage = metrics.startStage("streaming report")
+  common.streamSimilarFolderReport(catalogs, args.outFilePath, dirNamesToIgnore, args.sort_memory,
+                                   args.partitions, args.ignore_common_hashes, args.cross_catalog_only,
+                                   args.cache_dir, args.top, args.min_size)
+  stage.finish()
+  metrics.write(args.metrics)
+  print 'done'
+  sys.exit(0)
+
+# build an in-memory tree of the filesystem, and associate all files by hash
+filesByHash = common.HashIndex()
+progress = metrics.progress("load", "\rReading record {0}...")
+memRootDir = common.loadCatalogs(catalogs, filesByHash, progress, args.cache_dir, jobs=args.jobs)
 progress.reportDone()
 
-class LikeDirStat:
-  def __init__(self, aDir, bDir):
-    if aDir is bDir:
-      self.InitSingleDir(aDir)
-    else:
-      self.InitDifferentDirs(aDir, bDir)
-
-  def InitSingleDir(self, aDir):
-    # public fields
-    self.likeFileCount = 0
-    self.likeFileSize = 0
-    self.dirs = sorted([aDir, aDir])
-    self.dirs = (self.dirs[0], self.dirs[1])
-
-    # determine like file count and size
-    for aFileHash in aDir.filesByHash:
-      aFiles = aDir.filesByHash[aFileHash]
-      if len(aFiles) > 1:
-        self.likeFileCount += len(aFiles)
-        # size calculation assumes all files with same hash have the same size... 
-        # which is true until we want to survive hash collisions =)
-        self.likeFileSize += aFiles[0].size * len(aFiles)
-
-  def InitDifferentDirs(self, aDir, bDir):
-    # public fields
-    self.likeFileCount = 0
-    self.likeFileSize = 0
-    self.dirs = sorted([aDir, bDir])
-    self.dirs = (self.dirs[0], self.dirs[1])
-
-    # determine like file count and size
-    for bFileHash in bDir.filesByHash:
-      bFiles = bDir.filesByHash[bFileHash]
-      aFiles = aDir.filesByHash.get(bFileHash)
-      if aFiles is not None:
-        sharedFileCount = min(len(aFiles), len(bFiles))
-        self.likeFileCount += sharedFileCount
-        # size calculation assumes all files with same hash have the same size... 
-        # which is true until we want to survive hash collisions =)
-        self.likeFileSize += aFiles[0].size * sharedFileCount
-
-dirPairsToIgnore = {} # key = sorted list of [dir1, dir2], value = same (not used)
-bestStatsByDir = {} # key = dir, value = LikeDirStat
-
-progress = common.ProgressPrinter("\rProcessing folder {0}...")
-
-dirNamesToIgnore = { 
-  '.git': True, 
-  '.svn': True,
-  'dsbudget-source-archive': True
-  }
-
-def lookForDuplicateFolders(memDir):
-  # ignore anything in .git directories (or whatever directories I want to ignore)
-  if memDir.name in dirNamesToIgnore:
-    return
-
-  # recurse into child directories first
-  for dirName in memDir.dirs:
-    childDir = memDir.dirs[dirName]
-    lookForDuplicateFolders(childDir)
-
-  # report progress once in a while
-  progress.report()
-
-  # consider each file in this directory
-  for fileName in memDir.files:
-    file = memDir.files[fileName]
-
-    # consider all other identical files (across all directories)
-    likeFiles = filesByHash[file.hash]
-    for otherFile in likeFiles:
-      likeDir = otherFile.dir
-
-      # WACKY BUT EFFECTIVE!
-      # let directories be compared against themselves, to search for duplicate files within a single directory
-
-      # else, uncomment this block
-      # ignore other files in the original directory
-      #if otherFile.dir == memDir:
-      #  continue
-
-      # I'm pretty sure this never happens
-      if otherFile.dir is None:
-        raise ValueError('isn\'t the root directory the only thing with nil dir?')
-
-      # serious performance boost: don't compare directories that have already been compared
-      dirPair = sorted([memDir, likeDir])
-      dirPair = (dirPair[0], dirPair[1])
-      if dirPair in dirPairsToIgnore:
-        continue
-
-      # ok, after this point, don't compare these two directories again
-      dirPairsToIgnore[dirPair] = dirPair
-
-      # determine how similar the directories are
-      stat = LikeDirStat(memDir, likeDir)
-
-      # Reasonable matching limiter:
-      # only retain paired directories if the size of their matching files is
-      # at least 50% of either of their total file sizes
-      if stat.likeFileCount == 0:
-        continue
-      if (stat.likeFileSize < memDir.sizeImmediateFilesOnly / 2) and \
-         (stat.likeFileSize < likeDir.sizeImmediateFilesOnly / 2):
-        # then we ignore it forever
-        continue
-
-      # Serious noise limiter: (but also prevents me from seeing when a folder is duplicated 5 times)
-      # associate the directory pair with the directories only if the pair is more impressive
-      # than the previous directory pair associated the directories
-      bestMemDirStat = bestStatsByDir.get(memDir)
-      if (bestMemDirStat is None) or (bestMemDirStat.likeFileSize < stat.likeFileSize):
-        bestStatsByDir[memDir] = stat
-
-      bestStat = bestStatsByDir.get(likeDir)
-      if (bestStat is None) or (bestStat.likeFileSize < stat.likeFileSize):
-        bestStatsByDir[likeDir] = stat
+def isIgnored(memDir):
+  while memDir is not None:
+    if memDir.name in dirNamesToIgnore:
+      return True
+    memDir = memDir.dir
+  return False
+
+if args.subtrees:
+  print "Hashing folder contents..."
+  stage = metrics.startStage("hash folders")
+  subtreeHashes = common.computeSubtreeHashes(memRootDir, args.ignore_names)
+
+  # group identical folders in one pass
+  dirsBySubtreeHash = {}
+  for memDir in memRootDir.getAllDirs():
+    dirsBySubtreeHash.setdefault(subtreeHashes[memDir], []).append(memDir)
+
+  # only report the topmost copies: skip a group when it's just the same
+  # child of identical parents (each parent holding exactly one member)
+  groups = []
+  for subtreeHash in dirsBySubtreeHash:
+    group = dirsBySubtreeHash[subtreeHash]
+    if len(group) < 2:
+      continue
+    parentHashes = set(subtreeHashes[d.dir] for d in group)
+    parents = set(d.dir for d in group)
+    if len(parentHashes) == 1 and len(parents) == len(group) and \
+       len(dirsBySubtreeHash[parentHashes.pop()]) > 1:
+      continue
+    group = [d for d in group if not isIgnored(d)]
+    if len(group) < 2:
+      continue
+    if args.cross_catalog_only and len(set(common.getCatalogDir(d) for d in group)) < 2:
+      continue
+    group.sort(key=lambda d: d.getPath())
+    groups.append(group)
+
+  stage.finish(len(dirsBySubtreeHash))
+
+  print "Sorting identical folders..."
+  groups.sort(key=lambda g: (-g[0].size, g[0].getPath()))
+
+  progress = metrics.progress("report", "\rWriting identical folder data {0}...")
+  with open(args.outFilePath, "wb") as outFile:
+    csvOut = csv.writer(outFile, delimiter=' ', strict=True)
+    for group in groups:
+      progress.report()
+      csvOut.writerow(["subtree", common.getHumanReadableSize(group[0].size)])
+      for memDir in group:
+        csvOut.writerow(["copy", memDir.getPath()])
+      csvOut.writerow([])
+  progress.reportDone()
+  metrics.write(args.metrics)
+  print 'done'
+  sys.exit(0)
 
 # enumerate all folders looking for similar ones
-lookForDuplicateFolders(memRootDir)
-progress.reportDone()
+matcher = common.FolderMatcher(filesByHash, dirNamesToIgnore, args.ignore_common_hashes, args.cross_catalog_only,
+                               args.clusters)
+if args.candidates == 'minhash':
+  stage = metrics.startStage("score")
+  matcher.lookForDuplicateFoldersByMinHash(memRootDir, args.minhash_bands, args.minhash_rows, args.jobs)
+  stage.finish()
+else:
+  progress = metrics.progress("score", "\rProcessing folder {0}...")
+  if args.jobs > 1:
+    matcher.lookForDuplicateFoldersInParallel(memRootDir, progress, args.jobs)
+  else:
+    matcher.lookForDuplicateFolders(memRootDir, progress)
+  progress.reportDone()
+
+if args.clusters:
+  stage = metrics.startStage("report")
+  clusters = matcher.clusters.getClusters()
+  common.writeFolderClusterReport(clusters, args.outFilePath)
+  stage.finish(len(clusters))
+  metrics.write(args.metrics)
+  print 'done'
+  sys.exit(0)
 
 print "Sorting similar folders..."
-# get all unique folder pair stats
-allStats = {}
-for stat in bestStatsByDir.itervalues():
-  allStats[stat] = stat
-
-# sort by size, and since it matters to get predictable output, which matters for tests,
-# secondarily sort by paths too
-sortedStats = sorted(allStats, key=lambda s: (-s.likeFileSize, \
-                                              sorted([s.dirs[0].getPath(), s.dirs[1].getPath()])[0], \
-                                              sorted([s.dirs[0].getPath(), s.dirs[1].getPath()])[1]))
-
-progress = common.ProgressPrinter("\rWriting duplicate folder data {0}...")
-with open(args.outFilePath, "wb") as outFile:
-  csvOut = csv.writer(outFile, delimiter=' ', strict=True)
-  for stat in sortedStats:
-    #csvOut.writerow(["stat", "likesize", stat.likeFileSize]);
-    #csvOut.writerow(["stat", "likecount", stat.likeFileCount]);
-
-    # report progress once in a while
-    progress.report()
-
-    aDir = stat.dirs[0]
-    bDir = stat.dirs[1]
-
-    # write rows indicating the parent folder sizes and paths
-    if aDir is bDir:
-      csvOut.writerow(["parent", "compared against itself", common.getHumanReadableSize(aDir.size), aDir.getPath()])
-    else:
-      csvOut.writerow(["parent", "left", common.getHumanReadableSize(aDir.size), aDir.getPath()])
-      csvOut.writerow(["parent", "right", common.getHumanReadableSize(bDir.size), bDir.getPath()])
-
-    # plan the rows to write out
-    # (because we need to write summary rows first)
-    rows = []
-    summarySameFilesCount = 0
-    summarySameFilesSize = 0
-    summaryDifferentFilesCount = 0
-    summaryDifferentFilesSize = 0
-    summaryChangedFilesCount = 0
-    summaryChangedFilesSize = 0
-    summaryLeftOnlyFilesCount = 0
-    summaryLeftOnlyFilesSize = 0
-    summaryRightOnlyFilesCount = 0
-    summaryRightOnlyFilesSize = 0
-
-    if aDir is bDir:
-      # write rows indicating duplicated files
-      hashesDuplicated = set([aHash for aHash in aDir.filesByHash if len(aDir.filesByHash[aHash]) > 1])
-      # order the rows by size
-      for h in sorted(hashesDuplicated, key=lambda h: -aDir.filesByHash[h][0].size):
-        aFiles = aDir.filesByHash[h]
-        
-        summarySameFilesSize += aFiles[0].size * len(aFiles)
-        summarySameFilesCount += len(aFiles)
-
-        # write as multiple rows
-        size = aFiles[0].size
-        rows.append(["files", "same", common.getHumanReadableSize(size * len(aFiles))])
-
-        # write rows sorted by file name
-        aNames = set([f.name for f in aFiles])
-        for n in sorted(aNames):
-          rows.append(["  ", "file", common.getHumanReadableSize(size), n])
-
-      # write all other files, sorted by size
-      hashesNotDuplicated = set([aHash for aHash in aDir.filesByHash if len(aDir.filesByHash[aHash]) == 1])
-      if len(hashesNotDuplicated) > 0:
-        myRows = []
-        mySize = 0
-        for h in sorted(hashesNotDuplicated, key=lambda h: -aDir.filesByHash[h][0].size):
-          aFile = aDir.filesByHash[h][0]
-
-          mySize += aFile.size
-          summaryDifferentFilesSize += aFile.size
-          summaryDifferentFilesCount += 1
-
-          myRows.append(["  ", "file", common.getHumanReadableSize(aFile.size), aFile.name])
-
-        rows.append(["files", "different", common.getHumanReadableSize(mySize)])
-        for r in myRows:
-          rows.append(r)
-
-    else: # aDir != bDir
-
-      # write rows indicating duplicated files (whether the file appears on both sides or just 1 side)
-      hashesOnBothSides = set().intersection(aDir.filesByHash, bDir.filesByHash)
-      hashesDuplicatedOnSingleSide = set() \
-          .union([aHash for aHash in aDir.filesByHash if len(aDir.filesByHash[aHash]) > 1], \
-                 [bHash for bHash in bDir.filesByHash if len(bDir.filesByHash[bHash]) > 1])
-      hashesDuplicated = hashesOnBothSides.union(hashesDuplicatedOnSingleSide)
-      # order the rows by size
-      for h in sorted(hashesDuplicated, key=lambda h: -aDir.filesByHash.get(h, bDir.filesByHash.get(h))[0].size):
-        aFiles = aDir.filesByHash.get(h, [])
-        bFiles = bDir.filesByHash.get(h, [])
-
-        if len(aFiles) > 0:
-          summarySameFilesSize += aFiles[0].size * len(aFiles)
-          summarySameFilesCount += len(aFiles)
-        if len(bFiles) > 0:
-          summarySameFilesSize += bFiles[0].size * len(bFiles)
-          summarySameFilesCount += len(bFiles)
-
-        # if possible, write as 1 row
-        #if len(aFiles) == 1 and len(bFiles) == 1 and aFiles[0].name == bFiles[0].name:
-        #  rows.append(["files", "same", common.getHumanReadableSize(aFiles[0].size), aFiles[0].name])
-        #  continue
-
-        # else, write as multiple rows
-        count = 0
-        if len(aFiles) > 0:
-          size = aFiles[0].size
-          count += len(aFiles)
-        if len(bFiles) > 0:
-          size = bFiles[0].size
-          count += len(bFiles)
-        rows.append(["files", "same", common.getHumanReadableSize(size * count)])
-
-        # write rows sorted by file name
-        aNames = set([f.name for f in aFiles])
-        bNames = set([f.name for f in bFiles])
-        for n in sorted(set().union(aNames).union(bNames)):
-          presence = "both" if (n in aNames and n in bNames) else ("left" if n in aNames else "right")
-          rows.append(["  ", presence, common.getHumanReadableSize(size), n])
-
-      # get hashes indicating non-duplicated files
-      aOnlyHashes = set(aDir.filesByHash).difference(hashesDuplicated)
-      aOnlyHashesByName = {aDir.filesByHash[h][0].name: h for h in aOnlyHashes}
-      #aOnlyHashesSorted = sorted(aOnlyHashes, key=lambda h: (-aDir.filesByHash[h][0].size, aDir.filesByHash[h][0].name))
-
-      bOnlyHashes = set(bDir.filesByHash).difference(hashesDuplicated)
-      bOnlyHashesByName = {bDir.filesByHash[h][0].name: h for h in bOnlyHashes}
-      #bOnlyHashesSorted = sorted(bOnlyHashes, key=lambda h: (-bDir.filesByHash[h][0].size, bDir.filesByHash[h][0].name))
-
-      # get hashes of non-duplicated files on opposite sides with the same name
-      sharedNameFilePairs = {}
-      sharedNameHashes = set()
-      for n in aOnlyHashesByName:
-        aHash = aOnlyHashesByName[n]
-        if n in bOnlyHashesByName:
-          bHash = bOnlyHashesByName[n]
-          sharedNameFilePairs[n] = (aDir.filesByHash[aHash][0], bDir.filesByHash[bHash][0])
-          sharedNameHashes.add(aHash)
-          sharedNameHashes.add(bHash)
-
-      # write all "same name, different contents" files, sorted by size (then by name for maximally sorted output)
-      aSharedNameRows = []
-      aSharedNameSize = 0
-      aSharedNameCount = 0;
-      for name in sorted(sharedNameFilePairs, \
-                         key=lambda n: ( -max(sharedNameFilePairs[n][0].size, sharedNameFilePairs[n][1].size), n )):
-        files = sharedNameFilePairs[name]
-        aSharedNameRows.append(["  ", "left", common.getHumanReadableSize(files[0].size), files[0].name])
-        aSharedNameRows.append(["  ", "right", common.getHumanReadableSize(files[1].size), files[1].name])
-        aSharedNameSize += files[0].size + files[1].size
-        aSharedNameCount += 2
-
-      summaryChangedFilesSize += aSharedNameSize
-      summaryChangedFilesCount += aSharedNameCount
-
-      if len(aSharedNameRows) > 0:
-        rows.append(["files", "changed", common.getHumanReadableSize(summaryChangedFilesSize)])
-        for r in aSharedNameRows:
-          rows.append(r)
-
-      # write all "different names, different contents" files, sorted first by side then by size
-      aOtherRows = []
-      bOtherRows = []
-      aOnlySummarySize = 0
-      aOnlySummaryCount = 0
-      bOnlySummarySize = 0
-      bOnlySummaryCount = 0
-      for h in sorted(aOnlyHashes.difference(sharedNameHashes), \
-                      key=lambda h: ( -aDir.filesByHash[h][0].size, aDir.filesByHash[h][0].name)):
-        f = aDir.filesByHash[h][0]
-        aOtherRows.append(["  ", "left", common.getHumanReadableSize(f.size), f.name])
-        aOnlySummarySize += f.size
-        aOnlySummaryCount += 1
-      for h in sorted(bOnlyHashes.difference(sharedNameHashes), \
-                      key=lambda h: ( -bDir.filesByHash[h][0].size, bDir.filesByHash[h][0].name)):
-        f = bDir.filesByHash[h][0]
-        bOtherRows.append(["  ", "right", common.getHumanReadableSize(f.size), f.name])
-        bOnlySummarySize += f.size
-        bOnlySummaryCount += 1
-
-      if len(aOtherRows) > 0:
-        rows.append(["files", "left-only", common.getHumanReadableSize(aOnlySummarySize)])
-        for r in aOtherRows:
-          rows.append(r)
-      if len(bOtherRows) > 0:
-        rows.append(["files", "right-only", common.getHumanReadableSize(bOnlySummarySize)])
-        for r in bOtherRows:
-          rows.append(r)
-
-      summaryLeftOnlyFilesSize += aOnlySummarySize
-      summaryLeftOnlyFilesCount += aOnlySummaryCount
-      summaryRightOnlyFilesSize += bOnlySummarySize
-      summaryRightOnlyFilesCount += bOnlySummaryCount
-
-    # write the summary rows
-    if summarySameFilesCount > 0:
-      csvOut.writerow(["summary", "same", "files", common.getHumanReadableSize(summarySameFilesSize)])
-    if summaryDifferentFilesCount > 0:
-      csvOut.writerow(["summary", "different", "files", common.getHumanReadableSize(summaryDifferentFilesSize)])
-    if summaryChangedFilesCount > 0:
-      csvOut.writerow(["summary", "changed", "files", common.getHumanReadableSize(summaryChangedFilesSize)])
-    if summaryLeftOnlyFilesCount > 0:
-      csvOut.writerow(["summary", "left-only", "files", common.getHumanReadableSize(summaryLeftOnlyFilesSize)])
-    if summaryRightOnlyFilesCount > 0:
-      csvOut.writerow(["summary", "right-only", "files", common.getHumanReadableSize(summaryRightOnlyFilesSize)])
-
-    # write the detail rows
-    for r in rows:
-      csvOut.writerow(r)
-
-    # write a blank row for readability
-    csvOut.writerow([])
-
-progress.reportDone()
+stage = metrics.startStage("sort")
+sortedStats = matcher.getSortedStats(args.top, args.min_size)
+stage.finish(len(sortedStats))
+
+stage = metrics.startStage("report")
+common.writeSimilarFolderReport(sortedStats, args.outFilePath)
+stage.finish(len(sortedStats))
+metrics.write(args.metrics)
 print 'done'
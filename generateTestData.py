@@ -0,0 +1,87 @@
+import sys
+import os
+import argparse
+import nateBackupToolsCommon as common
+
+# see https://docs.python.org/dev/library/argparse.html
+argParser = argparse.ArgumentParser(description=
+"""Makes up a folder tree that looks like years of backups: folders of
+files, some files copied to other folders, and whole folders copied
+(with some files in the copies edited or deleted since). The same seed
+always makes the same tree.
+
+By default it writes a hash file, like \'hashFolderContents.py\' would
+for such a tree, without creating any files. With --tree, it creates
+the files on disk instead, under outPath.""")
+
+argParser.add_argument('outPath',
+  help='The path to the hash file to write, or with --tree, the directory to create files in')
+
+argParser.add_argument('--tree', action='store_true',
+  help='Create the files on disk instead of writing a hash file')
+
+argParser.add_argument('--format', choices=['csv', 'binary', 'sqlite'], default='csv',
+  help='The kind of hash file to write (default csv)')
+
+argParser.add_argument('--files', type=int, default=10000,
+  help='How many files to make (default 10000)')
+
+argParser.add_argument('--depth', type=int, default=8,
+  help='How deep folders can be nested (default 8)')
+
+argParser.add_argument('--files-per-dir', type=int, default=10,
+  help='The average number of files in a new folder (default 10)')
+
+argParser.add_argument('--median-size', type=int, default=65536,
+  help='The median file size in bytes (default 65536)')
+
+argParser.add_argument('--size-spread', type=float, default=2.0,
+  help='How spread out file sizes are: the sigma of their log-normal distribution (default 2.0)')
+
+argParser.add_argument('--max-size', type=int, default=None,
+  help='The biggest a file can be, in bytes (default no limit)')
+
+argParser.add_argument('--folder-copy-ratio', type=float, default=0.3,
+  help='The chance that a new folder is a copy of an earlier one (default 0.3)')
+
+argParser.add_argument('--file-copy-ratio', type=float, default=0.1,
+  help='The chance that a file in a new folder is a copy of an earlier file (default 0.1)')
+
+argParser.add_argument('--edit-ratio', type=float, default=0.1,
+  help='The chance that a file in a copied folder was edited or deleted (default 0.1)')
+
+argParser.add_argument('--seed', type=int, default=0,
+  help='The random seed (default 0)')
+
+args = argParser.parse_args()
+
+files = common.generateSyntheticFiles(args.files, args.depth, args.files_per_dir, args.median_size,
+                                      args.size_spread, args.max_size, args.folder_copy_ratio,
+                                      args.file_copy_ratio, args.edit_ratio, args.seed)
+
+if args.tree:
+  progress = common.ProgressPrinter("\rCreating file {0}...")
+  for (filePath, contentId, fileSize) in files:
+    progress.report()
+    fullPath = os.path.join(args.outPath, *filePath.split("/"))
+    dirPath = os.path.dirname(fullPath)
+    if not os.path.isdir(dirPath):
+      os.makedirs(dirPath)
+    with open(fullPath, "wb") as outFile:
+      outFile.write(common.getSyntheticContents(contentId, fileSize, args.seed))
+  progress.reportDone()
+else:
+  if args.format == 'sqlite':
+    writer = common.SqliteCatalogWriter(args.outPath)
+  elif args.format == 'binary':
+    writer = common.BinaryCatalogWriter(args.outPath)
+  else:
+    writer = common.CsvHashFileWriter(args.outPath)
+  progress = common.ProgressPrinter("\rWriting record {0}...")
+  for (filePath, contentId, fileSize) in files:
+    progress.report()
+    # made-up modification times too, so rows are as long as real ones
+    writer.writeRecord(common.getSyntheticHash(contentId, args.seed), fileSize, filePath, 1500000000.0 + contentId)
+  writer.close()
+  progress.reportDone()
+print 'done'
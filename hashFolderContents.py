@@ -2,49 +2,291 @@ import sys
 import os
 import argparse
 import nateBackupToolsCommon as common
-import csv
 import datetime
+import itertools
+import json
+import binascii
 
 # see https://docs.python.org/dev/library/argparse.html
 argParser = argparse.ArgumentParser(description=
 """Reads all files in a directory and its subdirectories.
 It records file paths/sizes/MD5 hashes and writes them to an output file.
 The output file format is csv with space as the delimiter for the following
-fields: <hash> <sizeNumber> <sizeHumanReadableText> <path>""")
+fields: <hash> <sizeNumber> <sizeHumanReadableText> <path> <mtime> [<hash> ...]
+(mtime is the file's modification time in seconds, which lets a later scan
+with --previous skip files that haven't changed)
+
+MD5 hashes are written as plain hex digits. Hashes made by other algorithms
+are written as <algorithm>:<hex digits>. Any hashes after mtime were
+requested with --also-hash.
+
+With --format, the same records can instead be written as a binary catalog
+(see 'convertHashFile.py') or a SQLite database indexed by hash, size and
+folder (see 'queryCatalog.py'). All the scripts can read any of them.
+
+With --resume, an interrupted scan can be started again with the same
+command, and it picks up where it left off.""")
 
 argParser.add_argument('dirToScan', help='The directory to scan')
 
 argParser.add_argument('outFilePath', 
   help='The path to the output file to populate with MD5 hashes')
 
+argParser.add_argument('--jobs', type=int, default=1,
+  help='The number of files to hash at the same time (default 1). '
+       'Rows are still written in the same order as with 1 job.')
+
+argParser.add_argument('--previous', metavar='HASH_FILE_PATH',
+  help='The path to an output file from an earlier scan of the same directory. '
+       'Files whose path, size and modification time match a row in it '
+       'are not read again; the earlier hash is reused.')
+
+argParser.add_argument('--algorithm', default='md5', choices=common.HASH_ALGORITHMS,
+  help='The hash algorithm to record (default md5)')
+
+argParser.add_argument('--also-hash', metavar='ALGORITHM', action='append', default=[],
+  choices=common.HASH_ALGORITHMS,
+  help='Another hash algorithm to compute in the same pass over each file, '
+       'written after mtime. Can be given more than once.')
+
+argParser.add_argument('--read-size', type=int, default=common.DEFAULT_READ_SIZE,
+  help='How many bytes to read at a time while hashing (default %d)' % common.DEFAULT_READ_SIZE)
+
+argParser.add_argument('--mmap-threshold', type=int, default=None, metavar='BYTES',
+  help='Memory map files at least this big instead of reading them')
+
+argParser.add_argument('--schedule', choices=['walk', 'device'], default='walk',
+  help='The order to read files in. "walk" reads them in the order they\'re found. '
+       '"device" lists every file first, then reads each disk (device) at the same '
+       'time, reading each disk\'s files in inode order, which is usually close to '
+       'their order on disk. That cuts down on seeking for spinning disks. '
+       'Rows are still written in the same order either way. (default walk)')
+
+argParser.add_argument('--exclude', metavar='PATTERN', action='append', default=[],
+  help='Skip files and folders whose name matches this pattern (like *.tmp or .git), '
+       'or whose path relative to dirToScan does, if the pattern has a /. '
+       'Excluded folders aren\'t read at all. Can be given more than once.')
+
+argParser.add_argument('--include', metavar='PATTERN', action='append', default=[],
+  help='Only hash files whose name (or relative path, as for --exclude) matches '
+       'this pattern. Can be given more than once.')
+
+argParser.add_argument('--format', choices=['csv', 'binary', 'sqlite'], default='csv',
+  help='The kind of output file to write (default csv)')
+
+argParser.add_argument('--resume', action='store_true',
+  help='If the output file is from an interrupted scan, keep its rows and only '
+       'hash the files it doesn\'t have yet. While scanning, rows are also saved '
+       'to disk every few seconds (see --checkpoint-seconds), so an interrupted '
+       'scan loses very little work.')
+
+argParser.add_argument('--checkpoint-seconds', type=float, default=5,
+  help='With --resume, how often to make sure rows are saved to disk (default 5)')
+
+common.addMetricsArgument(argParser)
+
 args = argParser.parse_args()
+metrics = common.Metrics()
+
+if args.previous is not None and len(args.also_hash) > 0:
+  argParser.error("--previous can't be combined with --also-hash")
+if args.format == 'binary' and len(args.also_hash) > 0:
+  argParser.error("binary catalogs can't hold --also-hash hashes")
+if args.schedule == 'device' and (args.jobs > 1 or args.mmap_threshold is not None):
+  argParser.error("--schedule device can't be combined with --jobs or --mmap-threshold")
+if args.resume and args.format != 'csv':
+  argParser.error("--resume only works with csv output")
+
+# with several files in flight, the whole line for a file is shown when it's done
+showLineWhenDone = args.jobs > 1 or args.schedule == 'device'
+
+algorithms = [args.algorithm] + args.also_hash
+for algorithm in algorithms:
+  # blake2b is only there with some Pythons, so find out now rather than in the middle of the scan
+  try:
+    common.newHasher(algorithm)
+  except ValueError as e:
+    argParser.error(str(e))
+
+# key = path, value = (hash, size, mtime) from the earlier scan
+previousRows = {}
+if args.previous is not None:
+  progress = metrics.progress("load previous", "\rReading previous record {0}...")
+  for (fileHash, fileSize, filePath, mtime) in common.readHashFile(args.previous):
+    progress.report()
+    # rows without an mtime can't prove the file is unchanged
+    if mtime is not None and common.getHashAlgorithm(fileHash) == args.algorithm:
+      previousRows[filePath] = (fileHash, fileSize, mtime)
+  progress.reportDone()
 
-# write binary because CSV writer requires that
-with open(args.outFilePath, "wb") as outFile:
-  csvOut = csv.writer(outFile, delimiter=' ', strict=True)
+# the checkpoint file says what an interrupted scan was doing,
+# so a resumed one can make sure it's doing the same thing.
+# paths are stored as hex, since JSON can't hold names that aren't UTF-8
+checkpointPath = args.outFilePath + ".checkpoint"
+checkpoint = {
+  'dirToScan': binascii.hexlify(os.path.abspath(args.dirToScan)),
+  'algorithms': algorithms,
+  'include': [binascii.hexlify(pattern) for pattern in args.include],
+  'exclude': [binascii.hexlify(pattern) for pattern in args.exclude],
+  }
 
-  # inspect every file in the directory to scan
-  for (dirPath, dirNames, fileNames) in os.walk(args.dirToScan):
-    for fileName in fileNames:
-      # get file size
-      filePath = os.path.join(dirPath, fileName)
-      fileSize = os.path.getsize(filePath)
-      fileSizeForHumes = common.getHumanReadableSize(fileSize)
+# key = path of the first link of a hard linked file, value = its hashes
+linkedFileHashes = {}
 
-      # show which file is being hashed
-      sys.stdout.write("reading " + filePath + ", " + fileSizeForHumes)
+# key = path, value = hashes from the interrupted scan being resumed
+resumedRows = {}
+if args.resume and os.path.exists(args.outFilePath):
+  if os.path.exists(checkpointPath):
+    with open(checkpointPath, "rb") as checkpointFile:
+      previousCheckpoint = json.load(checkpointFile)
+    for key in checkpoint:
+      if previousCheckpoint.get(key) != checkpoint[key]:
+        sys.exit("can't resume: the interrupted scan used a different " + key)
+
+  # anything after the last complete row didn't make it to disk, so drop it
+  (rows, goodLength) = common.recoverCsvHashFile(args.outFilePath)
+  for (filePath, fileHashes) in rows:
+    if common.getHashAlgorithm(fileHashes[0]) != args.algorithm:
+      sys.exit("can't resume: " + args.outFilePath + " has hashes made by a different algorithm")
+    resumedRows[filePath] = fileHashes
+  with open(args.outFilePath, "r+b") as outFile:
+    outFile.truncate(goodLength)
+  print "Kept %d rows already in %s" % (len(rows), args.outFilePath)
+  rows = None
+
+def writeCheckpoint():
+  writer.sync()
+  # write a new file then swap it in, so there's always a whole checkpoint file
+  with open(checkpointPath + ".new", "wb") as checkpointFile:
+    json.dump(checkpoint, checkpointFile)
+    checkpointFile.flush()
+    os.fsync(checkpointFile.fileno())
+  if os.path.exists(checkpointPath):
+    os.remove(checkpointPath)
+  os.rename(checkpointPath + ".new", checkpointPath)
+
+def getAction(previousHash, sameFileAs):
+  if sameFileAs is not None:
+    return "linked "
+  return "reusing " if previousHash is not None else "reading "
+
+def enumerateFiles():
+  # key = (st_dev, st_ino) of a hard linked file, value = path of its first link
+  firstLinks = {}
+
+  for (filePath, fileStat) in common.walkFiles(args.dirToScan, args.exclude, args.include):
+    # get file size and modification time
+    fileSize = fileStat.st_size
+    fileSizeForHumes = common.getHumanReadableSize(fileSize)
+
+    # other links to an already found file get the same hashes without reading it again
+    sameFileAs = None
+    if common.isHardLinked(fileStat):
+      sameFileAs = firstLinks.setdefault((fileStat.st_dev, fileStat.st_ino), filePath)
+      if sameFileAs == filePath:
+        sameFileAs = None
+
+    # skip files the interrupted scan already did
+    resumedHashes = resumedRows.get(filePath)
+    if resumedHashes is not None:
+      if sameFileAs is None and common.isHardLinked(fileStat):
+        linkedFileHashes[filePath] = resumedHashes
+      continue
+
+    # reuse the earlier hash if the file looks unchanged
+    previousHash = None
+    previousRow = previousRows.get(filePath)
+    if sameFileAs is None and previousRow is not None and \
+       previousRow[1] == fileSize and previousRow[2] == fileStat.st_mtime:
+      previousHash = previousRow[0]
+
+    # show which file is being hashed
+    if not showLineWhenDone:
+      sys.stdout.write(getAction(previousHash, sameFileAs) + filePath + ", " + fileSizeForHumes)
       sys.stdout.flush()
 
-      # get the file hash
-      startTime = datetime.datetime.now()
-      fileHash = common.getFileHash(filePath)
-      endTime = datetime.datetime.now()
+    yield (filePath, fileSize, fileSizeForHumes, fileStat.st_mtime, previousHash, fileStat, sameFileAs)
+
+def hashFile(fileInfo):
+  if fileInfo[6] is not None:
+    # the hashes are filled in from the first link when it's written
+    return (fileInfo, None, datetime.timedelta())
+  if fileInfo[4] is not None:
+    return (fileInfo, [fileInfo[4]], datetime.timedelta())
+
+  # get the file hashes
+  startTime = datetime.datetime.now()
+  fileHashes = common.getFileHashes(fileInfo[0], algorithms, args.read_size, args.mmap_threshold)
+  endTime = datetime.datetime.now()
+  return (fileInfo, fileHashes, endTime - startTime)
+
+def hashFilesByDevice():
+  # list every file up front, so they can be read in whatever order suits the disks
+  progress = metrics.progress("walk", "\rFinding file {0}...")
+  fileInfos = []
+  for fileInfo in enumerateFiles():
+    progress.report()
+    fileInfos.append(fileInfo)
+  progress.reportDone()
+
+  toHash = [(i[0], i[5]) if i[4] is None and i[6] is None else None for i in fileInfos]
+  for (fileInfo, result) in itertools.izip(fileInfos, common.hashFilesByDevice(toHash, algorithms, args.read_size)):
+    if result is None:
+      yield hashFile(fileInfo)
+    else:
+      yield (fileInfo,) + result
+
+if args.schedule == 'device':
+  hashedFiles = hashFilesByDevice()
+else:
+  hashedFiles = common.imapOrdered(hashFile, enumerateFiles(), args.jobs)
+
+if args.format == 'sqlite':
+  writer = common.SqliteCatalogWriter(args.outFilePath)
+elif args.format == 'binary':
+  writer = common.BinaryCatalogWriter(args.outFilePath)
+else:
+  writer = common.CsvHashFileWriter(args.outFilePath, "ab" if len(resumedRows) > 0 else "wb")
+
+# a checkpoint goes down before anything else, so even a scan stopped
+# right away can't be resumed with different options
+if args.resume:
+  writeCheckpoint()
+
+# inspect every file in the directory to scan
+lastCheckpointTime = datetime.datetime.now()
+stage = metrics.startStage("hash")
+fileCount = 0
+bytesRead = 0
+try:
+  for ((filePath, fileSize, fileSizeForHumes, mtime, previousHash, fileStat, sameFileAs), fileHashes, elapsed) in hashedFiles:
+    if sameFileAs is not None:
+      fileHashes = linkedFileHashes[sameFileAs]
+    elif common.isHardLinked(fileStat):
+      linkedFileHashes[filePath] = fileHashes
+    fileCount += 1
+    if sameFileAs is None and previousHash is None:
+      bytesRead += fileSize
+
+    # report the file hash
+    writer.writeRecord(fileHashes[0], fileSize, filePath, mtime, fileHashes[1:])
+
+    # report how long it took
+    if showLineWhenDone:
+      sys.stdout.write(getAction(previousHash, sameFileAs) + filePath + ", " + fileSizeForHumes)
+    totalSeconds = int(elapsed.total_seconds())
+    (hours, remainder) = divmod(totalSeconds, 3600)
+    (minutes, seconds) = divmod(remainder, 60)
+    sys.stdout.write(", %sh:%sm:%ss\n" % (hours, minutes, seconds))
 
-      # report the file hash
-      csvOut.writerow([fileHash, fileSize, fileSizeForHumes, filePath])
+    if args.resume and (datetime.datetime.now() - lastCheckpointTime).total_seconds() >= args.checkpoint_seconds:
+      writeCheckpoint()
+      lastCheckpointTime = datetime.datetime.now()
+finally:
+  writer.close()
+  stage.finish(fileCount, bytesRead)
+  metrics.write(args.metrics)
 
-      # report how long it took
-      totalSeconds = int((endTime - startTime).total_seconds())
-      (hours, remainder) = divmod(totalSeconds, 3600)
-      (minutes, seconds) = divmod(remainder, 60)
-      sys.stdout.write(", %sh:%sm:%ss\n" % (hours, minutes, seconds))
+# the scan finished, so there's nothing to resume
+if os.path.exists(checkpointPath):
+  os.remove(checkpointPath)
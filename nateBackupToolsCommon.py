@@ -3,16 +3,747 @@ import sys
 import os
 import ntpath
 import hashlib
+import io
+import mmap
 import re
+import csv
+import struct
+import binascii
 import datetime
 import argparse
+import collections
+import heapq
+import shutil
+import tempfile
+import threading
+import Queue
+import stat
+import fnmatch
+import random
+import math
+import itertools
+import time
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+try:
+  import sqlite3
+except ImportError:
+  # some Python builds leave it out. only SQLite catalogs need it
+  sqlite3 = None
+try:
+  from os import scandir # Python 3.5+
+except ImportError:
+  try:
+    from scandir import scandir # pip install scandir
+  except ImportError:
+    scandir = None
+try:
+  import resource
+except ImportError:
+  # not on Windows. only the peak memory in --metrics needs it
+  resource = None
+try:
+  import ctypes
+  import ctypes.util
+except ImportError:
+  # only adviseSequential() needs it
+  ctypes = None
 
-def getFileHash(filePath):
+# hash algorithms that hashFolderContents.py can record
+HASH_ALGORITHMS = ['md5', 'sha1', 'sha256', 'blake2b']
+
+# how many bytes to read at a time while hashing a file
+DEFAULT_READ_SIZE = 1024 * 1024
+
+# the hash of a file with no contents
+EMPTY_FILE_HASH = hashlib.md5().hexdigest()
+
+def newHasher(algorithm):
+  if algorithm not in HASH_ALGORITHMS:
+    raise ValueError('unsupported hash algorithm: ' + algorithm)
+  if algorithm == 'blake2b' and not hasattr(hashlib, 'blake2b'):
+    # hashlib only has blake2b since python 3.6
+    try:
+      import pyblake2
+    except ImportError:
+      raise ValueError('blake2b hashing needs python 3.6+ or the pyblake2 package')
+    return pyblake2.blake2b()
+  return hashlib.new(algorithm)
+
+def formatHash(algorithm, hexDigest):
+  # md5 hashes are written bare, like they always were. other algorithms are
+  # written as "<algorithm>:<hex digest>" so they can't be mistaken for md5.
+  if algorithm == 'md5':
+    return hexDigest
+  return algorithm + ':' + hexDigest
+
+def getHashAlgorithm(fileHash):
+  # the opposite of formatHash()
+  colon = fileHash.find(':')
+  if colon < 0:
+    return 'md5'
+  return fileHash[:colon]
+
+try:
+  # python 2 mmap objects only support the old buffer interface
+  sliceWithoutCopying = buffer
+except NameError:
+  def sliceWithoutCopying(data, offset, size):
+    return memoryview(data)[offset:offset + size]
+
+def getFileHashes(filePath, algorithms, readSize=DEFAULT_READ_SIZE, mmapThreshold=None):
+  # computes several hashes of a file while reading it only once.
+  # returns a list of hashes formatted by formatHash(), in the same order as algorithms.
+  # files at least mmapThreshold bytes long are memory mapped instead of read.
+  hashers = [newHasher(a) for a in algorithms]
+  with io.open(filePath, "rb", buffering=0) as f:
+    fileSize = os.fstat(f.fileno()).st_size
+    if mmapThreshold is not None and fileSize >= mmapThreshold and fileSize > 0:
+      mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        for offset in xrange(0, len(mapped), readSize):
+          chunk = sliceWithoutCopying(mapped, offset, readSize)
+          for hasher in hashers:
+            hasher.update(chunk)
+      finally:
+        mapped.close()
+    else:
+      # read into one reused buffer rather than allocating a string per read
+      buf = bytearray(readSize)
+      view = memoryview(buf)
+      while True:
+        count = f.readinto(buf)
+        if not count:
+          break
+        chunk = view[:count]
+        for hasher in hashers:
+          hasher.update(chunk)
+  return [formatHash(a, h.hexdigest()) for (a, h) in zip(algorithms, hashers)]
+
+def getFileHash(filePath, algorithm='md5', readSize=DEFAULT_READ_SIZE, mmapThreshold=None):
+  return getFileHashes(filePath, [algorithm], readSize, mmapThreshold)[0]
+
+def getPartialFileHash(filePath, fileSize, sampleSize=65536):
+  # hashes the first and last sampleSize bytes of a file, which is a cheap way
+  # to tell apart most same-sized files without reading all of them.
+  # returns (hash, isWholeFile); small files are read completely, in which
+  # case the hash is the same as getFileHash() would return.
+  if fileSize <= sampleSize * 2:
+    return (getFileHash(filePath), True)
   hasher = hashlib.md5()
   with open(filePath, "rb") as f:
-    for chunk in iter(lambda: f.read(4096), b""):
-      hasher.update(chunk)
-    return hasher.hexdigest()
+    hasher.update(f.read(sampleSize))
+    f.seek(-sampleSize, os.SEEK_END)
+    hasher.update(f.read(sampleSize))
+  return (hasher.hexdigest(), False)
+
+def imapOrdered(func, items, jobs, maxPending=None, useProcesses=False):
+  # like itertools.imap, but runs func on a pool of worker threads.
+  # results come back in the same order as items, and only a few items
+  # are read ahead of the caller so huge iterables don't pile up in memory.
+  # threads are enough because file reads and hashlib both release the GIL.
+  # for work that holds the GIL, useProcesses runs func in worker processes,
+  # in which case func must be a module-level function
+  if jobs <= 1:
+    for item in items:
+      yield func(item)
+    return
+
+  if maxPending is None:
+    maxPending = jobs * 4
+  pool = multiprocessing.Pool(jobs) if useProcesses else ThreadPool(jobs)
+  try:
+    pending = collections.deque()
+    for item in items:
+      pending.append(pool.apply_async(func, (item,)))
+      if len(pending) >= maxPending:
+        yield pending.popleft().get()
+    while len(pending) > 0:
+      yield pending.popleft().get()
+  finally:
+    pool.terminate()
+    pool.join()
+
+def matchesAnyPattern(name, relativePath, patterns):
+  # patterns are fnmatch patterns, matched against the name, or against the
+  # path relative to the top of the walk (with forward slashes) if they have a slash
+  for pattern in patterns:
+    if fnmatch.fnmatch(relativePath if '/' in pattern else name, pattern):
+      return True
+  return False
+
+def listDirEntries(dirPath):
+  # returns [(name, isDir, isSymlink, fileStat or None)] like scandir, where the
+  # stat (which follows symlinks) is only there for files
+  if scandir is not None:
+    entries = []
+    for entry in scandir(dirPath):
+      if entry.is_dir():
+        entries.append((entry.name, True, entry.is_symlink(), None))
+      else:
+        # on Windows this stat came with the listing. elsewhere it's the only stat needed
+        try:
+          entries.append((entry.name, False, False, entry.stat()))
+        except OSError:
+          # a broken link, or a file deleted since the listing. like below, walkFiles()
+          # stats it again, rather than losing the whole directory
+          entries.append((entry.name, False, False, None))
+    return entries
+
+  entries = []
+  for name in os.listdir(dirPath):
+    entryPath = os.path.join(dirPath, name)
+    try:
+      entryStat = os.stat(entryPath)
+    except OSError:
+      # a broken link, which os.walk() lists as a file
+      entries.append((name, False, False, None))
+      continue
+    if stat.S_ISDIR(entryStat.st_mode):
+      entries.append((name, True, os.path.islink(entryPath), None))
+    else:
+      entries.append((name, False, False, entryStat))
+  return entries
+
+def walkFiles(dirToScan, excludes=[], includes=[]):
+  # yields (filePath, fileStat) for every file under dirToScan, in the same order
+  # as os.walk() and with the same paths, but without its extra stat call per file.
+  # like os.walk(), symlinks to files are followed and symlinks to directories aren't,
+  # and directories that can't be listed are skipped.
+  # files and directories matching any of the excludes patterns are skipped (so
+  # nothing under an excluded directory is even listed), and if there are includes
+  # patterns, only files matching one of them are yielded. see matchesAnyPattern()
+  dirsToWalk = [(dirToScan, "")]
+  while len(dirsToWalk) > 0:
+    (dirPath, relativeDirPath) = dirsToWalk.pop()
+    try:
+      entries = listDirEntries(dirPath)
+    except OSError:
+      continue
+
+    childDirs = []
+    for (name, isDir, isSymlink, fileStat) in entries:
+      relativePath = relativeDirPath + "/" + name if relativeDirPath != "" else name
+      if matchesAnyPattern(name, relativePath, excludes):
+        continue
+      entryPath = os.path.join(dirPath, name)
+      if isDir:
+        if not isSymlink:
+          childDirs.append((entryPath, relativePath))
+        continue
+      if len(includes) > 0 and not matchesAnyPattern(name, relativePath, includes):
+        continue
+      if fileStat is None:
+        # raises the same error os.stat() would have after os.walk()
+        fileStat = os.stat(entryPath)
+      yield (entryPath, fileStat)
+
+    # os.walk() goes into each child directory in turn, after this directory's files
+    childDirs.reverse()
+    dirsToWalk.extend(childDirs)
+
+def isHardLinked(fileStat):
+  # whether other paths might be the same file. on Windows, Python 2 gives
+  # 0 for st_nlink and st_ino, so no files look hard linked there
+  return fileStat.st_nlink > 1 and fileStat.st_ino != 0
+
+def loadPosixFadvise():
+  # Python 2 has no os.posix_fadvise, so it's called from libc directly.
+  # only on Linux, where the 64-bit version is always there
+  if ctypes is None or not sys.platform.startswith('linux'):
+    return None
+  try:
+    posixFadvise = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).posix_fadvise64
+  except (OSError, AttributeError):
+    return None
+  posixFadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+  posixFadvise.restype = ctypes.c_int
+  return posixFadvise
+
+libcPosixFadvise = loadPosixFadvise()
+
+# from Linux's fcntl.h
+POSIX_FADV_SEQUENTIAL = 2
+
+def adviseSequential(fd):
+  # tells the OS the file will be read front to back, so it reads further ahead.
+  # it's only advice, so it does nothing where it can't be given, and a failure
+  # (which is returned, not raised) is ignored
+  if libcPosixFadvise is not None:
+    libcPosixFadvise(fd, 0, 0, POSIX_FADV_SEQUENTIAL)
+
+def hashFilesByDevice(files, algorithms, readSize=DEFAULT_READ_SIZE, maxQueuedChunks=16, batchSize=10000):
+  # hashes files with one reader thread per device (st_dev), so several disks are
+  # read at once but each disk only reads one file at a time. each device's files
+  # are read in inode order, which on most filesystems is roughly the order they're
+  # laid out on disk, so spinning disks seek less. each reader passes chunks to its
+  # own hasher thread, so the disk keeps reading while the last chunk is hashed.
+  # files is a list of (filePath, fileStat), or None for files to skip.
+  # yields (hashes, elapsed timedelta) in the same order as files, or None for skipped ones.
+  # files are taken batchSize at a time (and only put in inode order within a batch),
+  # so at most that many results are held until the ones before them are done
+  for start in xrange(0, len(files), batchSize):
+    for result in hashFileBatchByDevice(files[start:start + batchSize], algorithms, readSize, maxQueuedChunks):
+      yield result
+
+def hashFileBatchByDevice(files, algorithms, readSize, maxQueuedChunks):
+  # hashFilesByDevice() for one batch of files
+  results = Queue.Queue()
+  filesByDevice = {}
+  for (index, fileInfo) in enumerate(files):
+    if fileInfo is not None:
+      (filePath, fileStat) = fileInfo
+      filesByDevice.setdefault(fileStat.st_dev, []).append((fileStat.st_ino, index, filePath))
+
+  def hashChunks(chunks):
+    hashers = None
+    while True:
+      (index, chunk, startTime) = chunks.get()
+      if index is None:
+        return
+      if hashers is None:
+        hashers = [newHasher(a) for a in algorithms]
+      if isinstance(chunk, tuple):
+        # the reader failed, pass on its exception info
+        results.put((index, chunk, None))
+        hashers = None
+      elif chunk is None:
+        hashes = [formatHash(a, h.hexdigest()) for (a, h) in zip(algorithms, hashers)]
+        results.put((index, hashes, datetime.datetime.now() - startTime))
+        hashers = None
+      else:
+        for hasher in hashers:
+          hasher.update(chunk)
+
+  def readDevice(deviceFiles):
+    deviceFiles.sort()
+    chunks = Queue.Queue(maxQueuedChunks)
+    hasherThread = threading.Thread(target=hashChunks, args=(chunks,))
+    hasherThread.daemon = True
+    hasherThread.start()
+    for (inode, index, filePath) in deviceFiles:
+      startTime = datetime.datetime.now()
+      try:
+        with io.open(filePath, "rb", buffering=0) as f:
+          adviseSequential(f.fileno())
+          while True:
+            chunk = f.read(readSize)
+            if not chunk:
+              break
+            chunks.put((index, chunk, startTime))
+        chunks.put((index, None, startTime))
+      except Exception:
+        chunks.put((index, sys.exc_info(), startTime))
+    chunks.put((None, None, None))
+
+  for deviceFiles in filesByDevice.itervalues():
+    readerThread = threading.Thread(target=readDevice, args=(deviceFiles,))
+    readerThread.daemon = True
+    readerThread.start()
+
+  # files finish in whatever order the devices get to them, so hold on to
+  # results until all the ones before them are done
+  finished = {}
+  for (index, fileInfo) in enumerate(files):
+    if fileInfo is None:
+      yield None
+      continue
+    while index not in finished:
+      # a timeout lets Ctrl+C through, which a plain get() blocks on Python 2
+      (doneIndex, hashes, elapsed) = results.get(True, 1e9)
+      if isinstance(hashes, tuple):
+        raise hashes[0], hashes[1], hashes[2]
+      finished[doneIndex] = (hashes, elapsed)
+    yield finished.pop(index)
+
+def formatMtime(mtime):
+  # repr() round-trips a float exactly, so a stored mtime compares equal
+  # to the same os.stat() result the next time the file is scanned
+  return repr(mtime)
+
+def readHashFile(hashFilePath, duplicatesOnly=False, withExtraHashes=False):
+  # yields (fileHash, fileSize, filePath, mtime) for every row of a file
+  # written by hashFolderContents.py (or a binary catalog, see BinaryCatalog,
+  # or a SQLite catalog, see readSqliteCatalog).
+  # with duplicatesOnly, formats that can cheaply skip rows whose hash is
+  # unique do so, and the others yield every row anyway.
+  # withExtraHashes adds a fifth item, the list of extra hashes (see --also-hash)
+  if isBinaryCatalog(hashFilePath):
+    return readBinaryCatalog(hashFilePath, withExtraHashes)
+  if isSqliteCatalog(hashFilePath):
+    return readSqliteCatalog(hashFilePath, duplicatesOnly, withExtraHashes)
+  return readCsvHashFile(hashFilePath, withExtraHashes)
+
+def readBinaryCatalog(catalogPath, withExtraHashes=False):
+  # binary catalogs don't hold extra hashes
+  catalog = BinaryCatalog(catalogPath)
+  try:
+    for row in catalog.iterRows():
+      if withExtraHashes:
+        yield row + ([],)
+      else:
+        yield row
+  finally:
+    catalog.close()
+
+def readCsvHashFile(hashFilePath, withExtraHashes=False):
+  # The row format is <hash> <sizeNumber> <sizeHumanReadableText> <path> [<mtime>]
+  # where mtime is missing (None here) in files written before it was recorded.
+  # Any further fields are extra hashes of the file by other algorithms.
+  # Hashes made by different algorithms can't be compared, so all rows must
+  # have used the same algorithm.
+  algorithm = None
+  with open(hashFilePath, "rb") as inFile:
+    csvIn = csv.reader(inFile, delimiter=' ', strict=True)
+    for row in csvIn:
+      rowAlgorithm = getHashAlgorithm(row[0])
+      if algorithm is None:
+        algorithm = rowAlgorithm
+      elif algorithm != rowAlgorithm:
+        raise ValueError("%s mixes %s and %s hashes, which can't be compared" % \
+                         (hashFilePath, algorithm, rowAlgorithm))
+      mtime = None
+      if len(row) > 4 and row[4] != "":
+        mtime = float(row[4])
+      if withExtraHashes:
+        yield (row[0], long(row[1]), row[3], mtime, row[5:])
+      else:
+        yield (row[0], long(row[1]), row[3], mtime)
+
+def recoverCsvHashFile(hashFilePath):
+  # reads back a csv hash file that might have been cut off partway through a row
+  # (or end in garbage, if the computer lost power before it all reached the disk).
+  # returns ([(filePath, fileHashes)], the length of the file up to the last good row).
+  # rows with an odd shape, like a path with a newline in it, also count as bad,
+  # which is safe since anything after a bad row is just hashed again
+  rows = []
+  goodLength = 0
+  with open(hashFilePath, "rb") as inFile:
+    while True:
+      # readline() keeps tell() accurate, where iterating over the file wouldn't
+      line = inFile.readline()
+      if not line.endswith("\n"):
+        break
+      try:
+        parsed = list(csv.reader([line], delimiter=' ', strict=True))
+        if len(parsed) != 1 or len(parsed[0]) < 5:
+          break
+        row = parsed[0]
+        long(row[1])
+        float(row[4])
+      except (csv.Error, ValueError):
+        break
+      rows.append((row[3], [row[0]] + row[5:]))
+      goodLength = inFile.tell()
+  return (rows, goodLength)
+
+class CsvHashFileWriter:
+  # writes rows in the format read by readCsvHashFile()
+  def __init__(self, outFilePath, mode="wb"):
+    # write binary because CSV writer requires that
+    self.file = open(outFilePath, mode)
+    self.csvOut = csv.writer(self.file, delimiter=' ', strict=True)
+
+  def writeRecord(self, fileHash, fileSize, filePath, mtime, extraHashes=[]):
+    row = [fileHash, fileSize, getHumanReadableSize(fileSize), filePath]
+    if mtime is not None or len(extraHashes) > 0:
+      row.append(formatMtime(mtime) if mtime is not None else "")
+    self.csvOut.writerow(row + extraHashes)
+
+  def sync(self):
+    # makes sure every row so far is on the disk, and returns the file's length
+    self.file.flush()
+    os.fsync(self.file.fileno())
+    return self.file.tell()
+
+  def close(self):
+    self.file.close()
+
+# Binary catalogs hold the same records as a hash file, but are quicker to load
+# because nothing has to be parsed. All integers are little-endian.
+#
+#   header:  BINARY_CATALOG_MAGIC, algorithm name (16 bytes, NUL padded),
+#            record count, string count, dir count, strings offset, dirs offset
+#   records: one per file, see BinaryCatalog.recordStruct
+#            (raw digest, size, mtime or NaN, dir id, name string id, separator)
+#   strings: (string count + 1) offsets relative to the end of the offsets,
+#            then all the strings' bytes
+#   dirs:    one per directory (parent dir id, name string id, separator)
+#
+# Paths are stored as components so each directory and each distinct name is
+# stored once. The separator is the slash that came before the component
+# (or NUL for the first component) so paths round-trip exactly.
+BINARY_CATALOG_MAGIC = b"NBTCAT1\0"
+NO_ID = 0xFFFFFFFF
+HASH_DIGEST_SIZES = { 'md5': 16, 'sha1': 20, 'sha256': 32, 'blake2b': 64 }
+binaryCatalogHeaderStruct = struct.Struct("<8s16sQQQQQ")
+binaryCatalogDirStruct = struct.Struct("<IIc")
+binaryCatalogOffsetStruct = struct.Struct("<Q")
+
+def getBinaryCatalogRecordStruct(algorithm):
+  return struct.Struct("<%dsQdIIc" % HASH_DIGEST_SIZES[algorithm])
+
+def isBinaryCatalog(hashFilePath):
+  with open(hashFilePath, "rb") as f:
+    return f.read(len(BINARY_CATALOG_MAGIC)) == BINARY_CATALOG_MAGIC
+
+def splitPathComponents(filePath):
+  # returns [(separator, name), ...] where separator is the slash before name
+  # (or NUL for the first component), e.g. "/a\\b" -> [(NUL, ""), ("/", "a"), ("\\", "b")]
+  parts = re.split(r"([\\/])", filePath)
+  components = [(b"\0", parts[0])]
+  for i in xrange(1, len(parts), 2):
+    components.append((parts[i], parts[i + 1]))
+  return components
+
+class BinaryCatalogWriter:
+  def __init__(self, outFilePath, algorithm=None):
+    self.file = open(outFilePath, "w+b")
+    self.algorithm = algorithm
+    self.recordStruct = None
+    self.recordCount = 0
+    self.stringIds = {}
+    self.strings = []
+    self.dirIds = {} # key = (parent dir id, name string id, separator)
+    self.dirs = []
+    self.lastDirPath = None
+    self.lastDirId = NO_ID
+    # leave room for the header, which is written once the counts are known
+    self.file.write(b"\0" * binaryCatalogHeaderStruct.size)
+
+  def getStringId(self, string):
+    stringId = self.stringIds.get(string)
+    if stringId is None:
+      stringId = len(self.strings)
+      self.stringIds[string] = stringId
+      self.strings.append(string)
+    return stringId
+
+  def getDirId(self, components):
+    dirId = NO_ID
+    for (separator, name) in components:
+      key = (dirId, self.getStringId(name), separator)
+      childId = self.dirIds.get(key)
+      if childId is None:
+        childId = len(self.dirs)
+        self.dirIds[key] = childId
+        self.dirs.append(key)
+      dirId = childId
+    return dirId
+
+  def writeRecord(self, fileHash, fileSize, filePath, mtime, extraHashes=[]):
+    if len(extraHashes) > 0:
+      raise ValueError("binary catalogs can only hold one hash per file")
+    algorithm = getHashAlgorithm(fileHash)
+    if self.algorithm is None:
+      self.algorithm = algorithm
+    if algorithm != self.algorithm:
+      raise ValueError("binary catalogs can only hold %s hashes, not %s" % (self.algorithm, algorithm))
+    if self.recordStruct is None:
+      self.recordStruct = getBinaryCatalogRecordStruct(self.algorithm)
+
+    components = splitPathComponents(filePath)
+    (separator, name) = components[-1]
+
+    # hash files list a folder's files together, so usually the dir was just seen
+    dirPath = filePath[:len(filePath) - len(name)]
+    if dirPath != self.lastDirPath:
+      self.lastDirPath = dirPath
+      self.lastDirId = self.getDirId(components[:-1])
+
+    digest = binascii.unhexlify(fileHash[fileHash.find(':') + 1:])
+    self.file.write(self.recordStruct.pack(digest, fileSize,
+                                           mtime if mtime is not None else float('nan'),
+                                           self.lastDirId, self.getStringId(name), separator))
+    self.recordCount += 1
+
+  def close(self):
+    if self.algorithm is None:
+      self.algorithm = 'md5'
+
+    stringsOffset = self.file.tell()
+    offset = 0
+    for string in self.strings:
+      self.file.write(binaryCatalogOffsetStruct.pack(offset))
+      offset += len(string)
+    self.file.write(binaryCatalogOffsetStruct.pack(offset))
+    for string in self.strings:
+      self.file.write(string)
+
+    dirsOffset = self.file.tell()
+    for (parentId, nameId, separator) in self.dirs:
+      self.file.write(binaryCatalogDirStruct.pack(parentId, nameId, separator))
+
+    self.file.seek(0)
+    self.file.write(binaryCatalogHeaderStruct.pack(BINARY_CATALOG_MAGIC, self.algorithm,
+                                                   self.recordCount, len(self.strings), len(self.dirs),
+                                                   stringsOffset, dirsOffset))
+    self.file.close()
+
+class BinaryCatalog:
+  # reads a file written by BinaryCatalogWriter through a memory map
+  def __init__(self, catalogPath):
+    self.file = open(catalogPath, "rb")
+    self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, algorithm, self.recordCount, self.stringCount, self.dirCount,
+     self.stringsOffset, self.dirsOffset) = binaryCatalogHeaderStruct.unpack_from(self.mapped, 0)
+    if magic != BINARY_CATALOG_MAGIC:
+      raise ValueError(catalogPath + " is not a binary catalog")
+    self.algorithm = algorithm.rstrip(b"\0")
+    self.recordStruct = getBinaryCatalogRecordStruct(self.algorithm)
+    self.stringBytesOffset = self.stringsOffset + (self.stringCount + 1) * binaryCatalogOffsetStruct.size
+    self.stringCache = {}
+    self.dirPathCache = {}
+
+  def close(self):
+    self.mapped.close()
+    self.file.close()
+
+  def getString(self, stringId):
+    string = self.stringCache.get(stringId)
+    if string is None:
+      offsetPosition = self.stringsOffset + stringId * binaryCatalogOffsetStruct.size
+      (start,) = binaryCatalogOffsetStruct.unpack_from(self.mapped, offsetPosition)
+      (end,) = binaryCatalogOffsetStruct.unpack_from(self.mapped, offsetPosition + binaryCatalogOffsetStruct.size)
+      string = self.mapped[self.stringBytesOffset + start:self.stringBytesOffset + end]
+      self.stringCache[stringId] = string
+    return string
+
+  def getDir(self, dirId):
+    # returns (parent dir id, name string id, separator)
+    return binaryCatalogDirStruct.unpack_from(self.mapped, self.dirsOffset + dirId * binaryCatalogDirStruct.size)
+
+  def getDirPath(self, dirId):
+    path = self.dirPathCache.get(dirId)
+    if path is None:
+      (parentId, nameId, separator) = self.getDir(dirId)
+      path = self.getString(nameId)
+      if parentId != NO_ID:
+        path = self.getDirPath(parentId) + separator + path
+      self.dirPathCache[dirId] = path
+    return path
+
+  def iterRecords(self):
+    # yields (raw digest, size, mtime or NaN, dir id, name string id, separator)
+    unpackFrom = self.recordStruct.unpack_from
+    recordSize = self.recordStruct.size
+    mapped = self.mapped
+    offset = binaryCatalogHeaderStruct.size
+    for i in xrange(self.recordCount):
+      yield unpackFrom(mapped, offset)
+      offset += recordSize
+
+  def iterRows(self):
+    # yields the same thing as readHashFile()
+    for (digest, fileSize, mtime, dirId, nameId, separator) in self.iterRecords():
+      if dirId == NO_ID:
+        filePath = self.getString(nameId)
+      else:
+        filePath = self.getDirPath(dirId) + separator + self.getString(nameId)
+      fileHash = formatHash(self.algorithm, binascii.hexlify(digest))
+      yield (fileHash, fileSize, filePath, mtime if mtime == mtime else None)
+
+# SQLite catalogs hold the same records as a hash file, indexed for ad-hoc
+# queries (see queryCatalog.py):
+#
+#   dirs:  id, path (everything before the file name, including the slash)
+#   files: id (in the order they were written), hash (as in a hash file), size,
+#          dirId, name, mtime (or NULL), extraHashes (space separated, or NULL)
+#
+# with indexes on files.hash, files.size and files.dirId
+SQLITE_CATALOG_MAGIC = b"SQLite format 3\0"
+
+SQLITE_CATALOG_SCHEMA = """
+CREATE TABLE dirs (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE);
+CREATE TABLE files (id INTEGER PRIMARY KEY, hash TEXT NOT NULL, size INTEGER NOT NULL,
+                    dirId INTEGER NOT NULL, name TEXT NOT NULL, mtime REAL, extraHashes TEXT);
+"""
+
+# created after all the rows are in, which is much quicker than keeping them up to date
+SQLITE_CATALOG_INDEXES = """
+CREATE INDEX files_hash ON files (hash);
+CREATE INDEX files_size ON files (size);
+CREATE INDEX files_dirId ON files (dirId);
+"""
+
+def isSqliteCatalog(hashFilePath):
+  with open(hashFilePath, "rb") as f:
+    return f.read(len(SQLITE_CATALOG_MAGIC)) == SQLITE_CATALOG_MAGIC
+
+def openSqliteCatalog(catalogPath):
+  if sqlite3 is None:
+    raise ValueError("SQLite catalogs need the sqlite3 module, which this Python doesn't have")
+  db = sqlite3.connect(catalogPath)
+  # paths are whatever bytes the filesystem gave, which might not be UTF-8
+  db.text_factory = str
+  return db
+
+class SqliteCatalogWriter:
+  # writes a SQLite catalog, inserting rows in batches
+  def __init__(self, outFilePath, batchSize=10000):
+    if os.path.exists(outFilePath):
+      os.remove(outFilePath)
+    self.db = openSqliteCatalog(outFilePath)
+    # a half-written catalog is useless anyway, so don't bother making it crash-proof
+    self.db.execute("PRAGMA synchronous = OFF")
+    self.db.execute("PRAGMA journal_mode = OFF")
+    self.db.executescript(SQLITE_CATALOG_SCHEMA)
+    self.batchSize = batchSize
+    self.algorithm = None
+    self.dirIds = {}
+    self.newDirs = []
+    self.newFiles = []
+
+  def writeRecord(self, fileHash, fileSize, filePath, mtime, extraHashes=[]):
+    algorithm = getHashAlgorithm(fileHash)
+    if self.algorithm is None:
+      self.algorithm = algorithm
+    if algorithm != self.algorithm:
+      raise ValueError("a catalog can only hold one kind of hash, not %s and %s" % (self.algorithm, algorithm))
+
+    cut = max(filePath.rfind('/'), filePath.rfind('\\')) + 1
+    dirPath = filePath[:cut]
+    dirId = self.dirIds.get(dirPath)
+    if dirId is None:
+      dirId = len(self.dirIds) + 1
+      self.dirIds[dirPath] = dirId
+      self.newDirs.append((dirId, dirPath))
+
+    self.newFiles.append((fileHash, fileSize, dirId, filePath[cut:], mtime,
+                          " ".join(extraHashes) if len(extraHashes) > 0 else None))
+    if len(self.newFiles) >= self.batchSize:
+      self.flush()
+
+  def flush(self):
+    self.db.executemany("INSERT INTO dirs (id, path) VALUES (?, ?)", self.newDirs)
+    self.db.executemany("INSERT INTO files (hash, size, dirId, name, mtime, extraHashes) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", self.newFiles)
+    self.newDirs = []
+    self.newFiles = []
+
+  def close(self):
+    self.flush()
+    self.db.executescript(SQLITE_CATALOG_INDEXES)
+    self.db.commit()
+    self.db.close()
+
+def readSqliteCatalog(catalogPath, duplicatesOnly=False, withExtraHashes=False):
+  # yields the same thing as readHashFile(), in the order the rows were written
+  db = openSqliteCatalog(catalogPath)
+  try:
+    query = ("SELECT f.hash, f.size, d.path || f.name, f.mtime, f.extraHashes "
+             "FROM files f JOIN dirs d ON d.id = f.dirId")
+    if duplicatesOnly:
+      # the hash index makes this quick, and most hashes are unique
+      query += " WHERE f.hash IN (SELECT hash FROM files GROUP BY hash HAVING COUNT(*) > 1)"
+    for (fileHash, fileSize, filePath, mtime, extraHashes) in db.execute(query + " ORDER BY f.id"):
+      if withExtraHashes:
+        yield (fileHash, long(fileSize), filePath, mtime, extraHashes.split(" ") if extraHashes is not None else [])
+      else:
+        yield (fileHash, long(fileSize), filePath, mtime)
+  finally:
+    db.close()
 
 def getHumanReadableSize(size):
   for unit in ['Bytes','KB','MB','GB','TB','PB','EB','ZB']:
@@ -27,93 +758,531 @@ def splitFilePath(filePath):
 
   # drive indicators are annoying, so handle them separately
   (drive, remainingPath) = ntpath.splitdrive(filePath)
-   
-  # os.path.split is weird about leading slashes, so capture them separately
-  leadingSlashes = ""
-  poo = re.search("^([\\/]+)(.*)$", remainingPath)
-  if poo:
-    leadingSlashes = poo.group(1)
-    remainingPath = poo.group(2)
-
-  # split dirs and filename
-  reversePathParts = []
-  while True:
-    (base, name) = ntpath.split(remainingPath)
-    if base == "":
-      if name == "":
-        raise ValueError("the file path was empty - not supported")
-      else:
-        reversePathParts.append(name)
-        break
-    else:
-      if name != "":
-        reversePathParts.append(name)
-        remainingPath = base
-      else:
-        raise ValueError("file path ends in a slash - not supported")
 
+  # capture leading slashes (of either kind) separately
+  start = 0
+  while start < len(remainingPath) and remainingPath[start] in "\\/":
+    start += 1
+  leadingSlashes = remainingPath[:start]
+  remainingPath = remainingPath[start:]
+
+  if remainingPath == "":
+    raise ValueError("the file path was empty - not supported")
+  if remainingPath[-1] in "\\/":
+    raise ValueError("file path ends in a slash - not supported")
+
+  # split dirs and filename on either kind of slash, in one pass,
+  # treating doubled slashes as one like ntpath.split does
+  reversePathParts = [name for name in remainingPath.replace('\\', '/').split('/') if name != ""]
+  reversePathParts.reverse()
   return (drive, leadingSlashes, reversePathParts)
 
-class MemFile:
+def splitDirPath(filePath):
+  # returns (the path up to and including the last slash, the file name)
+  slash = filePath.rfind('/')
+  backslash = filePath.rfind('\\')
+  cut = (slash if slash > backslash else backslash) + 1
+  if cut == len(filePath):
+    raise ValueError("file path ends in a slash - not supported")
+  return (filePath[:cut], filePath[cut:])
+
+def packHash(fileHash):
+  # turns a hash from a hash file into its raw digest bytes, which take
+  # half the memory of the hex digits (the algorithm prefix is dropped)
+  return binascii.unhexlify(fileHash[fileHash.find(':') + 1:])
+
+def unpackHash(digest, algorithm='md5'):
+  # the opposite of packHash()
+  return formatHash(algorithm, binascii.hexlify(digest))
+
+class MemFile(object):
+  # __slots__ keeps each of the (possibly many millions of) files small
+  __slots__ = ('name', 'hash', 'size', 'dir')
+
   def __init__(self, name, fileHash, fileSize, parentDir):
     self.name = name
-    self.hash = fileHash
+    self.hash = fileHash # see packHash()
     self.size = fileSize
     self.dir = parentDir
 
   def getPath(self):
     return self.dir.getPath() + '/' + self.name
 
-class MemDirectory:
+class MemDirectory(object):
+  __slots__ = ('id', 'files', 'dirs', 'name', 'dir', 'size', 'sizeImmediateFilesOnly',
+               'filesByHashCache', 'path')
+
+  # directories are numbered in the order they're created, which is also
+  # how they sort, so output that depends on directory order is repeatable
+  nextId = 0
+
   def __init__(self, name, parentDir):
-    self.files = {} # by name
-    self.filesByHash = {} # key is hash, value is list of files with that hash
+    self.id = MemDirectory.nextId
+    MemDirectory.nextId += 1
+    self.files = []
     self.dirs = {}
     self.name = name
     self.dir = parentDir
-    self.size = 0
+    self.size = 0 # see computeSizes()
     self.sizeImmediateFilesOnly = 0
+    self.filesByHashCache = None
+    self.path = None
+
+  def __lt__(self, other):
+    return self.id < other.id
+
+  def __gt__(self, other):
+    return self.id > other.id
+
+  @property
+  def filesByHash(self):
+    # key is hash, value is list of files with that hash.
+    # it's only built when asked for, because findDuplicateFiles.py never needs it
+    if self.filesByHashCache is None:
+      self.filesByHashCache = {}
+      for f in self.files:
+        pile = self.filesByHashCache.get(f.hash)
+        if pile is None:
+          pile = []
+          self.filesByHashCache[f.hash] = pile
+        pile.append(f)
+    return self.filesByHashCache
 
   def getPath(self):
-    # there's always a root MemDirectory with name = "" and dir = None
-    # so avoid printing that empty root name or a slash after it
-    if self.dir == None:
-      return ""
-    if self.dir.dir == None:
-      return self.name
-    return self.dir.getPath() + '/' + self.name
+    # paths are built once and remembered, since sorting and reporting ask a lot
+    if self.path is None:
+      # there's always a root MemDirectory with name = "" and dir = None
+      # so avoid printing that empty root name or a slash after it
+      if self.dir == None:
+        self.path = ""
+      elif self.dir.dir == None:
+        self.path = self.name
+      else:
+        self.path = self.dir.getPath() + '/' + self.name
+    return self.path
 
-  def add(self, fileHash, fileSize, reversePathParts):
-    name = reversePathParts[-1]
-    remainingParts = reversePathParts[:-1]
-    if len(reversePathParts) == 1:
-      newFile = MemFile(name, fileHash, fileSize, self)
-      self.files[name] = newFile
+  def getDir(self, name):
+    # returns the child directory with the name, creating it if needed
+    childDir = self.dirs.get(name)
+    if childDir is None:
+      childDir = MemDirectory(name, self)
+      self.dirs[name] = childDir
+    return childDir
 
-      pile = self.filesByHash.get(fileHash)
-      if pile is None:
-        pile = []
-        self.filesByHash[fileHash] = pile
-      pile.append(newFile)
+  def addFile(self, name, fileHash, fileSize):
+    newFile = MemFile(name, fileHash, fileSize, self)
+    self.files.append(newFile)
+    self.filesByHashCache = None
+    self.sizeImmediateFilesOnly += fileSize
+    return newFile
 
-      self.addToSize(newFile.size)
-      self.sizeImmediateFilesOnly += newFile.size
+  def getAllDirs(self):
+    # returns this directory and every directory below it, parents before children
+    pending = [self]
+    allDirs = []
+    while len(pending) > 0:
+      memDir = pending.pop()
+      allDirs.append(memDir)
+      pending.extend(memDir.dirs.itervalues())
+    return allDirs
 
-      return newFile
+  def computeSizes(self):
+    # sets size (this directory's files plus all its subdirectories' files)
+    # for this directory and everything below it, in a single bottom-up pass
+    # rather than walking up to the root for every file as files are added
+    for memDir in reversed(self.getAllDirs()):
+      memDir.size = memDir.sizeImmediateFilesOnly
+      for childDir in memDir.dirs.itervalues():
+        memDir.size += childDir.size
 
-    else:
-      if name in self.dirs:
-        myDir = self.dirs[name]
+def computeSubtreeHashes(rootDir, ignoreNames=False):
+  # returns a dict with key = MemDirectory, value = a digest of everything below it.
+  # two directories get the same digest exactly when they hold the same files
+  # in the same layout (with the same names too, unless ignoreNames).
+  # done bottom-up so each directory only looks at its immediate children.
+  subtreeHashes = {}
+  for memDir in reversed(rootDir.getAllDirs()):
+    entries = []
+    for f in memDir.files:
+      entries.append("f" + f.hash if ignoreNames else "f" + f.name + "\0" + f.hash)
+    for childDir in memDir.dirs.itervalues():
+      childHash = subtreeHashes[childDir]
+      entries.append("d" + childHash if ignoreNames else "d" + childDir.name + "\0" + childHash)
+    entries.sort()
+    hasher = hashlib.md5()
+    for entry in entries:
+      hasher.update(entry)
+    subtreeHashes[memDir] = hasher.digest()
+  return subtreeHashes
+
+uint64Struct = struct.Struct("<Q")
+
+def getMinHashSignature(digests, binCount):
+  # returns a list of binCount numbers such that two sets of digests have the
+  # same number at any given position with probability equal to how similar
+  # the sets are (their Jaccard index), or None for an empty set.
+  # this is one-permutation MinHash: digests are already uniformly random, so
+  # the first 8 bytes of each one pick a bin and a value within it, and the
+  # signature is the smallest value in each bin. bins that got no digest borrow
+  # from the next bin that did (offset by how far away it was) so even small
+  # sets get a full signature. that's one step per digest instead of binCount.
+  if len(digests) == 0:
+    return None
+  mins = [None] * binCount
+  for digest in digests:
+    (value,) = uint64Struct.unpack_from(digest)
+    (value, binIndex) = divmod(value, binCount)
+    if mins[binIndex] is None or value < mins[binIndex]:
+      mins[binIndex] = value
+  signature = list(mins)
+  for binIndex in xrange(binCount):
+    if signature[binIndex] is None:
+      distance = 1
+      while mins[(binIndex + distance) % binCount] is None:
+        distance += 1
+      signature[binIndex] = mins[(binIndex + distance) % binCount] + (distance << 64)
+  return signature
+
+class TreeBuilder(object):
+  # builds a MemDirectory tree from hash file rows.
+  # each row costs one dict lookup to find its directory (hash files list a
+  # folder's files together, so usually it's the same directory as last row)
+  # rather than one step per path component. call finish() when done.
+  def __init__(self, strings=None, root=None):
+    self.root = MemDirectory(name="", parentDir=None) if root is None else root
+    self.dirsByPath = {} # key = path up to and including the last slash
+    self.lastDirPath = None
+    self.lastDir = None
+    self.strings = deduplicatedStrings if strings is None else strings
+
+  def deduplicate(self, string):
+    return self.strings.setdefault(string, string)
+
+  def getDir(self, dirPath):
+    # dirPath must end with a slash (or be empty, for the root)
+    if dirPath == self.lastDirPath:
+      return self.lastDir
+    memDir = self.dirsByPath.get(dirPath)
+    if memDir is None:
+      memDir = self.root
+      if dirPath != "":
+        # only done once per directory.
+        # splitFilePath deals with drives, doubled slashes and such the same as always.
+        (drive, leadingSlashes, reversePathParts) = splitFilePath(dirPath + "x")
+        for name in reversed(reversePathParts[1:]):
+          memDir = memDir.getDir(self.deduplicate(name))
+      self.dirsByPath[dirPath] = memDir
+    self.lastDirPath = dirPath
+    self.lastDir = memDir
+    return memDir
+
+  def addFile(self, fileHash, fileSize, filePath):
+    # fileHash should come from packHash()
+    (dirPath, name) = splitDirPath(filePath)
+    return self.addFileInDir(fileHash, fileSize, dirPath, name)
+
+  def addFileInDir(self, fileHash, fileSize, dirPath, name):
+    # the same as addFile(), for a path already split by splitDirPath()
+    if dirPath == "":
+      # no slashes, but maybe a drive
+      (drive, leadingSlashes, reversePathParts) = splitFilePath(name)
+      return self.root.addFile(self.deduplicate(reversePathParts[0]), fileHash, fileSize)
+    return self.getDir(dirPath).addFile(self.deduplicate(name), fileHash, fileSize)
+
+  def finish(self):
+    self.root.computeSizes()
+    self.dirsByPath = {}
+    self.lastDirPath = None
+    self.lastDir = None
+    return self.root
+
+# how many bytes of a csv hash file a worker process parses at a time, see loadHashFile()
+LOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+def getLineChunks(filePath, chunkSize):
+  # returns [(start, end), ...] byte ranges covering a file, about chunkSize
+  # long, each ending at the end of a line
+  fileSize = os.path.getsize(filePath)
+  chunks = []
+  start = 0
+  with open(filePath, "rb") as inFile:
+    while start < fileSize:
+      end = start + chunkSize
+      if end >= fileSize:
+        end = fileSize
       else:
-        myDir = MemDirectory(name, self)
-        self.dirs[name] = myDir
+        inFile.seek(end)
+        end += len(inFile.readline())
+      chunks.append((start, end))
+      start = end
+  return chunks
+
+def parseHashFileChunk(chunk):
+  # parses the rows of a csv hash file in a byte range from getLineChunks(),
+  # for readCsvHashFileInParallel(). returns (hash algorithm, [(digest, size, dir path, name), ...])
+  (hashFilePath, start, end) = chunk
+  with open(hashFilePath, "rb") as inFile:
+    inFile.seek(start)
+    data = inFile.read(end - start)
+  algorithm = None
+  rows = []
+  lastDirPath = None
+  for row in csv.reader(io.BytesIO(data), delimiter=' ', strict=True):
+    rowAlgorithm = getHashAlgorithm(row[0])
+    if algorithm is None:
+      algorithm = rowAlgorithm
+    elif algorithm != rowAlgorithm:
+      raise ValueError("%s mixes %s and %s hashes, which can't be compared" % \
+                       (hashFilePath, algorithm, rowAlgorithm))
+    (dirPath, name) = splitDirPath(row[3])
+    # rows from the same folder share one dir path string, so it's only sent back once
+    if dirPath == lastDirPath:
+      dirPath = lastDirPath
+    lastDirPath = dirPath
+    rows.append((packHash(row[0]), long(row[1]), dirPath, name))
+  return (algorithm, rows)
+
+def readCsvHashFileInParallel(hashFilePath, jobs):
+  # yields (digest, size, dir path, name) for every row of a csv hash file, like
+  # readCsvHashFile() but with chunks of the file parsed by jobs worker processes
+  chunks = [(hashFilePath, start, end) for (start, end) in getLineChunks(hashFilePath, LOAD_CHUNK_SIZE)]
+  algorithm = None
+  rowCount = 0
+  try:
+    for (chunkAlgorithm, rows) in imapOrdered(parseHashFileChunk, chunks, jobs, jobs + 1, useProcesses=True):
+      if algorithm is None:
+        algorithm = chunkAlgorithm
+      elif chunkAlgorithm is not None and algorithm != chunkAlgorithm:
+        raise ValueError("%s mixes %s and %s hashes, which can't be compared" % \
+                         (hashFilePath, algorithm, chunkAlgorithm))
+      for row in rows:
+        rowCount += 1
+        yield row
+  except csv.Error:
+    # a path with a line break in it was split between chunks, so read the rest in one go
+    for (fileHash, fileSize, filePath, mtime) in itertools.islice(readCsvHashFile(hashFilePath), rowCount, None):
+      yield (packHash(fileHash), fileSize) + splitDirPath(filePath)
+
+def loadHashFile(hashFilePath, builder, filesByHash, progress, duplicatesOnly=False, jobs=1):
+  # adds every file in a hash file (or binary catalog) to a TreeBuilder
+  # and a HashIndex. with jobs > 1, a big csv hash file is parsed by that many
+  # worker processes (but not on Windows, which can't fork them)
+  if isBinaryCatalog(hashFilePath):
+    # binary catalogs already have directories numbered, so skip the path strings
+    catalog = BinaryCatalog(hashFilePath)
+    dirsById = {}
+    for (digest, fileSize, mtime, dirId, nameId, separator) in catalog.iterRecords():
+      progress.report()
+      if dirId == NO_ID:
+        filesByHash.add(builder.addFile(digest, fileSize, catalog.getString(nameId)))
+        continue
+      memDir = dirsById.get(dirId)
+      if memDir is None:
+        memDir = builder.getDir(catalog.getDirPath(dirId) + "/")
+        dirsById[dirId] = memDir
+      filesByHash.add(memDir.addFile(builder.deduplicate(catalog.getString(nameId)), digest, fileSize))
+    catalog.close()
+  elif jobs > 1 and sys.platform != 'win32' and not isSqliteCatalog(hashFilePath) and \
+       os.path.getsize(hashFilePath) > LOAD_CHUNK_SIZE * 2:
+    for (digest, fileSize, dirPath, name) in readCsvHashFileInParallel(hashFilePath, jobs):
+      progress.report()
+      filesByHash.add(builder.addFileInDir(digest, fileSize, dirPath, name))
+  else:
+    for (fileHash, fileSize, filePath, mtime) in readHashFile(hashFilePath, duplicatesOnly):
+      progress.report()
+      filesByHash.add(builder.addFile(packHash(fileHash), fileSize, filePath))
+
+def getCachedCatalogPath(hashFilePath, cacheDir):
+  # converts a csv hash file to a binary catalog in cacheDir, unless that was
+  # already done since the hash file last changed, and returns the catalog's path.
+  # catalogs that are already binary or SQLite are returned as is
+  if isBinaryCatalog(hashFilePath) or isSqliteCatalog(hashFilePath):
+    return hashFilePath
+  absPath = os.path.abspath(hashFilePath)
+  cachePath = os.path.join(cacheDir, hashlib.md5(absPath).hexdigest() + ".bin")
+  stampPath = cachePath + ".stamp"
+  fileStat = os.stat(hashFilePath)
+  stamp = "%d %s %s\n" % (fileStat.st_size, formatMtime(fileStat.st_mtime), absPath)
+  if os.path.exists(stampPath):
+    with open(stampPath, "rb") as stampFile:
+      if stampFile.read() == stamp and os.path.exists(cachePath):
+        return cachePath
+    # the stamp goes before the catalog does, so a half-written one is never trusted
+    os.remove(stampPath)
 
-      return myDir.add(fileHash, fileSize, remainingParts)
+  if not os.path.isdir(cacheDir):
+    os.makedirs(cacheDir)
+  print "Caching %s..." % hashFilePath
+  writer = BinaryCatalogWriter(cachePath)
+  for (fileHash, fileSize, filePath, mtime) in readHashFile(hashFilePath):
+    writer.writeRecord(fileHash, fileSize, filePath, mtime)
+  writer.close()
+  with open(stampPath, "wb") as stampFile:
+    stampFile.write(stamp)
+  return cachePath
 
-  def addToSize(self, extraSize):
-    self.size += extraSize
-    if self.dir is not None:
-      self.dir.addToSize(extraSize)
+def getCatalogAlgorithm(hashFilePath):
+  # the hash algorithm of a hash file (or catalog), from its first row, or None
+  # if it's empty. readHashFile() checks that the rest of the rows match it
+  for (fileHash, fileSize, filePath, mtime) in readHashFile(hashFilePath):
+    return getHashAlgorithm(fileHash)
+  return None
+
+def checkCatalogAlgorithms(hashFilePaths):
+  # hashes made by different algorithms never match, so searching catalogs made
+  # with different ones would quietly find nothing in common between them
+  pathsByAlgorithm = {}
+  for hashFilePath in hashFilePaths:
+    algorithm = getCatalogAlgorithm(hashFilePath)
+    if algorithm is not None:
+      pathsByAlgorithm.setdefault(algorithm, hashFilePath)
+  if len(pathsByAlgorithm) > 1:
+    ((algorithm1, path1), (algorithm2, path2)) = sorted(pathsByAlgorithm.items())[:2]
+    raise ValueError("%s has %s hashes and %s has %s hashes, which can't be compared" % \
+                     (path1, algorithm1, path2, algorithm2))
+
+def loadCatalogs(catalogs, filesByHash, progress, cacheDir=None, duplicatesOnly=False, jobs=1):
+  # builds one tree from several hash files, and returns its root.
+  # catalogs is a list of (label, hash file path). an unlabeled catalog is loaded
+  # as is, and a labeled one goes in a top-level folder named by its label.
+  # each catalog gets its own string table, which is dropped once it's loaded.
+  # with cacheDir, csv hash files are loaded from binary catalogs cached there.
+  # duplicatesOnly is passed to readHashFile() when there's only one catalog
+  # (with several, a hash unique within one catalog can still have copies in another).
+  # jobs is passed to loadHashFile()
+  if len(catalogs) > 1:
+    checkCatalogAlgorithms(hashFilePath for (label, hashFilePath) in catalogs)
+  root = MemDirectory(name="", parentDir=None)
+  for (label, hashFilePath) in catalogs:
+    loadCatalog(root if label is None else root.getDir(label), hashFilePath, filesByHash, progress,
+                cacheDir, duplicatesOnly and len(catalogs) == 1, jobs)
+  root.computeSizes()
+  return root
+
+def loadCatalog(catalogDir, hashFilePath, filesByHash, progress, cacheDir=None, duplicatesOnly=False, jobs=1):
+  # loads one of loadCatalogs()' hash files into catalogDir, without computing sizes
+  if cacheDir is not None:
+    hashFilePath = getCachedCatalogPath(hashFilePath, cacheDir)
+  builder = TreeBuilder(strings={}, root=catalogDir)
+  loadHashFile(hashFilePath, builder, filesByHash, progress, duplicatesOnly, jobs)
+
+def reloadCatalog(root, label, hashFilePath, filesByHash, progress, cacheDir=None, jobs=1):
+  # replaces a labeled catalog in a tree from loadCatalogs() with what its hash file
+  # holds now, leaving the other catalogs alone. the new copy is loaded off to the
+  # side first, so if loading fails the old one is still there.
+  # directories loaded later number (and so sort) after the others, and files
+  # join the end of their HashIndex piles, so ties can come out in a different
+  # order than from a fresh loadCatalogs()
+  newDir = MemDirectory(name=label, parentDir=root)
+  newFiles = HashIndex()
+  loadCatalog(newDir, hashFilePath, newFiles, progress, cacheDir, jobs=jobs)
+
+  oldDir = root.dirs.get(label)
+  if oldDir is not None:
+    filesByHash.removeFiles(f for memDir in oldDir.getAllDirs() for f in memDir.files)
+  root.dirs[label] = newDir
+  for (fileHash, files) in newFiles.iterPiles():
+    for f in files:
+      filesByHash.add(f)
+  root.computeSizes()
+
+def addCatalogArguments(argParser):
+  # the options for reading several hash files, shared by findDuplicateFiles.py
+  # and findDuplicateFolders.py. see getCatalogs()
+  argParser.add_argument('--label',
+    help='A name for the drive hashFilePath came from. Required with --catalog.')
+
+  argParser.add_argument('--catalog', nargs=2, action='append', default=[],
+    metavar=('LABEL', 'HASH_FILE_PATH'),
+    help='Another hash file to search, from the drive named LABEL. '
+         'Can be given more than once. Paths in the output start with the '
+         'label of the hash file they came from.')
+
+  argParser.add_argument('--cross-catalog-only', action='store_true',
+    help='Only report duplicates that are in more than one catalog')
+
+  argParser.add_argument('--cache-dir',
+    help='A folder to keep binary copies of csv hash files in, so hash files '
+         'that haven\'t changed since the last run load quickly')
+
+def getCatalogs(args, argParser):
+  # returns the (label, hash file path) list for loadCatalogs(),
+  # from the options added by addCatalogArguments()
+  catalogs = [(args.label, args.hashFilePath)] + [tuple(c) for c in args.catalog]
+  if len(catalogs) > 1 and args.label is None:
+    argParser.error("--label is required with --catalog")
+  if args.cross_catalog_only and len(catalogs) < 2:
+    argParser.error("--cross-catalog-only needs more than one catalog")
+  labels = [label for (label, hashFilePath) in catalogs if label is not None]
+  for label in labels:
+    if label in ("", ".", "..") or "/" in label or "\\" in label:
+      argParser.error("catalog labels can't be empty or contain slashes: %r" % label)
+  if len(set(labels)) < len(labels):
+    argParser.error("catalog labels must be unique")
+  if len(catalogs) > 1:
+    try:
+      checkCatalogAlgorithms(hashFilePath for (label, hashFilePath) in catalogs)
+    except ValueError as e:
+      argParser.error(str(e))
+  return catalogs
+
+def getCatalogLabel(filePath):
+  # the label a labeled file path (from MemFile.getPath()) starts with
+  return filePath[:filePath.find('/')]
+
+class HashIndex(object):
+  # all files by hash, like a dict of lists, except that a hash with only
+  # one file stores that MemFile directly since most hashes are unique
+  __slots__ = ('piles',)
+
+  def __init__(self):
+    self.piles = {}
+
+  def __len__(self):
+    return len(self.piles)
+
+  def add(self, memFile):
+    pile = self.piles.get(memFile.hash)
+    if pile is None:
+      self.piles[memFile.hash] = memFile
+      return
+    if type(pile) is not list:
+      pile = [pile]
+      self.piles[memFile.hash] = pile
+    # sanity check for hash collisions
+    if pile[0].size != memFile.size:
+      raise ValueError('Files with same hash had different size!')
+    pile.append(memFile)
+
+  def get(self, fileHash):
+    # returns the list of files with the hash
+    pile = self.piles.get(fileHash)
+    if pile is None:
+      return []
+    if type(pile) is not list:
+      return [pile]
+    return pile
+
+  def removeFiles(self, memFiles):
+    # removes many files at once, going through each of their piles only once
+    fileIdsByHash = {}
+    for memFile in memFiles:
+      fileIdsByHash.setdefault(memFile.hash, set()).add(id(memFile))
+    for (fileHash, fileIds) in fileIdsByHash.iteritems():
+      pile = [f for f in self.get(fileHash) if id(f) not in fileIds]
+      if len(pile) == 0:
+        del self.piles[fileHash]
+      elif len(pile) == 1:
+        self.piles[fileHash] = pile[0]
+      else:
+        self.piles[fileHash] = pile
+
+  def iterPiles(self):
+    # yields (hash, list of files) for every hash
+    for (fileHash, pile) in self.piles.iteritems():
+      if type(pile) is not list:
+        pile = [pile]
+      yield (fileHash, pile)
 
 deduplicatedStrings = {}
 def deduplicate(parts):
@@ -127,24 +1296,1424 @@ def deduplicate(parts):
       deduplicatedStrings[part] = part
     i = i + 1
 
+# the most reports, and bytes reported, that ProgressPrinter lets go by without looking at the clock
+MAX_PROGRESS_CHECK_INTERVAL = 1024
+MAX_PROGRESS_CHECK_BYTES = 64 * 1024 * 1024
+
 class ProgressPrinter:
-  def __init__(self, messageFormat=None):
+  # stage is the Stage to record the count in when done, if any
+  def __init__(self, messageFormat=None, stage=None):
     self.number = 0
-    self.timeOfLastUpdate = datetime.datetime.now()
+    self.byteCount = 0
+    self.stage = stage
+    self.startTime = time.time()
+    self.timeOfLastUpdate = self.startTime
+    self.timeOfLastCheck = self.startTime
+    self.checkInterval = 1
+    self.nextCheck = 1
+    self.nextCheckBytes = MAX_PROGRESS_CHECK_BYTES
     if messageFormat is None:
       self.messageFormat = "\rDoing thing {0}..."
     else:
       self.messageFormat = messageFormat
 
-  def report(self):
+  def report(self, byteCount=0):
     self.number += 1
-    if (datetime.datetime.now() - self.timeOfLastUpdate) > datetime.timedelta(microseconds=500000) \
-       or self.number == 1:
+    self.byteCount += byteCount
+    if self.number < self.nextCheck and self.byteCount < self.nextCheckBytes:
+      return
+    # only look at the clock every checkInterval reports, and keep doubling that
+    # while reports come quickly, so reporting millions of records costs little
+    # more than counting them. it's capped, the clock is also looked at after
+    # every so many bytes, and the interval starts over once reports slow down a
+    # lot (like small files giving way to big ones), so the count on screen
+    # doesn't freeze
+    now = time.time()
+    if now - self.timeOfLastCheck > 0.5:
+      self.checkInterval = 1
+    elif now - self.timeOfLastCheck < 0.05:
+      self.checkInterval = min(self.checkInterval * 2, MAX_PROGRESS_CHECK_INTERVAL)
+    elif self.checkInterval > 1:
+      self.checkInterval //= 2
+    self.timeOfLastCheck = now
+    self.nextCheck = self.number + self.checkInterval
+    self.nextCheckBytes = self.byteCount + MAX_PROGRESS_CHECK_BYTES
+    if now - self.timeOfLastUpdate > 0.5 or self.number == 1:
       sys.stdout.write(self.messageFormat.format(str(self.number)))
       sys.stdout.flush()
-      self.timeOfLastUpdate = datetime.datetime.now()
+      self.timeOfLastUpdate = now
 
   def reportDone(self):
     sys.stdout.write(self.messageFormat.format(str(self.number)))
+    seconds = time.time() - self.startTime
+    if seconds >= 1:
+      sys.stdout.write(" %.1fs, %d per second" % (seconds, self.number / seconds))
+      if self.byteCount > 0:
+        sys.stdout.write(", %s per second" % getHumanReadableSize(int(self.byteCount / seconds)))
     sys.stdout.write("\n")
     sys.stdout.flush()
+    if self.stage is not None:
+      self.stage.finish(self.number, self.byteCount if self.byteCount > 0 else None)
+
+def getCpuTime():
+  # the user and system time this process has used so far, in seconds
+  times = os.times()
+  return times[0] + times[1]
+
+def getPeakMemory():
+  # the most memory this process has used so far, in bytes, or None where that isn't known
+  if resource is None:
+    return None
+  peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin':
+    return peakMemory
+  return peakMemory * 1024 # in kilobytes everywhere else
+
+class Stage:
+  # the time taken by one step of a script, and how much it got through. see Metrics
+  def __init__(self, name):
+    self.name = name
+    self.records = None
+    self.byteCount = None
+    self.seconds = None
+    self.cpuSeconds = None
+    self.peakMemory = None
+    self.startTime = time.time()
+    self.startCpuTime = getCpuTime()
+
+  def finish(self, records=None, byteCount=None):
+    if self.seconds is not None:
+      return # already finished
+    self.seconds = time.time() - self.startTime
+    self.cpuSeconds = getCpuTime() - self.startCpuTime
+    self.peakMemory = getPeakMemory()
+    self.records = records
+    self.byteCount = byteCount
+
+  def toDict(self):
+    stageDict = {
+      'name': self.name,
+      'seconds': self.seconds,
+      'cpuSeconds': self.cpuSeconds,
+      'peakMemory': self.peakMemory,
+      }
+    for (key, count) in [('records', self.records), ('bytes', self.byteCount)]:
+      if count is not None:
+        stageDict[key] = count
+        stageDict[key + 'PerSecond'] = count / self.seconds if self.seconds > 0 else None
+    return stageDict
+
+class Metrics:
+  # times each stage of a script, for --metrics. a stage is started with startStage(),
+  # or with progress() for a stage that reports progress, which finishes the
+  # stage when its reportDone() is called
+  def __init__(self):
+    self.stages = []
+    self.startTime = time.time()
+    self.startCpuTime = getCpuTime()
+
+  def startStage(self, name):
+    stage = Stage(name)
+    self.stages.append(stage)
+    return stage
+
+  def progress(self, name, messageFormat):
+    return ProgressPrinter(messageFormat, self.startStage(name))
+
+  def toDict(self):
+    for stage in self.stages:
+      stage.finish() # in case the script stopped in the middle of one
+    return {
+      'command': sys.argv,
+      'seconds': time.time() - self.startTime,
+      'cpuSeconds': getCpuTime() - self.startCpuTime,
+      'peakMemory': getPeakMemory(),
+      'stages': [stage.toDict() for stage in self.stages],
+      }
+
+  def write(self, outFilePath):
+    # does nothing without a path, so scripts can call it whether or not --metrics was given
+    if outFilePath is None:
+      return
+    with open(outFilePath, "wb") as outFile:
+      json.dump(self.toDict(), outFile, indent=2, sort_keys=True)
+
+def addMetricsArgument(argParser):
+  argParser.add_argument('--metrics', metavar='METRICS_FILE_PATH', default=None,
+    help='Write how long each stage took, how many records and bytes it got through per second, '
+         'and the peak memory used, to this JSON file')
+
+class ReversedSortKey(object):
+  # wraps a sort key so it sorts in the opposite order
+  __slots__ = ('key',)
+
+  def __init__(self, key):
+    self.key = key
+
+  def __lt__(self, other):
+    return other.key < self.key
+
+  def __eq__(self, other):
+    return self.key == other.key
+
+def writeSortedRun(run, key, reverse, tempDir, runNumber):
+  run.sort(key=key, reverse=reverse)
+  runPath = os.path.join(tempDir, "run%d.csv" % runNumber)
+  with open(runPath, "wb") as runFile:
+    csv.writer(runFile, strict=True).writerows(run)
+  return runPath
+
+# how many runs mergeSortedRuns() opens at once
+MAX_MERGED_RUNS = 256
+
+def mergeSortedRuns(runPaths, key, reverse):
+  # with more runs than can be open at once, consecutive groups of them are merged
+  # into bigger runs first (deleting the smaller ones), so ties still go to the earlier run
+  mergePass = 0
+  while len(runPaths) > MAX_MERGED_RUNS:
+    tempDir = os.path.dirname(runPaths[0])
+    mergedPaths = []
+    for start in xrange(0, len(runPaths), MAX_MERGED_RUNS):
+      groupPaths = runPaths[start:start + MAX_MERGED_RUNS]
+      mergedPath = os.path.join(tempDir, "merged%d_%d.csv" % (mergePass, len(mergedPaths)))
+      with open(mergedPath, "wb") as mergedFile:
+        csv.writer(mergedFile, strict=True).writerows(mergeRuns(groupPaths, key, reverse))
+      for runPath in groupPaths:
+        os.remove(runPath)
+      mergedPaths.append(mergedPath)
+    runPaths = mergedPaths
+    mergePass += 1
+  for record in mergeRuns(runPaths, key, reverse):
+    yield record
+
+def mergeRuns(runPaths, key, reverse):
+  runFiles = [open(p, "rb") for p in runPaths]
+  try:
+    readers = [csv.reader(f, strict=True) for f in runFiles]
+    wrap = ReversedSortKey if reverse else (lambda k: k)
+    # ties go to the earlier run, so the merge is stable like sort()
+    heap = []
+    for (runNumber, reader) in enumerate(readers):
+      for record in reader:
+        heap.append((wrap(key(record)), runNumber, record))
+        break
+    heapq.heapify(heap)
+    while len(heap) > 0:
+      (sortKey, runNumber, record) = heap[0]
+      yield record
+      for nextRecord in readers[runNumber]:
+        heapq.heapreplace(heap, (wrap(key(nextRecord)), runNumber, nextRecord))
+        break
+      else:
+        heapq.heappop(heap)
+  finally:
+    for f in runFiles:
+      f.close()
+
+def externalSort(records, key, maxRecordsInMemory, reverse=False):
+  # like sorted(records, key=key, reverse=reverse), but for more records than fit in
+  # memory: sorted runs of up to maxRecordsInMemory records are written to temporary
+  # files and then merged. records must be lists of strings, since runs are stored
+  # as csv, and records read back from a run are always lists.
+  tempDir = None
+  try:
+    runPaths = []
+    run = []
+    for record in records:
+      run.append(record)
+      if len(run) >= maxRecordsInMemory:
+        if tempDir is None:
+          tempDir = tempfile.mkdtemp(prefix="nateBackupTools")
+        runPaths.append(writeSortedRun(run, key, reverse, tempDir, len(runPaths)))
+        run = []
+
+    if len(runPaths) == 0:
+      # it all fit in memory after all
+      run.sort(key=key, reverse=reverse)
+      for record in run:
+        yield record
+      return
+
+    if len(run) > 0:
+      runPaths.append(writeSortedRun(run, key, reverse, tempDir, len(runPaths)))
+    run = None
+    for record in mergeSortedRuns(runPaths, key, reverse):
+      yield record
+  finally:
+    if tempDir is not None:
+      shutil.rmtree(tempDir, ignore_errors=True)
+
+def getMemPath(filePath):
+  # returns the path that MemFile.getPath() would give the file
+  # (no drive or leading slashes, and always forward slashes)
+  (drive, leadingSlashes, reversePathParts) = splitFilePath(filePath)
+  return '/'.join(reversed(reversePathParts))
+
+class FilePile:
+  def __init__(self, hash, files):
+    self.hash = hash
+    self.files = files
+    self.firstFileSize = files[0].size
+    self.firstFilePath = files[0].getPath()
+
+def writeDuplicateFileReport(filesByHash, outFilePath, crossCatalogOnly=False):
+  # writes the report described by findDuplicateFiles.py
+  # filesByHash is a HashIndex of all the files
+
+  # enumerate all duplicate file piles, sorted first by size then path
+  piles = []
+  progress = ProgressPrinter("\rProcessing unique record {0}...")
+  for (hash, files) in filesByHash.iterPiles():
+    # report progress once in a while
+    progress.report()
+
+    if len(files) > 1:
+      if crossCatalogOnly and len(set(getCatalogLabel(f.getPath()) for f in files)) < 2:
+        continue
+      # (sorted into a copy, so the HashIndex keeps its order for other reports)
+      pile = FilePile(hash, sorted(files, key=lambda y: y.getPath()))
+      piles.append(pile)
+
+  progress.reportDone()
+
+  print "Sorting duplicate file data..."
+  piles.sort(key=lambda x: (x.firstFileSize, x.firstFilePath), reverse=True)
+
+  progress = ProgressPrinter("\rWriting duplicate file data {0}...")
+  with open(outFilePath, "wb") as outFile:
+    csvOut = csv.writer(outFile, delimiter=' ', strict=True)
+    for filePile in piles:
+      # report progress once in a while
+      progress.report()
+
+      # sanity check for hash collisions
+      if not all(x.size == filePile.firstFileSize for x in filePile.files):
+        raise ValueError('Files with same hash had different size!')
+
+      writeDuplicateFilePile(csvOut, filePile.firstFileSize, [x.getPath() for x in filePile.files])
+
+  progress.reportDone()
+
+def streamDuplicateFileReport(catalogs, outFilePath, maxRecordsInMemory,
+                              crossCatalogOnly=False, cacheDir=None):
+  # writes the same report as writeDuplicateFileReport, straight from hash
+  # files without building a tree, using external sorts so that no more than
+  # maxRecordsInMemory rows (or file names and paths of duplicates) are held in
+  # memory at once, however many copies a file has.
+  # catalogs and cacheDir are the same as for loadCatalogs()
+  if len(catalogs) > 1:
+    checkCatalogAlgorithms(hashFilePath for (label, hashFilePath) in catalogs)
+
+  # pass 1: sort every row by hash then path, so duplicates end up next to each other
+  def enumerateRows():
+    progress = ProgressPrinter("\rReading record {0}...")
+    for (label, hashFilePath) in catalogs:
+      if cacheDir is not None:
+        hashFilePath = getCachedCatalogPath(hashFilePath, cacheDir)
+      prefix = "" if label is None else label + "/"
+      for (fileHash, fileSize, filePath, mtime) in readHashFile(hashFilePath, len(catalogs) == 1):
+        progress.report()
+        yield [fileHash, str(fileSize), prefix + getMemPath(filePath)]
+    progress.reportDone()
+
+  # records are [size, first path, hash, kind, value] where kind "2" is a pile's
+  # summary, with "1" as the value if the pile is reported, kind "1" has one of its
+  # file names and kind "0" one of its paths. a hash's rows come sorted by path, so
+  # its first path is known from its first row, and that row is all that has to be
+  # held until the pile turns out to have a second file
+  def enumeratePileRecords():
+    pileHash = None
+    pileSize = None
+    pileCount = 0
+    firstPath = None
+    labels = set()
+    for (fileHash, fileSize, filePath) in externalSort(enumerateRows(),
+        lambda r: (r[0], r[2]), maxRecordsInMemory):
+      if fileHash != pileHash:
+        if pileCount > 1:
+          yield [pileSize, firstPath, pileHash, "2", "1" if not crossCatalogOnly or len(labels) > 1 else ""]
+        pileHash = fileHash
+        pileSize = fileSize
+        pileCount = 0
+        firstPath = filePath
+        labels = set()
+      elif fileSize != pileSize:
+        # sanity check for hash collisions
+        raise ValueError('Files with same hash had different size!')
+      pileCount += 1
+      if crossCatalogOnly:
+        labels.add(getCatalogLabel(filePath))
+      if pileCount == 2:
+        pilePaths = [firstPath, filePath]
+      elif pileCount > 2:
+        pilePaths = [filePath]
+      else:
+        pilePaths = []
+      for p in pilePaths:
+        yield [pileSize, firstPath, pileHash, "1", p[p.rfind('/') + 1:]]
+        yield [pileSize, firstPath, pileHash, "0", p]
+    if pileCount > 1:
+      yield [pileSize, firstPath, pileHash, "2", "1" if not crossCatalogOnly or len(labels) > 1 else ""]
+
+  # pass 2: sort the piles first by size then path, the same as the in-memory report,
+  # and within each pile, its summary, names, then paths, so piles are written as they're
+  # read. the sort is stable, so paths stay in the order they were in
+  print "Sorting duplicate file data..."
+  pileKey = lambda r: (r[0], r[1], r[2])
+  sortKey = lambda r: (int(r[0]), r[1], r[2], r[3])
+  progress = ProgressPrinter("\rWriting duplicate file data {0}...")
+  with open(outFilePath, "wb") as outFile:
+    csvOut = csv.writer(outFile, delimiter=' ', strict=True)
+    # the "file" row is written a field at a time, since a pile can have more names than fit in memory
+    fieldBuffer = io.BytesIO()
+    fieldWriter = csv.writer(fieldBuffer, delimiter=' ', strict=True)
+    def formatFields(fields):
+      fieldBuffer.seek(0)
+      fieldBuffer.truncate()
+      fieldWriter.writerow(fields)
+      return fieldBuffer.getvalue()[:-len(fieldWriter.dialect.lineterminator)]
+
+    sortedRecords = externalSort(enumeratePileRecords(), sortKey, maxRecordsInMemory, reverse=True)
+    for (key, records) in itertools.groupby(sortedRecords, pileKey):
+      if next(records)[4] == "":
+        continue
+      progress.report()
+
+      # the same rows as writeDuplicateFilePile(), with the names sorted as they're read
+      def enumerateNames():
+        for record in records:
+          if record[3] != "1":
+            yield record
+            return
+          yield [record[4]]
+      outFile.write(formatFields(["file", getHumanReadableSize(int(key[0]))]))
+      lastName = None
+      firstPathRecord = None
+      for nameOrPathRecord in externalSort(enumerateNames(), lambda r: (len(r) > 1, r[0]), maxRecordsInMemory):
+        if len(nameOrPathRecord) > 1:
+          firstPathRecord = nameOrPathRecord
+        elif nameOrPathRecord[0] != lastName:
+          outFile.write(" " + formatFields(nameOrPathRecord))
+          lastName = nameOrPathRecord[0]
+      outFile.write(fieldWriter.dialect.lineterminator)
+      csvOut.writerow(["duplicate", firstPathRecord[4]])
+      for record in records:
+        csvOut.writerow(["duplicate", record[4]])
+      csvOut.writerow([])
+  progress.reportDone()
+
+def writeDuplicateFilePile(csvOut, fileSize, filePaths):
+  # filePaths come from MemFile.getPath() (or getMemPath()), sorted
+
+  # write a row with file size and all unique file names
+  fileSizeForHumes = getHumanReadableSize(fileSize)
+  orderedFileNames = sorted(set([p[p.rfind('/') + 1:] for p in filePaths]))
+  csvOut.writerow(["file", fileSizeForHumes] + orderedFileNames)
+
+  # write a row with each found file path
+  for filePath in filePaths:
+    csvOut.writerow(["duplicate", filePath])
+
+  # write a blank row for readability
+  csvOut.writerow([])
+
+class LikeDirStat:
+  def __init__(self, aDir, bDir, likeFileCount=None, likeFileSize=None):
+    if likeFileCount is not None:
+      # already counted in a worker process, see FolderMatcher.lookForDuplicateFoldersInParallel()
+      self.likeFileCount = likeFileCount
+      self.likeFileSize = likeFileSize
+      self.dirs = tuple(sorted([aDir, bDir]))
+    elif aDir is bDir:
+      self.InitSingleDir(aDir)
+    else:
+      self.InitDifferentDirs(aDir, bDir)
+
+  def InitSingleDir(self, aDir):
+    # public fields
+    self.likeFileCount = 0
+    self.likeFileSize = 0
+    self.dirs = sorted([aDir, aDir])
+    self.dirs = (self.dirs[0], self.dirs[1])
+
+    # determine like file count and size
+    for aFileHash in aDir.filesByHash:
+      aFiles = aDir.filesByHash[aFileHash]
+      if len(aFiles) > 1:
+        self.likeFileCount += len(aFiles)
+        # size calculation assumes all files with same hash have the same size... 
+        # which is true until we want to survive hash collisions =)
+        self.likeFileSize += aFiles[0].size * len(aFiles)
+
+  def InitDifferentDirs(self, aDir, bDir):
+    # public fields
+    self.likeFileCount = 0
+    self.likeFileSize = 0
+    self.dirs = sorted([aDir, bDir])
+    self.dirs = (self.dirs[0], self.dirs[1])
+
+    # determine like file count and size
+    for bFileHash in bDir.filesByHash:
+      bFiles = bDir.filesByHash[bFileHash]
+      aFiles = aDir.filesByHash.get(bFileHash)
+      if aFiles is not None:
+        sharedFileCount = min(len(aFiles), len(bFiles))
+        self.likeFileCount += sharedFileCount
+        # size calculation assumes all files with same hash have the same size... 
+        # which is true until we want to survive hash collisions =)
+        self.likeFileSize += aFiles[0].size * sharedFileCount
+
+def getCatalogDir(memDir):
+  # the top-level folder a directory is in, which is named by its catalog's label
+  # when several catalogs are loaded (see loadCatalogs())
+  while memDir.dir is not None and memDir.dir.dir is not None:
+    memDir = memDir.dir
+  return memDir
+
+# the read-only copy of FolderMatcher's data that worker processes score folders with.
+# it's set before the processes are forked, so they share it rather than each getting a copy
+folderScoringIndex = None
+
+def countLikeFiles(aSharedHashes, bSharedHashes, isSameDir):
+  # the same counts as LikeDirStat, from dicts with key = hash, value = (file count, file size)
+  likeFileCount = 0
+  likeFileSize = 0
+  if isSameDir:
+    for (fileCount, fileSize) in aSharedHashes.itervalues():
+      if fileCount > 1:
+        likeFileCount += fileCount
+        likeFileSize += fileSize * fileCount
+  else:
+    for (fileHash, (bFileCount, bFileSize)) in bSharedHashes.iteritems():
+      aFiles = aSharedHashes.get(fileHash)
+      if aFiles is not None:
+        sharedFileCount = min(aFiles[0], bFileCount)
+        likeFileCount += sharedFileCount
+        likeFileSize += aFiles[1] * sharedFileCount
+  return (likeFileCount, likeFileSize)
+
+def scoreFolderPair(aId, bId):
+  # returns (like file count, like file size) for two folders in folderScoringIndex,
+  # or None if FolderMatcher.considerDirPair() would ignore the pair
+  index = folderScoringIndex
+  if index['crossCatalogOnly'] and index['catalogIds'][aId] == index['catalogIds'][bId]:
+    return None
+  (likeFileCount, likeFileSize) = countLikeFiles(index['sharedHashes'][aId], index['sharedHashes'][bId], aId == bId)
+  if likeFileCount == 0:
+    return None
+  sizes = index['sizesImmediateFilesOnly']
+  if (likeFileSize < sizes[aId] / 2) and (likeFileSize < sizes[bId] / 2):
+    return None
+  return (likeFileCount, likeFileSize)
+
+def scoreFolderRange(idRange):
+  # does what FolderMatcher.lookForDuplicateFolders() does for the folders with ids in
+  # idRange, which are numbered in the order it visits them. returns a list with, for each
+  # folder, the list of (other folder id, like file count, like file size) in the order
+  # it would consider them
+  index = folderScoringIndex
+  ignoreCommonHashes = index['ignoreCommonHashes']
+  results = []
+  for memId in xrange(*idRange):
+    pairs = []
+    likeIdsSeen = set()
+    for fileHash in index['fileHashes'][memId]:
+      # hashes with only one file aren't in the index, that file being in this folder
+      likeIds = index['dirIdsByHash'].get(fileHash, (memId,))
+      if ignoreCommonHashes is not None and len(likeIds) > ignoreCommonHashes:
+        continue
+      for likeId in likeIds:
+        # folders with lower ids were already compared with everything
+        if likeId < memId or likeId in likeIdsSeen:
+          continue
+        likeIdsSeen.add(likeId)
+        score = scoreFolderPair(memId, likeId)
+        if score is not None:
+          pairs.append((likeId,) + score)
+    results.append(pairs)
+  return results
+
+def scoreFolderPairs(pairs):
+  # scores a list of (folder id, folder id) pairs from folderScoringIndex
+  return [scoreFolderPair(aId, bId) for (aId, bId) in pairs]
+
+# folders that findDuplicateFolders.py doesn't compare
+DIR_NAMES_TO_IGNORE = {
+  '.git': True,
+  '.svn': True,
+  'dsbudget-source-archive': True
+  }
+
+class FolderClusters(object):
+  # groups folders that are similar, even indirectly: if a is like b and b is like c,
+  # a, b and c are one cluster even if a and c have little in common (union-find)
+  def __init__(self):
+    self.parents = {} # key = dir, value = a dir in the same cluster, or itself for the cluster's root
+
+  def find(self, memDir):
+    # returns the root of memDir's cluster, pointing memDir and the dirs on the way at it
+    root = memDir
+    while self.parents[root] is not root:
+      root = self.parents[root]
+    while memDir is not root:
+      nextDir = self.parents[memDir]
+      self.parents[memDir] = root
+      memDir = nextDir
+    return root
+
+  def join(self, aDir, bDir):
+    self.parents.setdefault(aDir, aDir)
+    self.parents.setdefault(bDir, bDir)
+    aRoot = self.find(aDir)
+    bRoot = self.find(bDir)
+    # the first-created dir stays the root, so the same pairs always give the same tree
+    if bRoot < aRoot:
+      (aRoot, bRoot) = (bRoot, aRoot)
+    self.parents[bRoot] = aRoot
+
+  def getClusters(self):
+    # returns a list of clusters, each a list of dirs sorted by path
+    dirsByRoot = {}
+    for memDir in self.parents:
+      dirsByRoot.setdefault(self.find(memDir), []).append(memDir)
+    return [sorted(dirs, key=lambda d: d.getPath()) for dirs in dirsByRoot.itervalues()]
+
+class FolderMatcher:
+  # finds pairs of similar folders for findDuplicateFolders.py.
+  # call lookForDuplicateFolders() or lookForDuplicateFoldersByMinHash(),
+  # then getSortedStats() (or with keepClusters, clusters.getClusters())
+  def __init__(self, filesByHash, dirNamesToIgnore, ignoreCommonHashes=None, crossCatalogOnly=False,
+               keepClusters=False):
+    self.filesByHash = filesByHash
+    self.dirNamesToIgnore = dirNamesToIgnore
+    self.ignoreCommonHashes = ignoreCommonHashes
+    self.crossCatalogOnly = crossCatalogOnly
+    self.bestStatsByDir = {} # key = dir, value = LikeDirStat
+    # every pair that passes considerDirPair()'s limits joins a cluster, not just the best ones
+    self.clusters = FolderClusters() if keepClusters else None
+    # directories that have already been compared with every directory they share a file with
+    self.comparedDirs = set()
+
+  def isCommonHash(self, fileHash):
+    # low-information files (empty files, Thumbs.db, license files...) can have
+    # thousands of copies, and pairing up every folder that has one is slow
+    return self.ignoreCommonHashes is not None and \
+           len(self.filesByHash.get(fileHash)) > self.ignoreCommonHashes
+
+  def considerDirPair(self, memDir, likeDir):
+    if self.crossCatalogOnly and getCatalogDir(memDir) is getCatalogDir(likeDir):
+      return
+
+    # determine how similar the directories are
+    stat = LikeDirStat(memDir, likeDir)
+
+    # Reasonable matching limiter:
+    # only retain paired directories if the size of their matching files is
+    # at least 50% of either of their total file sizes
+    if stat.likeFileCount == 0:
+      return
+    if (stat.likeFileSize < memDir.sizeImmediateFilesOnly / 2) and \
+       (stat.likeFileSize < likeDir.sizeImmediateFilesOnly / 2):
+      # then we ignore it forever
+      return
+
+    self.keepIfBest(memDir, likeDir, stat)
+
+  def keepIfBest(self, memDir, likeDir, stat):
+    if self.clusters is not None and memDir is not likeDir:
+      self.clusters.join(memDir, likeDir)
+
+    # Serious noise limiter: (but also prevents me from seeing when a folder is duplicated 5 times)
+    # associate the directory pair with the directories only if the pair is more impressive
+    # than the previous directory pair associated the directories
+    bestMemDirStat = self.bestStatsByDir.get(memDir)
+    if (bestMemDirStat is None) or (bestMemDirStat.likeFileSize < stat.likeFileSize):
+      self.bestStatsByDir[memDir] = stat
+
+    bestStat = self.bestStatsByDir.get(likeDir)
+    if (bestStat is None) or (bestStat.likeFileSize < stat.likeFileSize):
+      self.bestStatsByDir[likeDir] = stat
+
+  def lookForDuplicateFolders(self, memDir, progress):
+    # ignore anything in .git directories (or whatever directories I want to ignore)
+    if memDir.name in self.dirNamesToIgnore:
+      return
+
+    # recurse into child directories first
+    for dirName in memDir.dirs:
+      childDir = memDir.dirs[dirName]
+      self.lookForDuplicateFolders(childDir, progress)
+
+    # report progress once in a while
+    progress.report()
+
+    # serious performance boost: don't compare directories that have already been compared.
+    # a pair has been compared if the other directory was already done (it looked at every
+    # directory sharing a file with it, including this one) or if it already came up here,
+    # so there's no need to remember every pair
+    likeDirsSeen = set()
+
+    # consider each file in this directory
+    for file in memDir.files:
+      if self.isCommonHash(file.hash):
+        continue
+
+      # consider all other identical files (across all directories)
+      likeFiles = self.filesByHash.get(file.hash)
+      for otherFile in likeFiles:
+        likeDir = otherFile.dir
+
+        # WACKY BUT EFFECTIVE!
+        # let directories be compared against themselves, to search for duplicate files within a single directory
+
+        # else, uncomment this block
+        # ignore other files in the original directory
+        #if otherFile.dir == memDir:
+        #  continue
+
+        # I'm pretty sure this never happens
+        if otherFile.dir is None:
+          raise ValueError('isn\'t the root directory the only thing with nil dir?')
+
+        if likeDir in self.comparedDirs or likeDir in likeDirsSeen:
+          continue
+        likeDirsSeen.add(likeDir)
+
+        self.considerDirPair(memDir, likeDir)
+
+    self.comparedDirs.add(memDir)
+
+  def buildScoringIndex(self, dirsToCompare):
+    # returns (index, dirs) where index is what folderScoringIndex is set to, with
+    # folders numbered by their place in dirs. dirsToCompare come first, in order, then any
+    # other folders that share files with them (ones that are ignored)
+    dirs = list(dirsToCompare)
+    dirIds = dict((memDir, i) for (i, memDir) in enumerate(dirs))
+    dirIdsByHash = {}
+    for (fileHash, pile) in self.filesByHash.iterPiles():
+      # only files with copies can be like anything else
+      if len(pile) < 2:
+        continue
+      pileDirIds = []
+      for f in pile:
+        dirId = dirIds.get(f.dir)
+        if dirId is None:
+          dirId = len(dirs)
+          dirIds[f.dir] = dirId
+          dirs.append(f.dir)
+        pileDirIds.append(dirId)
+      dirIdsByHash[fileHash] = tuple(pileDirIds)
+
+    sharedHashes = []
+    for memDir in dirs:
+      dirSharedHashes = {}
+      for f in memDir.files:
+        if f.hash in dirIdsByHash:
+          counted = dirSharedHashes.get(f.hash)
+          dirSharedHashes[f.hash] = (1, f.size) if counted is None else (counted[0] + 1, counted[1])
+      sharedHashes.append(dirSharedHashes)
+
+    index = {
+      'dirIdsByHash': dirIdsByHash,
+      'sharedHashes': sharedHashes,
+      'fileHashes': [tuple(f.hash for f in memDir.files) for memDir in dirsToCompare],
+      'sizesImmediateFilesOnly': [memDir.sizeImmediateFilesOnly for memDir in dirs],
+      'catalogIds': [getCatalogDir(memDir).id for memDir in dirs],
+      'ignoreCommonHashes': self.ignoreCommonHashes,
+      'crossCatalogOnly': self.crossCatalogOnly,
+      }
+    return (index, dirs)
+
+  def imapInProcesses(self, index, func, items, jobs):
+    # like itertools.imap, but runs func on a pool of processes that share index
+    global folderScoringIndex
+    if sys.platform == 'win32':
+      raise ValueError("scoring folders in parallel needs fork(), which Windows doesn't have")
+    folderScoringIndex = index
+    pool = multiprocessing.Pool(jobs)
+    try:
+      for result in pool.imap(func, items):
+        yield result
+    finally:
+      pool.terminate()
+      pool.join()
+      folderScoringIndex = None
+
+  def lookForDuplicateFoldersInParallel(self, rootDir, progress, jobs):
+    # the same as lookForDuplicateFolders(), spread over jobs processes.
+    # folders are split into ranges, each process returns the pairs that pass
+    # considerDirPair()'s limits for its range, and those are kept in the same
+    # order as lookForDuplicateFolders() would, so the results are the same
+    dirsToCompare = []
+    self.listDirsToCompare(rootDir, dirsToCompare)
+    (index, dirs) = self.buildScoringIndex(dirsToCompare)
+
+    rangeSize = max(1, min(256, len(dirsToCompare) / (jobs * 16)))
+    idRanges = [(start, min(start + rangeSize, len(dirsToCompare)))
+                for start in xrange(0, len(dirsToCompare), rangeSize)]
+    for ((start, end), results) in itertools.izip(idRanges, self.imapInProcesses(index, scoreFolderRange, idRanges, jobs)):
+      for (memId, pairs) in enumerate(results, start):
+        progress.report()
+        memDir = dirs[memId]
+        for (likeId, likeFileCount, likeFileSize) in pairs:
+          likeDir = dirs[likeId]
+          self.keepIfBest(memDir, likeDir, LikeDirStat(memDir, likeDir, likeFileCount, likeFileSize))
+
+  def listDirsToCompare(self, memDir, dirsToCompare):
+    # the same directories, in the same order, as lookForDuplicateFolders()
+    if memDir.name in self.dirNamesToIgnore:
+      return
+    for dirName in memDir.dirs:
+      self.listDirsToCompare(memDir.dirs[dirName], dirsToCompare)
+    dirsToCompare.append(memDir)
+
+  def lookForDuplicateFoldersByMinHash(self, rootDir, bands, rows, jobs=1):
+    # rather than comparing every pair of directories that share any file, only compare
+    # pairs whose MinHash signatures match in at least one band (locality-sensitive hashing).
+    # directories with mostly the same files are very likely to match in some band.
+    dirsToCompare = []
+    self.listDirsToCompare(rootDir, dirsToCompare)
+
+    binCount = bands * rows
+    candidatePairs = set()
+    dirsByBand = {} # key = (band number, signature numbers in the band), value = list of dirs
+    progress = ProgressPrinter("\rSigning folder {0}...")
+    for memDir in dirsToCompare:
+      progress.report()
+
+      # directories are still compared against themselves if they hold duplicate files
+      if any(len(pile) > 1 for pile in memDir.filesByHash.itervalues()):
+        candidatePairs.add((memDir, memDir))
+
+      signature = getMinHashSignature([h for h in memDir.filesByHash if not self.isCommonHash(h)], binCount)
+      if signature is None:
+        continue
+      for band in xrange(bands):
+        key = (band,) + tuple(signature[band * rows:(band + 1) * rows])
+        dirsByBand.setdefault(key, []).append(memDir)
+    progress.reportDone()
+
+    for likeDirs in dirsByBand.itervalues():
+      for i in xrange(len(likeDirs)):
+        for j in xrange(i + 1, len(likeDirs)):
+          candidatePairs.add(tuple(sorted([likeDirs[i], likeDirs[j]])))
+    dirsByBand = None
+
+    candidatePairs = sorted(candidatePairs)
+    progress = ProgressPrinter("\rProcessing folder pair {0}...")
+    if jobs > 1:
+      # score the pairs in other processes, in batches, and keep the results in the same order
+      (index, dirs) = self.buildScoringIndex(dirsToCompare)
+      dirIds = dict((memDir, i) for (i, memDir) in enumerate(dirs))
+      batches = [[(dirIds[aDir], dirIds[bDir]) for (aDir, bDir) in candidatePairs[start:start + 1024]]
+                 for start in xrange(0, len(candidatePairs), 1024)]
+      scores = itertools.chain.from_iterable(self.imapInProcesses(index, scoreFolderPairs, batches, jobs))
+      for ((aDir, bDir), score) in itertools.izip(candidatePairs, scores):
+        progress.report()
+        if score is not None:
+          self.keepIfBest(aDir, bDir, LikeDirStat(aDir, bDir, *score))
+    else:
+      for (aDir, bDir) in candidatePairs:
+        progress.report()
+        self.considerDirPair(aDir, bDir)
+    progress.reportDone()
+
+  def getSortedStats(self, top=None, minSize=None):
+    # get all unique folder pair stats
+    allStats = {}
+    for stat in self.bestStatsByDir.itervalues():
+      if minSize is None or stat.likeFileSize >= minSize:
+        allStats[stat] = stat
+
+    # sort by size, and since it matters to get predictable output, which matters for tests,
+    # secondarily sort by paths too
+    def sortKey(s):
+      aPath = s.dirs[0].getPath()
+      bPath = s.dirs[1].getPath()
+      return (-s.likeFileSize, aPath, bPath) if aPath <= bPath else (-s.likeFileSize, bPath, aPath)
+    if top is not None:
+      # only the first top, kept in a heap of that size rather than sorting them all
+      return heapq.nsmallest(top, allStats, key=sortKey)
+    return sorted(allStats, key=sortKey)
+
+def writeSimilarFolderReport(sortedStats, outFilePath):
+  # writes the report described by findDuplicateFolders.py,
+  # given the LikeDirStats from FolderMatcher.getSortedStats()
+  progress = ProgressPrinter("\rWriting duplicate folder data {0}...")
+  with open(outFilePath, "wb") as outFile:
+    csvOut = csv.writer(outFile, delimiter=' ', strict=True)
+    for stat in sortedStats:
+      # report progress once in a while
+      progress.report()
+
+      csvOut.writerows(enumerateSimilarFolderRows(stat))
+
+  progress.reportDone()
+
+def enumerateSimilarFolderRows(stat):
+  # yields the report rows for one pair of folders, only working them out when
+  # the pair is written, so they're never all in memory at once
+  #yield ["stat", "likesize", stat.likeFileSize]
+  #yield ["stat", "likecount", stat.likeFileCount]
+
+  aDir = stat.dirs[0]
+  bDir = stat.dirs[1]
+
+  # write rows indicating the parent folder sizes and paths
+  if aDir is bDir:
+    yield ["parent", "compared against itself", getHumanReadableSize(aDir.size), aDir.getPath()]
+  else:
+    yield ["parent", "left", getHumanReadableSize(aDir.size), aDir.getPath()]
+    yield ["parent", "right", getHumanReadableSize(bDir.size), bDir.getPath()]
+
+  # plan the rows to write out
+  # (because we need to write summary rows first)
+  rows = []
+  summarySameFilesCount = 0
+  summarySameFilesSize = 0
+  summaryDifferentFilesCount = 0
+  summaryDifferentFilesSize = 0
+  summaryChangedFilesCount = 0
+  summaryChangedFilesSize = 0
+  summaryLeftOnlyFilesCount = 0
+  summaryLeftOnlyFilesSize = 0
+  summaryRightOnlyFilesCount = 0
+  summaryRightOnlyFilesSize = 0
+
+  if aDir is bDir:
+    # write rows indicating duplicated files
+    hashesDuplicated = set([aHash for aHash in aDir.filesByHash if len(aDir.filesByHash[aHash]) > 1])
+    # order the rows by size
+    for h in sorted(hashesDuplicated, key=lambda h: -aDir.filesByHash[h][0].size):
+      aFiles = aDir.filesByHash[h]
+      
+      summarySameFilesSize += aFiles[0].size * len(aFiles)
+      summarySameFilesCount += len(aFiles)
+
+      # write as multiple rows
+      size = aFiles[0].size
+      rows.append(["files", "same", getHumanReadableSize(size * len(aFiles))])
+
+      # write rows sorted by file name
+      aNames = set([f.name for f in aFiles])
+      for n in sorted(aNames):
+        rows.append(["  ", "file", getHumanReadableSize(size), n])
+
+    # write all other files, sorted by size
+    hashesNotDuplicated = set([aHash for aHash in aDir.filesByHash if len(aDir.filesByHash[aHash]) == 1])
+    if len(hashesNotDuplicated) > 0:
+      myRows = []
+      mySize = 0
+      for h in sorted(hashesNotDuplicated, key=lambda h: -aDir.filesByHash[h][0].size):
+        aFile = aDir.filesByHash[h][0]
+
+        mySize += aFile.size
+        summaryDifferentFilesSize += aFile.size
+        summaryDifferentFilesCount += 1
+
+        myRows.append(["  ", "file", getHumanReadableSize(aFile.size), aFile.name])
+
+      rows.append(["files", "different", getHumanReadableSize(mySize)])
+      for r in myRows:
+        rows.append(r)
+
+  else: # aDir != bDir
+
+    # write rows indicating duplicated files (whether the file appears on both sides or just 1 side)
+    hashesOnBothSides = set().intersection(aDir.filesByHash, bDir.filesByHash)
+    hashesDuplicatedOnSingleSide = set() \
+        .union([aHash for aHash in aDir.filesByHash if len(aDir.filesByHash[aHash]) > 1], \
+               [bHash for bHash in bDir.filesByHash if len(bDir.filesByHash[bHash]) > 1])
+    hashesDuplicated = hashesOnBothSides.union(hashesDuplicatedOnSingleSide)
+    # order the rows by size
+    for h in sorted(hashesDuplicated, key=lambda h: -aDir.filesByHash.get(h, bDir.filesByHash.get(h))[0].size):
+      aFiles = aDir.filesByHash.get(h, [])
+      bFiles = bDir.filesByHash.get(h, [])
+
+      if len(aFiles) > 0:
+        summarySameFilesSize += aFiles[0].size * len(aFiles)
+        summarySameFilesCount += len(aFiles)
+      if len(bFiles) > 0:
+        summarySameFilesSize += bFiles[0].size * len(bFiles)
+        summarySameFilesCount += len(bFiles)
+
+      # if possible, write as 1 row
+      #if len(aFiles) == 1 and len(bFiles) == 1 and aFiles[0].name == bFiles[0].name:
+      #  rows.append(["files", "same", getHumanReadableSize(aFiles[0].size), aFiles[0].name])
+      #  continue
+
+      # else, write as multiple rows
+      count = 0
+      if len(aFiles) > 0:
+        size = aFiles[0].size
+        count += len(aFiles)
+      if len(bFiles) > 0:
+        size = bFiles[0].size
+        count += len(bFiles)
+      rows.append(["files", "same", getHumanReadableSize(size * count)])
+
+      # write rows sorted by file name
+      aNames = set([f.name for f in aFiles])
+      bNames = set([f.name for f in bFiles])
+      for n in sorted(set().union(aNames).union(bNames)):
+        presence = "both" if (n in aNames and n in bNames) else ("left" if n in aNames else "right")
+        rows.append(["  ", presence, getHumanReadableSize(size), n])
+
+    # get hashes indicating non-duplicated files
+    aOnlyHashes = set(aDir.filesByHash).difference(hashesDuplicated)
+    aOnlyHashesByName = {aDir.filesByHash[h][0].name: h for h in aOnlyHashes}
+    #aOnlyHashesSorted = sorted(aOnlyHashes, key=lambda h: (-aDir.filesByHash[h][0].size, aDir.filesByHash[h][0].name))
+
+    bOnlyHashes = set(bDir.filesByHash).difference(hashesDuplicated)
+    bOnlyHashesByName = {bDir.filesByHash[h][0].name: h for h in bOnlyHashes}
+    #bOnlyHashesSorted = sorted(bOnlyHashes, key=lambda h: (-bDir.filesByHash[h][0].size, bDir.filesByHash[h][0].name))
+
+    # get hashes of non-duplicated files on opposite sides with the same name
+    sharedNameFilePairs = {}
+    sharedNameHashes = set()
+    for n in aOnlyHashesByName:
+      aHash = aOnlyHashesByName[n]
+      if n in bOnlyHashesByName:
+        bHash = bOnlyHashesByName[n]
+        sharedNameFilePairs[n] = (aDir.filesByHash[aHash][0], bDir.filesByHash[bHash][0])
+        sharedNameHashes.add(aHash)
+        sharedNameHashes.add(bHash)
+
+    # write all "same name, different contents" files, sorted by size (then by name for maximally sorted output)
+    aSharedNameRows = []
+    aSharedNameSize = 0
+    aSharedNameCount = 0;
+    for name in sorted(sharedNameFilePairs, \
+                       key=lambda n: ( -max(sharedNameFilePairs[n][0].size, sharedNameFilePairs[n][1].size), n )):
+      files = sharedNameFilePairs[name]
+      aSharedNameRows.append(["  ", "left", getHumanReadableSize(files[0].size), files[0].name])
+      aSharedNameRows.append(["  ", "right", getHumanReadableSize(files[1].size), files[1].name])
+      aSharedNameSize += files[0].size + files[1].size
+      aSharedNameCount += 2
+
+    summaryChangedFilesSize += aSharedNameSize
+    summaryChangedFilesCount += aSharedNameCount
+
+    if len(aSharedNameRows) > 0:
+      rows.append(["files", "changed", getHumanReadableSize(summaryChangedFilesSize)])
+      for r in aSharedNameRows:
+        rows.append(r)
+
+    # write all "different names, different contents" files, sorted first by side then by size
+    aOtherRows = []
+    bOtherRows = []
+    aOnlySummarySize = 0
+    aOnlySummaryCount = 0
+    bOnlySummarySize = 0
+    bOnlySummaryCount = 0
+    for h in sorted(aOnlyHashes.difference(sharedNameHashes), \
+                    key=lambda h: ( -aDir.filesByHash[h][0].size, aDir.filesByHash[h][0].name)):
+      f = aDir.filesByHash[h][0]
+      aOtherRows.append(["  ", "left", getHumanReadableSize(f.size), f.name])
+      aOnlySummarySize += f.size
+      aOnlySummaryCount += 1
+    for h in sorted(bOnlyHashes.difference(sharedNameHashes), \
+                    key=lambda h: ( -bDir.filesByHash[h][0].size, bDir.filesByHash[h][0].name)):
+      f = bDir.filesByHash[h][0]
+      bOtherRows.append(["  ", "right", getHumanReadableSize(f.size), f.name])
+      bOnlySummarySize += f.size
+      bOnlySummaryCount += 1
+
+    if len(aOtherRows) > 0:
+      rows.append(["files", "left-only", getHumanReadableSize(aOnlySummarySize)])
+      for r in aOtherRows:
+        rows.append(r)
+    if len(bOtherRows) > 0:
+      rows.append(["files", "right-only", getHumanReadableSize(bOnlySummarySize)])
+      for r in bOtherRows:
+        rows.append(r)
+
+    summaryLeftOnlyFilesSize += aOnlySummarySize
+    summaryLeftOnlyFilesCount += aOnlySummaryCount
+    summaryRightOnlyFilesSize += bOnlySummarySize
+    summaryRightOnlyFilesCount += bOnlySummaryCount
+
+  # write the summary rows
+  if summarySameFilesCount > 0:
+    yield ["summary", "same", "files", getHumanReadableSize(summarySameFilesSize)]
+  if summaryDifferentFilesCount > 0:
+    yield ["summary", "different", "files", getHumanReadableSize(summaryDifferentFilesSize)]
+  if summaryChangedFilesCount > 0:
+    yield ["summary", "changed", "files", getHumanReadableSize(summaryChangedFilesSize)]
+  if summaryLeftOnlyFilesCount > 0:
+    yield ["summary", "left-only", "files", getHumanReadableSize(summaryLeftOnlyFilesSize)]
+  if summaryRightOnlyFilesCount > 0:
+    yield ["summary", "right-only", "files", getHumanReadableSize(summaryRightOnlyFilesSize)]
+
+  # write the detail rows
+  for r in rows:
+    yield r
+
+  # write a blank row for readability
+  yield []
+
+def writeFolderClusterReport(clusters, outFilePath):
+  # writes the --clusters report described by findDuplicateFolders.py,
+  # given the clusters from FolderClusters.getClusters()
+
+  # count each cluster's shared files once, rather than once per pair of its folders
+  progress = ProgressPrinter("\rMeasuring folder cluster {0}...")
+  measuredClusters = []
+  for dirs in clusters:
+    progress.report()
+    dirCountsByHash = {}
+    sizesByHash = {}
+    for memDir in dirs:
+      for (fileHash, files) in memDir.filesByHash.iteritems():
+        dirCountsByHash[fileHash] = dirCountsByHash.get(fileHash, 0) + 1
+        sizesByHash[fileHash] = files[0].size
+    sharedHashes = set(h for (h, dirCount) in dirCountsByHash.iteritems() if dirCount > 1)
+    sharedSize = sum(sizesByHash[h] for h in sharedHashes)
+    members = []
+    for memDir in dirs:
+      memberSharedSize = sum(f.size for f in memDir.files if f.hash in sharedHashes)
+      members.append((memDir, memberSharedSize, memDir.sizeImmediateFilesOnly - memberSharedSize))
+    measuredClusters.append((sharedSize, members))
+  progress.reportDone()
+
+  measuredClusters.sort(key=lambda c: (-c[0], c[1][0][0].getPath()))
+
+  progress = ProgressPrinter("\rWriting folder cluster {0}...")
+  with open(outFilePath, "wb") as outFile:
+    csvOut = csv.writer(outFile, delimiter=' ', strict=True)
+    for (sharedSize, members) in measuredClusters:
+      progress.report()
+      csvOut.writerow(["cluster", len(members), getHumanReadableSize(sharedSize)])
+      for (memDir, memberSharedSize, memberOtherSize) in members:
+        csvOut.writerow(["member", getHumanReadableSize(memDir.size), getHumanReadableSize(memberSharedSize),
+                         getHumanReadableSize(memberOtherSize), memDir.getPath()])
+      csvOut.writerow([])
+  progress.reportDone()
+
+class HashPartitionWriter(object):
+  # stands in for a HashIndex while loading hash files (see loadCatalogs()) for
+  # streamSimilarFolderReport(). rather than keeping files in memory, it writes each
+  # one to a partition file picked by the first byte of its hash, and to a file of
+  # every file in load order, leaving only the folder tree in memory
+  def __init__(self, tempDir, partitionCount):
+    self.fileCount = 0
+    self.partitionPaths = [os.path.join(tempDir, "partition%d.csv" % i) for i in xrange(partitionCount)]
+    self.partitionFiles = [open(p, "wb") for p in self.partitionPaths]
+    self.partitionWriters = [csv.writer(f, strict=True) for f in self.partitionFiles]
+    self.filesPath = os.path.join(tempDir, "files.csv")
+    self.filesFile = open(self.filesPath, "wb")
+    self.filesWriter = csv.writer(self.filesFile, strict=True)
+
+  def add(self, memFile):
+    # files are numbered in the order they're loaded, which is the order
+    # a HashIndex would list them in
+    hexHash = binascii.hexlify(memFile.hash)
+    partition = ord(memFile.hash[0]) * len(self.partitionWriters) / 256
+    self.partitionWriters[partition].writerow([hexHash, self.fileCount, memFile.dir.id, memFile.size])
+    self.filesWriter.writerow([memFile.dir.id, hexHash, memFile.size, memFile.name])
+    self.fileCount += 1
+    memFile.dir.files.pop()
+
+  def close(self):
+    for f in self.partitionFiles:
+      f.close()
+    self.filesFile.close()
+
+def readCsvRows(filePath):
+  with open(filePath, "rb") as inFile:
+    for row in csv.reader(inFile, strict=True):
+      yield row
+
+def streamSimilarFolderReport(catalogs, outFilePath, dirNamesToIgnore, maxRecordsInMemory, partitionCount,
+                              ignoreCommonHashes=None, crossCatalogOnly=False, cacheDir=None, top=None,
+                              minSize=None):
+  # writes the same report as FolderMatcher.lookForDuplicateFolders() and
+  # writeSimilarFolderReport(), while only keeping the folder tree in memory
+  # (not its files), so catalogs with far more files than fit in memory work.
+  #
+  # files are split on disk into partitions by hash, and each partition is sorted
+  # by hash (see externalSort()) so every pair of folders sharing a file can be
+  # counted, like LikeDirStat does. the counts are kept in memory per pair of
+  # folders until there are maxRecordsInMemory of them, then written to disk
+  # sorted by pair, and all of those are merged and added up at the end.
+  #
+  # to get the same results as lookForDuplicateFolders(), each pair also remembers
+  # when lookForDuplicateFolders() would have first compared it: the folder it
+  # would've been visiting, that folder's first file with a copy in the other
+  # folder, and the first such copy, numbering files in load order.
+  # the pairs are then kept or not in that order.
+  # top and minSize are passed to FolderMatcher.getSortedStats()
+  tempDir = tempfile.mkdtemp(prefix="nateBackupTools")
+  try:
+    # pass 1: load the folder tree, and split the files into partitions
+    partitions = HashPartitionWriter(tempDir, partitionCount)
+    progress = ProgressPrinter("\rReading record {0}...")
+    try:
+      rootDir = loadCatalogs(catalogs, partitions, progress, cacheDir)
+    finally:
+      partitions.close()
+    progress.reportDone()
+
+    matcher = FolderMatcher(None, dirNamesToIgnore, ignoreCommonHashes, crossCatalogOnly)
+    dirsById = dict((memDir.id, memDir) for memDir in rootDir.getAllDirs())
+    dirsToCompare = []
+    matcher.listDirsToCompare(rootDir, dirsToCompare)
+    visitOrder = dict((memDir.id, i) for (i, memDir) in enumerate(dirsToCompare))
+    catalogIds = None
+    if crossCatalogOnly:
+      catalogIds = dict((dirId, getCatalogDir(memDir).id) for (dirId, memDir) in dirsById.iteritems())
+
+    # key = folder id, value = the number of its first file that isn't a common hash
+    # (which is when lookForDuplicateFolders() compares it against itself)
+    firstFiles = {}
+    # key = folder id, value = [like file count, like file size] against itself
+    selfCounts = {}
+    # key = folder id, value = {hash: (file count, file size)} for common hashes, which
+    # don't make folders get compared but still count once they are
+    commonHashesByDir = {}
+    # key = (id of the folder visited first, id of the other), value =
+    # [like file count, like file size, first file number, first copy number]
+    pairCounts = {}
+    runPaths = []
+    pairKey = lambda r: (int(r[0]), int(r[1]))
+
+    def spillPairCounts():
+      runPaths.append(writeSortedRun([list(k) + v for (k, v) in pairCounts.iteritems()],
+                                     pairKey, False, tempDir, len(runPaths)))
+      pairCounts.clear()
+
+    # pass 2: count the files each pair of folders shares, a partition at a time
+    progress = ProgressPrinter("\rCounting shared files of hash {0}...")
+    for partitionPath in partitions.partitionPaths:
+      sortedRows = externalSort(readCsvRows(partitionPath), lambda r: (r[0], int(r[1])), maxRecordsInMemory)
+      for (hexHash, rows) in itertools.groupby(sortedRows, lambda r: r[0]):
+        progress.report()
+        fileSize = None
+        fileCount = 0
+        dirIds = [] # in pile order
+        dirCounts = {} # key = folder id, value = [file count, first file number]
+        for (rowHash, fileNumber, dirId, rowSize) in rows:
+          (fileNumber, dirId, rowSize) = (int(fileNumber), int(dirId), long(rowSize))
+          if fileSize is None:
+            fileSize = rowSize
+          elif rowSize != fileSize:
+            # sanity check for hash collisions
+            raise ValueError('Files with same hash had different size!')
+          fileCount += 1
+          counted = dirCounts.get(dirId)
+          if counted is None:
+            dirCounts[dirId] = [1, fileNumber]
+            dirIds.append(dirId)
+          else:
+            counted[0] += 1
+
+        if ignoreCommonHashes is not None and fileCount > ignoreCommonHashes:
+          if fileCount > 1:
+            fileHash = binascii.unhexlify(hexHash)
+            for dirId in dirIds:
+              commonHashesByDir.setdefault(dirId, {})[fileHash] = (dirCounts[dirId][0], fileSize)
+          continue
+
+        for dirId in dirIds:
+          (dirFileCount, firstFile) = dirCounts[dirId]
+          if dirId not in firstFiles or firstFile < firstFiles[dirId]:
+            firstFiles[dirId] = firstFile
+          if dirFileCount > 1:
+            counts = selfCounts.setdefault(dirId, [0, 0])
+            counts[0] += dirFileCount
+            counts[1] += fileSize * dirFileCount
+
+        for (i, aId) in enumerate(dirIds):
+          for bId in dirIds[i + 1:]:
+            # the pair is compared when the folder visited first gets visited.
+            # ignored folders are never visited
+            (aOrder, bOrder) = (visitOrder.get(aId), visitOrder.get(bId))
+            if aOrder is None and bOrder is None:
+              continue
+            if bOrder is None or (aOrder is not None and aOrder < bOrder):
+              (memId, likeId) = (aId, bId)
+            else:
+              (memId, likeId) = (bId, aId)
+            if crossCatalogOnly and catalogIds[memId] == catalogIds[likeId]:
+              continue
+            sharedFileCount = min(dirCounts[memId][0], dirCounts[likeId][0])
+            firstPair = (dirCounts[memId][1], dirCounts[likeId][1])
+            counts = pairCounts.get((memId, likeId))
+            if counts is None:
+              pairCounts[(memId, likeId)] = [sharedFileCount, fileSize * sharedFileCount] + list(firstPair)
+              # (checked for every pair, since a hash in k folders makes k * (k - 1) / 2 of them)
+              if len(pairCounts) >= maxRecordsInMemory:
+                spillPairCounts()
+            else:
+              counts[0] += sharedFileCount
+              counts[1] += fileSize * sharedFileCount
+              if firstPair < (counts[2], counts[3]):
+                (counts[2], counts[3]) = firstPair
+    progress.reportDone()
+    if len(pairCounts) > 0 or len(runPaths) == 0:
+      spillPairCounts()
+    pairCounts = None
+    for partitionPath in partitions.partitionPaths:
+      os.remove(partitionPath)
+
+    # pass 3: add up the counts for each pair, and list the pairs that
+    # considerDirPair() would keep, in the order it would see them
+    def addCommonHashes(memId, likeId, counts):
+      memHashes = commonHashesByDir.get(memId)
+      likeHashes = commonHashesByDir.get(likeId)
+      if memHashes is None or likeHashes is None:
+        return
+      for (fileHash, (memFileCount, fileSize)) in memHashes.iteritems():
+        if memId == likeId:
+          if memFileCount > 1:
+            counts[0] += memFileCount
+            counts[1] += fileSize * memFileCount
+        else:
+          likeFiles = likeHashes.get(fileHash)
+          if likeFiles is not None:
+            sharedFileCount = min(memFileCount, likeFiles[0])
+            counts[0] += sharedFileCount
+            counts[1] += fileSize * sharedFileCount
+
+    def isKept(memId, likeId, counts):
+      if counts[0] == 0:
+        return False
+      return not ((counts[1] < dirsById[memId].sizeImmediateFilesOnly / 2) and \
+                  (counts[1] < dirsById[likeId].sizeImmediateFilesOnly / 2))
+
+    def enumerateKeptPairs():
+      # records are [visit order, first file number, first copy number, folder id, other folder id,
+      # like file count, like file size]
+      for (dirId, firstFile) in firstFiles.iteritems():
+        # with crossCatalogOnly, considerDirPair() skips a folder paired with itself
+        if dirId not in visitOrder or crossCatalogOnly:
+          continue
+        counts = list(selfCounts.get(dirId, [0, 0]))
+        addCommonHashes(dirId, dirId, counts)
+        if isKept(dirId, dirId, counts):
+          yield [visitOrder[dirId], firstFile, firstFile, dirId, dirId] + counts
+      for ((memId, likeId), pairRows) in itertools.groupby(mergeSortedRuns(runPaths, pairKey, False), pairKey):
+        counts = [0, 0, None, None]
+        for (rowMemId, rowLikeId, likeFileCount, likeFileSize, firstFile, firstCopy) in pairRows:
+          counts[0] += int(likeFileCount)
+          counts[1] += long(likeFileSize)
+          firstPair = (int(firstFile), int(firstCopy))
+          if counts[2] is None or firstPair < (counts[2], counts[3]):
+            (counts[2], counts[3]) = firstPair
+        addCommonHashes(memId, likeId, counts)
+        if isKept(memId, likeId, counts):
+          yield [visitOrder[memId], counts[2], counts[3], memId, likeId, counts[0], counts[1]]
+
+    progress = ProgressPrinter("\rProcessing folder pair {0}...")
+    for record in externalSort(enumerateKeptPairs(), lambda r: (int(r[0]), int(r[1]), int(r[2])),
+                               maxRecordsInMemory):
+      progress.report()
+      memDir = dirsById[int(record[3])]
+      likeDir = dirsById[int(record[4])]
+      matcher.keepIfBest(memDir, likeDir, LikeDirStat(memDir, likeDir, int(record[5]), long(record[6])))
+    progress.reportDone()
+
+    print "Sorting similar folders..."
+    sortedStats = matcher.getSortedStats(top, minSize)
+
+    # pass 4: load the files of just the folders in the report
+    reportedDirIds = set()
+    for stat in sortedStats:
+      reportedDirIds.add(stat.dirs[0].id)
+      reportedDirIds.add(stat.dirs[1].id)
+    for (dirId, hexHash, fileSize, name) in readCsvRows(partitions.filesPath):
+      if int(dirId) in reportedDirIds:
+        memDir = dirsById[int(dirId)]
+        memDir.files.append(MemFile(name, binascii.unhexlify(hexHash), long(fileSize), memDir))
+
+    writeSimilarFolderReport(sortedStats, outFilePath)
+  finally:
+    shutil.rmtree(tempDir, ignore_errors=True)
+
+def generateSyntheticFiles(fileCount, maxDepth=8, filesPerDir=10, medianSize=65536, sizeSpread=2.0,
+                           maxSize=None, folderCopyRatio=0.3, fileCopyRatio=0.1, editRatio=0.1, seed=0):
+  # makes up a folder tree that looks like years of backups, for tests and benchmarks:
+  # new folders of new files (with sizes from a log-normal distribution), some files that
+  # are copies of earlier ones, and copies of whole earlier folders (with their subfolders)
+  # where some of the files were since edited or deleted.
+  # yields (filePath, contentId, fileSize), where files with the same contentId have the
+  # same contents (see getSyntheticHash() and getSyntheticContents(), given the same seed)
+  rng = random.Random(seed)
+  contentSizes = []
+
+  def newContent():
+    size = int(rng.lognormvariate(math.log(medianSize), sizeSpread))
+    if maxSize is not None:
+      size = min(size, maxSize)
+    contentSizes.append(size)
+    return len(contentSizes) - 1
+
+  # each folder is [path, depth, files as [(name, contentId)], subfolders as {name: folder}]
+  root = ["root", 0, [], {}]
+  folders = [root]
+  parents = [root] # folders that aren't too deep for more subfolders
+
+  def copyFolder(source, depth):
+    # copies are built apart from the tree, so a folder can be copied into itself
+    files = []
+    for (name, contentId) in source[2]:
+      if rng.random() < editRatio:
+        if rng.random() < 0.5:
+          continue # deleted
+        contentId = newContent() # edited
+      files.append((name, contentId))
+    subfolders = {}
+    if depth < maxDepth:
+      for name in sorted(source[3]):
+        subfolders[name] = copyFolder(source[3][name], depth + 1)
+    return [None, depth, files, subfolders]
+
+  def attachFolder(folder, parent, name):
+    # gives a new folder (and its subfolders) a path, and yields its files
+    while name in parent[3]:
+      name += " copy"
+    parent[3][name] = folder
+    folder[0] = parent[0] + "/" + name
+    folders.append(folder)
+    if folder[1] < maxDepth:
+      parents.append(folder)
+    for (fileName, contentId) in folder[2]:
+      yield (folder[0] + "/" + fileName, contentId)
+    for subfolderName in sorted(folder[3]):
+      for f in attachFolder(folder[3].pop(subfolderName), folder, subfolderName):
+        yield f
+
+  count = 0
+  while count < fileCount:
+    parent = rng.choice(parents)
+    if len(folders) > 1 and rng.random() < folderCopyRatio:
+      source = rng.choice(folders[1:])
+      newFolder = copyFolder(source, parent[1] + 1)
+      name = source[0][source[0].rfind("/") + 1:]
+    else:
+      fileNames = ["file%d.dat" % i for i in xrange(rng.randint(1, filesPerDir * 2 - 1))]
+      files = []
+      for fileName in fileNames:
+        if len(contentSizes) > 0 and rng.random() < fileCopyRatio:
+          files.append((fileName, rng.randrange(len(contentSizes))))
+        else:
+          files.append((fileName, newContent()))
+      newFolder = [None, parent[1] + 1, files, {}]
+      name = "dir%d" % len(folders)
+
+    for (filePath, contentId) in attachFolder(newFolder, parent, name):
+      yield (filePath, contentId, contentSizes[contentId])
+      count += 1
+      if count >= fileCount:
+        return
+
+def getSyntheticHash(contentId, seed=0):
+  # a made-up MD5 hash for generateSyntheticFiles() contents. the seed is part of it,
+  # since the same contentId is a different file (with a different size) in data
+  # made with another seed
+  return hashlib.md5("seed%d content%d" % (seed, contentId)).hexdigest()
+
+def getSyntheticContents(contentId, fileSize, seed=0):
+  # made-up file contents for generateSyntheticFiles(), different for each contentId and seed
+  block = hashlib.sha512("seed%d content%d" % (seed, contentId)).digest()
+  return (block * (fileSize // len(block) + 1))[:fileSize]
@@ -0,0 +1,115 @@
+import sys
+import argparse
+import nateBackupToolsCommon as common
+import csv
+
+# see https://docs.python.org/dev/library/argparse.html
+argParser = argparse.ArgumentParser(description=
+"""Answers questions about a SQLite catalog written by
+\'hashFolderContents.py --format sqlite\' (or converted with
+\'convertHashFile.py --to sqlite\'), using its indexes instead of reading
+every record. Results are written to stdout as csv with space as the
+delimiter.
+
+"copies" lists every copy of a file, given its hash or one of its paths,
+as rows in the hash file format.
+
+"largest" lists the biggest files that have copies, with at least one copy
+under a folder. A row whose first field is "file" has the fields
+<sizeHumanReadableText> <copyCount>, and is followed by a "duplicate" row
+with the <path> of each copy.
+
+"only-in" lists the files whose contents aren't in any of the other
+catalogs, as rows in the hash file format.""")
+
+argParser.add_argument('catalogPath', help='The path to the SQLite catalog')
+
+subParsers = argParser.add_subparsers(dest='query')
+
+copiesParser = subParsers.add_parser('copies', help='Where are all copies of a file?')
+copiesParser.add_argument('hashOrPath', help='A file hash, or the path of a file in the catalog')
+
+largestParser = subParsers.add_parser('largest', help='What are the biggest duplicated files?')
+largestParser.add_argument('--under', metavar='FOLDER', default='',
+  help='Only files with a copy in this folder (as its path is written in the catalog)')
+largestParser.add_argument('--limit', type=int, default=20,
+  help='How many files to list (default 20)')
+
+onlyInParser = subParsers.add_parser('only-in', help='What\'s only in this catalog?')
+onlyInParser.add_argument('otherCatalogPaths', nargs='+', metavar='OTHER_CATALOG',
+  help='The SQLite catalogs of the other drives')
+
+args = argParser.parse_args()
+
+for catalogPath in [args.catalogPath] + getattr(args, 'otherCatalogPaths', []):
+  if not common.isSqliteCatalog(catalogPath):
+    argParser.error(catalogPath + " is not a SQLite catalog")
+if args.query == 'only-in':
+  try:
+    common.checkCatalogAlgorithms([args.catalogPath] + args.otherCatalogPaths)
+  except ValueError as e:
+    argParser.error(str(e))
+
+db = common.openSqliteCatalog(args.catalogPath)
+csvOut = csv.writer(sys.stdout, delimiter=' ', strict=True)
+
+def writeHashFileRows(cursor):
+  for (fileHash, fileSize, filePath, mtime) in cursor:
+    row = [fileHash, fileSize, common.getHumanReadableSize(fileSize), filePath]
+    if mtime is not None:
+      row.append(common.formatMtime(mtime))
+    csvOut.writerow(row)
+
+selectRows = "SELECT f.hash, f.size, d.path || f.name, f.mtime FROM files f JOIN dirs d ON d.id = f.dirId "
+
+if args.query == 'copies':
+  fileHash = args.hashOrPath
+  cut = max(fileHash.rfind('/'), fileHash.rfind('\\')) + 1
+  row = db.execute("SELECT f.hash FROM files f JOIN dirs d ON d.id = f.dirId "
+                   "WHERE d.path = ? AND f.name = ?", (fileHash[:cut], fileHash[cut:])).fetchone()
+  if row is not None:
+    fileHash = row[0]
+  writeHashFileRows(db.execute(selectRows + "WHERE f.hash = ? ORDER BY f.id", (fileHash,)))
+
+elif args.query == 'largest':
+  folder = args.under
+  if folder != "" and not folder.endswith('/') and not folder.endswith('\\'):
+    folder += '/'
+  # the folders under it are the paths from the folder up to (not including) the folder
+  # with the last character one higher, so the unique index on dir paths finds them
+  if folder != "":
+    folderCondition = "AND d.path >= ? AND d.path < ? "
+    parameters = (folder, folder[:-1] + chr(ord(folder[-1]) + 1))
+  else:
+    folderCondition = ""
+    parameters = ()
+  # the copies of every duplicated file are counted in one pass over the hash index,
+  # then the files are walked from the biggest down, stopping once there are enough
+  piles = []
+  hashesSeen = set()
+  for (fileHash, fileSize, copyCount) in db.execute(
+      "SELECT f.hash, f.size, c.copyCount FROM files f JOIN dirs d ON d.id = f.dirId "
+      "JOIN (SELECT hash, COUNT(*) AS copyCount FROM files GROUP BY hash HAVING COUNT(*) > 1) c "
+      "ON c.hash = f.hash WHERE 1 " + folderCondition + "ORDER BY f.size DESC", parameters):
+    if len(piles) >= args.limit:
+      break
+    if fileHash in hashesSeen:
+      continue
+    hashesSeen.add(fileHash)
+    piles.append((fileHash, fileSize, copyCount))
+
+  for (fileHash, fileSize, copyCount) in piles:
+    csvOut.writerow(["file", common.getHumanReadableSize(fileSize), copyCount])
+    for (filePath,) in db.execute("SELECT d.path || f.name FROM files f JOIN dirs d ON d.id = f.dirId "
+                                  "WHERE f.hash = ? ORDER BY 1", (fileHash,)):
+      csvOut.writerow(["duplicate", filePath])
+    csvOut.writerow([])
+
+elif args.query == 'only-in':
+  conditions = []
+  for (i, otherCatalogPath) in enumerate(args.otherCatalogPaths):
+    db.execute("ATTACH DATABASE ? AS other%d" % i, (otherCatalogPath,))
+    conditions.append("NOT EXISTS (SELECT 1 FROM other%d.files o WHERE o.hash = f.hash)" % i)
+  writeHashFileRows(db.execute(selectRows + "WHERE " + " AND ".join(conditions) + " ORDER BY f.id"))
+
+db.close()
@@ -0,0 +1,124 @@
+import sys
+import os
+import argparse
+import nateBackupToolsCommon as common
+
+# see https://docs.python.org/dev/library/argparse.html
+argParser = argparse.ArgumentParser(description=
+"""Reads a directory and its subdirectories directly (no hash file needed)
+and reports duplicate files, writing them to an output file in the same
+format as \'findDuplicateFiles.py\'.
+
+To avoid reading every byte, files are compared in stages: first by size
+(a file with a unique size can't have a duplicate), then by an MD5 hash of
+just their first and last bytes, and only files that still match are
+fully hashed.""")
+
+argParser.add_argument('dirToScan', help='The directory to scan')
+
+argParser.add_argument('outFilePath',
+  help='The path to the output file to populate with detected duplicates')
+
+argParser.add_argument('--jobs', type=int, default=1,
+  help='The number of files to hash at the same time (default 1)')
+
+argParser.add_argument('--sample-size', type=int, default=65536,
+  help='How many bytes to read from each end of a file for the partial hash (default 65536)')
+
+common.addMetricsArgument(argParser)
+
+args = argParser.parse_args()
+metrics = common.Metrics()
+
+# stage 1: group all files by size
+filesBySize = {} # key = size, value = list of paths
+totalSize = 0
+progress = metrics.progress("walk", "\rFinding file {0}...")
+for (filePath, fileStat) in common.walkFiles(args.dirToScan):
+  progress.report()
+  fileSize = fileStat.st_size
+  totalSize += fileSize
+
+  pile = filesBySize.get(fileSize)
+  if pile is None:
+    pile = []
+    filesBySize[fileSize] = pile
+  pile.append(filePath)
+
+progress.reportDone()
+
+# stage 2: group same-sized files by a hash of their first and last bytes
+def hashFileEnds(fileInfo):
+  (filePath, fileSize) = fileInfo
+  if fileSize == 0:
+    # every empty file is the same, no need to open them
+    return (fileInfo, common.EMPTY_FILE_HASH, True)
+  (partialHash, isWholeFile) = common.getPartialFileHash(filePath, fileSize, args.sample_size)
+  return (fileInfo, partialHash, isWholeFile)
+
+def enumerateSameSizeFiles():
+  for fileSize in filesBySize:
+    filePaths = filesBySize[fileSize]
+    if len(filePaths) > 1:
+      for filePath in filePaths:
+        yield (filePath, fileSize)
+
+bytesRead = 0
+filesByPartialHash = {} # key = (size, partial hash), value = list of (path, isWholeFile)
+progress = metrics.progress("hash ends", "\rReading ends of same-sized file {0}...")
+for ((filePath, fileSize), partialHash, isWholeFile) in \
+    common.imapOrdered(hashFileEnds, enumerateSameSizeFiles(), args.jobs):
+  partialBytesRead = fileSize if isWholeFile else args.sample_size * 2
+  progress.report(partialBytesRead)
+  bytesRead += partialBytesRead
+  key = (fileSize, partialHash)
+  pile = filesByPartialHash.get(key)
+  if pile is None:
+    pile = []
+    filesByPartialHash[key] = pile
+  pile.append((filePath, isWholeFile))
+
+progress.reportDone()
+filesBySize = None
+
+# stage 3: fully hash files that still look alike
+def hashWholeFile(fileInfo):
+  (filePath, fileSize, partialHash, isWholeFile) = fileInfo
+  if isWholeFile:
+    # the partial hash already covered the whole file
+    return (fileInfo, partialHash)
+  return (fileInfo, common.getFileHash(filePath))
+
+def enumerateSamePartialHashFiles():
+  for (fileSize, partialHash) in filesByPartialHash:
+    pile = filesByPartialHash[(fileSize, partialHash)]
+    if len(pile) > 1:
+      for (filePath, isWholeFile) in pile:
+        yield (filePath, fileSize, partialHash, isWholeFile)
+
+builder = common.TreeBuilder()
+filesByHash = common.HashIndex()
+progress = metrics.progress("hash", "\rHashing possibly duplicate file {0}...")
+for ((filePath, fileSize, partialHash, isWholeFile), fileHash) in \
+    common.imapOrdered(hashWholeFile, enumerateSamePartialHashFiles(), args.jobs):
+  if not isWholeFile:
+    progress.report(fileSize)
+    bytesRead += fileSize
+  else:
+    progress.report()
+
+  # build an in-memory tree of the candidate files, the same as findDuplicateFiles.py
+  filesByHash.add(builder.addFile(common.packHash(fileHash), fileSize, filePath))
+
+progress.reportDone()
+builder.finish()
+filesByPartialHash = None
+
+print "Read %s of %s total file contents" % (common.getHumanReadableSize(bytesRead),
+                                           common.getHumanReadableSize(totalSize))
+
+stage = metrics.startStage("report")
+common.writeDuplicateFileReport(filesByHash, args.outFilePath)
+stage.finish(len(filesByHash))
+metrics.write(args.metrics)
+print 'done'
@@ -7,6 +7,9 @@ import shutil
 import subprocess
 import difflib
 import filecmp
+import json
+import time
+import hashlib
 
 # see https://docs.python.org/dev/library/argparse.html
 argParser = argparse.ArgumentParser(description=
@@ -37,29 +40,617 @@ if not os.path.exists('testResults_actual'):
   os.mkdir('testResults_actual')
 deleteFolderContents('testResults_actual')
 
+failedCount = 0
+
+def compareResults(actualPath, expectedPath):
+  global failedCount
+  if filecmp.cmp(actualPath, expectedPath, shallow=False):
+    sys.stdout.write(" ok\n")
+  else:
+    sys.stdout.write(" failed\n")
+    failedCount += 1
+    with open(actualPath) as f:
+      actual = f.read().splitlines()
+    with open(expectedPath) as f:
+      expected = f.read().splitlines()
+    for line in difflib.unified_diff(expected, actual, fromfile='expected', tofile='actual', n=3):
+      print line.rstrip("\r\n")
+
+def runScript(*scriptArgs):
+  with open(os.devnull, "w") as fnull:
+    subprocess.check_call([pythonPath] + list(scriptArgs),
+                          stdout=fnull,
+                          stderr=fnull)
+
+def runScriptToFile(outFilePath, *scriptArgs):
+  # for scripts that write their results to stdout
+  with open(outFilePath, "wb") as outFile, open(os.devnull, "w") as fnull:
+    subprocess.check_call([pythonPath] + list(scriptArgs),
+                          stdout=outFile,
+                          stderr=fnull)
+
+def writeCsvRows(outFilePath, rows):
+  # in the same format as the scripts' outputs
+  with open(outFilePath, 'wb') as f:
+    csv.writer(f, delimiter=' ', strict=True).writerows(rows)
+
 # test something
 sys.stdout.write("testing findDuplicateFolders.py... ")
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'stuff/testData_findDuplicateFolders_hashes.txt')
+runScript('findDuplicateFolders.py',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/folders.txt')
+compareResults('testResults_actual/folders.txt', 'testResults_expected/folders.txt')
+
+sys.stdout.write("testing hashFolderContents.py --algorithm and --also-hash... ")
+# small reads and a low --mmap-threshold, so both ways of reading take several chunks
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes_sha256.txt',
+          '--algorithm', 'sha256',
+          '--also-hash', 'sha1',
+          '--read-size', '16',
+          '--mmap-threshold', '50')
+with open('stuff/testData_findDuplicateFolders_hashes.txt', 'rb') as f:
+  md5Rows = list(csv.reader(f, delimiter=' '))
+with open('testResults_actual/hashes_sha256_expected.txt', 'wb') as f:
+  csvOut = csv.writer(f, delimiter=' ', strict=True)
+  for row in md5Rows:
+    with open(row[3], 'rb') as fileToHash:
+      contents = fileToHash.read()
+    csvOut.writerow(['sha256:' + hashlib.sha256(contents).hexdigest()] + row[1:5] +
+                    ['sha1:' + hashlib.sha1(contents).hexdigest()])
+compareResults('testResults_actual/hashes_sha256.txt', 'testResults_actual/hashes_sha256_expected.txt')
+
+sys.stdout.write("testing hashFolderContents.py --jobs... ")
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes_jobs.txt',
+          '--jobs', '4')
+compareResults('testResults_actual/hashes_jobs.txt', 'stuff/testData_findDuplicateFolders_hashes.txt')
+
+sys.stdout.write("testing hashFolderContents.py --previous... ")
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes_previous.txt',
+          '--previous', 'stuff/testData_findDuplicateFolders_hashes.txt')
+compareResults('testResults_actual/hashes_previous.txt', 'stuff/testData_findDuplicateFolders_hashes.txt')
+
+sys.stdout.write("testing hashFolderContents.py --previous reuses hashes... ")
+# a wrong hash for a file with the same size and mtime is kept (so it wasn't hashed
+# again), but one for a file whose size changed is replaced
+with open('stuff/testData_findDuplicateFolders_hashes.txt', 'rb') as f:
+  previousRows = list(csv.reader(f, delimiter=' '))
+expectedRows = [list(row) for row in previousRows]
+for (previousRow, expectedRow) in zip(previousRows, expectedRows):
+  if previousRow[3] == 'testData_findDuplicateFolders/a/just_in_a.txt':
+    previousRow[0] = expectedRow[0] = '0' * 32
+  elif previousRow[3] == 'testData_findDuplicateFolders/b/just_in_b.txt':
+    previousRow[0] = '0' * 32
+    previousRow[1] = str(int(previousRow[1]) + 1)
+writeCsvRows('testResults_actual/hashes_wrong_previous.txt', previousRows)
+writeCsvRows('testResults_actual/hashes_reused_expected.txt', expectedRows)
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes_reused.txt',
+          '--previous', 'testResults_actual/hashes_wrong_previous.txt')
+compareResults('testResults_actual/hashes_reused.txt', 'testResults_actual/hashes_reused_expected.txt')
+
+sys.stdout.write("testing hashFolderContents.py --resume... ")
+with open('stuff/testData_findDuplicateFolders_hashes.txt', 'rb') as f:
+  interruptedRows = f.read()
+with open('testResults_actual/hashes_resumed.txt', 'wb') as f:
+  # as if the scan stopped partway through writing a row
+  f.write(interruptedRows[:len(interruptedRows) / 2])
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes_resumed.txt',
+          '--resume')
+compareResults('testResults_actual/hashes_resumed.txt', 'stuff/testData_findDuplicateFolders_hashes.txt')
+
+sys.stdout.write("testing hashFolderContents.py --resume checkpoints with names that aren't ASCII... ")
+# (a UTF-8 folder name, and file names that aren't UTF-8 at all)
+nonAsciiDir = 'testResults_actual/r\xc3\xa9sum\xc3\xa9'
+os.makedirs(os.path.join(nonAsciiDir, 'sub'))
+for (i, name) in enumerate(['caf\xe9.txt', 'plain.txt', 'sub/\xe9t\xe9.txt', 'skip\xe9.tmp', 'sub/z.txt']):
+  with open(os.path.join(nonAsciiDir, name), 'wb') as f:
+    f.write("contents %d\n" % i)
+runScript('hashFolderContents.py', nonAsciiDir, 'testResults_actual/hashes_nonascii.txt',
+          '--exclude', '*\xe9.tmp')
+# a bad --metrics path stops the scan after it's written its rows, but before it
+# cleans up its checkpoint, as if it had been killed
+with open(os.devnull, "w") as fnull:
+  subprocess.call([pythonPath, 'hashFolderContents.py', nonAsciiDir, 'testResults_actual/hashes_nonascii_resumed.txt',
+                   '--exclude', '*\xe9.tmp', '--resume', '--checkpoint-seconds', '0',
+                   '--metrics', 'testResults_actual/no_such_folder/metrics.json'], stdout=fnull, stderr=fnull)
+with open('testResults_actual/checkpoint_saved.txt', 'wb') as f:
+  f.write("%s\n" % os.path.exists('testResults_actual/hashes_nonascii_resumed.txt.checkpoint'))
+with open('testResults_actual/checkpoint_saved_expected.txt', 'wb') as f:
+  f.write("True\n")
+compareResults('testResults_actual/checkpoint_saved.txt', 'testResults_actual/checkpoint_saved_expected.txt')
+
+sys.stdout.write("testing hashFolderContents.py --resume with names that aren't ASCII... ")
+with open('testResults_actual/hashes_nonascii_resumed.txt', 'rb') as f:
+  interruptedRows = f.read()
+with open('testResults_actual/hashes_nonascii_resumed.txt', 'wb') as f:
+  f.write(interruptedRows[:len(interruptedRows) / 2])
+runScript('hashFolderContents.py', nonAsciiDir, 'testResults_actual/hashes_nonascii_resumed.txt',
+          '--exclude', '*\xe9.tmp', '--resume')
+compareResults('testResults_actual/hashes_nonascii_resumed.txt', 'testResults_actual/hashes_nonascii.txt')
+
+sys.stdout.write("testing hashFolderContents.py --schedule device... ")
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes_device.txt',
+          '--schedule', 'device')
+compareResults('testResults_actual/hashes_device.txt', 'stuff/testData_findDuplicateFolders_hashes.txt')
+
+sys.stdout.write("testing hashFolderContents.py --exclude... ")
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes_exclude.txt',
+          '--exclude', 'a', '--exclude', '*root*')
+with open('stuff/testData_findDuplicateFolders_hashes.txt', 'rb') as f:
+  expectedRows = [r for r in f if '/b/' in r.replace('\\', '/')]
+with open('testResults_actual/hashes_exclude_expected.txt', 'wb') as f:
+  f.writelines(expectedRows)
+compareResults('testResults_actual/hashes_exclude.txt', 'testResults_actual/hashes_exclude_expected.txt')
+
+sys.stdout.write("testing scanForDuplicateFiles.py... ")
+runScript('findDuplicateFiles.py',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/files.txt')
+runScript('scanForDuplicateFiles.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/files_scanned.txt',
+          '--sample-size', '16')
+compareResults('testResults_actual/files_scanned.txt', 'testResults_actual/files.txt')
+
+sys.stdout.write("testing findDuplicateFiles.py --streaming... ")
+runScript('findDuplicateFiles.py',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/files_streaming.txt',
+          '--streaming', '--sort-memory', '3')
+compareResults('testResults_actual/files_streaming.txt', 'testResults_actual/files.txt')
+
+sys.stdout.write("testing findDuplicateFiles.py --catalog... ")
+runScript('findDuplicateFiles.py',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/files_catalogs.txt',
+          '--label', 'a', '--catalog', 'b', 'stuff/testData_findDuplicateFolders_hashes.txt')
+for i in range(2):
+  # the second run loads from the cache
+  runScript('findDuplicateFiles.py',
+            'stuff/testData_findDuplicateFolders_hashes.txt',
+            'testResults_actual/files_catalogs_cached.txt',
+            '--label', 'a', '--catalog', 'b', 'stuff/testData_findDuplicateFolders_hashes.txt',
+            '--cache-dir', 'testResults_actual/cache')
+compareResults('testResults_actual/files_catalogs_cached.txt', 'testResults_actual/files_catalogs.txt')
+
+sys.stdout.write("testing hashFolderContents.py --format sqlite... ")
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes.db',
+          '--format', 'sqlite')
+runScript('findDuplicateFiles.py',
+          'testResults_actual/hashes.db',
+          'testResults_actual/files_sqlite.txt')
+compareResults('testResults_actual/files_sqlite.txt', 'testResults_actual/files.txt')
+
+sys.stdout.write("testing queryCatalog.py copies... ")
+with open('stuff/testData_findDuplicateFolders_hashes.txt', 'rb') as f:
+  hashRows = list(csv.reader(f, delimiter=' '))
+runScript('convertHashFile.py',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/query.db',
+          '--to', 'sqlite')
+runScriptToFile('testResults_actual/query_copies.txt',
+                'queryCatalog.py',
+                'testResults_actual/query.db',
+                'copies', 'testData_findDuplicateFolders/b/multi_in_ab_b.txt')
+writeCsvRows('testResults_actual/query_copies_expected.txt',
+               [row for row in hashRows if row[0] == 'bb0ed9b097ea8b7d44caac7d7afc6f9d'])
+compareResults('testResults_actual/query_copies.txt', 'testResults_actual/query_copies_expected.txt')
+
+sys.stdout.write("testing queryCatalog.py largest --under... ")
+runScriptToFile('testResults_actual/query_largest.txt',
+                'queryCatalog.py',
+                'testResults_actual/query.db',
+                'largest', '--under', 'testData_findDuplicateFolders/b')
+writeCsvRows('testResults_actual/query_largest_expected.txt', [
+  ['file', '71 Bytes', '5'],
+  ['duplicate', 'testData_findDuplicateFolders/a/multi_in_ab.txt'],
+  ['duplicate', 'testData_findDuplicateFolders/a/multi_in_ab_a1.txt'],
+  ['duplicate', 'testData_findDuplicateFolders/a/multi_in_ab_a2.txt'],
+  ['duplicate', 'testData_findDuplicateFolders/b/multi_in_ab.txt'],
+  ['duplicate', 'testData_findDuplicateFolders/b/multi_in_ab_b.txt'],
+  [],
+  ['file', '36 Bytes', '2'],
+  ['duplicate', 'testData_findDuplicateFolders/a/same_in_a_and_b.txt'],
+  ['duplicate', 'testData_findDuplicateFolders/b/same_in_a_and_b.txt'],
+  []])
+compareResults('testResults_actual/query_largest.txt', 'testResults_actual/query_largest_expected.txt')
+
+sys.stdout.write("testing queryCatalog.py only-in... ")
+# a catalog of just the b folder
+bRows = [row for row in hashRows if row[3].startswith('testData_findDuplicateFolders/b/')]
+writeCsvRows('testResults_actual/query_b.txt', bRows)
+runScript('convertHashFile.py',
+          'testResults_actual/query_b.txt',
+          'testResults_actual/query_b.db',
+          '--to', 'sqlite')
+runScriptToFile('testResults_actual/query_only_in.txt',
+                'queryCatalog.py',
+                'testResults_actual/query.db',
+                'only-in', 'testResults_actual/query_b.db')
+bHashes = set(row[0] for row in bRows)
+writeCsvRows('testResults_actual/query_only_in_expected.txt',
+               [row for row in hashRows if row[0] not in bHashes])
+compareResults('testResults_actual/query_only_in.txt', 'testResults_actual/query_only_in_expected.txt')
+
+sys.stdout.write("testing catalogs with different hash algorithms are refused... ")
+# md5 and sha256 hashes never match, so comparing them would quietly find nothing
+runScript('convertHashFile.py',
+          'testResults_actual/hashes_sha256.txt',
+          'testResults_actual/hashes_sha256.db',
+          '--to', 'sqlite')
+mixedRuns = [
+  ['findDuplicateFiles.py', 'stuff/testData_findDuplicateFolders_hashes.txt', 'testResults_actual/mixed.txt',
+   '--label', 'md5', '--catalog', 'sha256', 'testResults_actual/hashes_sha256.txt', '--cross-catalog-only'],
+  ['findDuplicateFiles.py', 'stuff/testData_findDuplicateFolders_hashes.txt', 'testResults_actual/mixed.txt',
+   '--label', 'md5', '--catalog', 'sha256', 'testResults_actual/hashes_sha256.txt', '--streaming'],
+  ['findDuplicateFolders.py', 'stuff/testData_findDuplicateFolders_hashes.txt', 'testResults_actual/mixed.txt',
+   '--label', 'md5', '--catalog', 'sha256', 'testResults_actual/hashes_sha256.txt', '--streaming'],
+  ['queryCatalog.py', 'testResults_actual/query.db', 'only-in', 'testResults_actual/hashes_sha256.db'],
+  ]
 with open(os.devnull, "w") as fnull:
-  subprocess.check_call([pythonPath,
-                         'hashFolderContents.py',
-                         'testData_findDuplicateFolders',
-                         'stuff/testData_findDuplicateFolders_hashes.txt'],
-                         stdout=fnull,
-                         stderr=fnull)
-  subprocess.check_call([pythonPath,
-                         'findDuplicateFolders.py',
-                         'stuff/testData_findDuplicateFolders_hashes.txt',
-                         'testResults_actual/folders.txt'],
-                         stdout=fnull,
-                         stderr=fnull)
-if filecmp.cmp('testResults_actual/folders.txt', 'testResults_expected/folders.txt'):
-  sys.stdout.write(" ok\n")
-else:
-  sys.stdout.write(" failed\n")
-  with open('testResults_actual/folders.txt') as f:
-    actual = f.read().splitlines()
-  with open('testResults_expected/folders.txt') as f:
-    expected = f.read().splitlines()
-  for line in difflib.unified_diff(expected, actual, fromfile='expected', tofile='actual', n=3):
-    print line.rstrip("\r\n")
+  refused = [subprocess.call([pythonPath] + run, stdout=fnull, stderr=fnull) != 0 for run in mixedRuns]
+with open('testResults_actual/mixed_refused.txt', 'wb') as f:
+  f.write("%s\n" % refused)
+with open('testResults_actual/mixed_refused_expected.txt', 'wb') as f:
+  f.write("%s\n" % ([True] * len(mixedRuns)))
+compareResults('testResults_actual/mixed_refused.txt', 'testResults_actual/mixed_refused_expected.txt')
+
+sys.stdout.write("testing verifyHashes.py... ")
+runScript('verifyHashes.py',
+          'testData_findDuplicateFolders',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/verify.txt',
+          '--jobs', '4')
+with open('testResults_actual/verify_expected.txt', 'wb') as f:
+  pass # nothing should have changed
+compareResults('testResults_actual/verify.txt', 'testResults_actual/verify_expected.txt')
+
+sys.stdout.write("testing verifyHashes.py with changed files... ")
+shutil.copytree('testData_findDuplicateFolders', 'testResults_actual/verify_tree')
+def setMtime(filePath):
+  # like touch -r, so a change to the contents can't be seen from the mtime
+  os.utime(filePath, (1500000000, 1500000000))
+for (dirPath, dirNames, fileNames) in os.walk('testResults_actual/verify_tree'):
+  for fileName in fileNames:
+    setMtime(os.path.join(dirPath, fileName))
+runScript('hashFolderContents.py',
+          'testResults_actual/verify_tree',
+          'testResults_actual/verify_tree_hashes.txt')
+os.remove('testResults_actual/verify_tree/a/just_in_a.txt')
+with open('testResults_actual/verify_tree/b/added.txt', 'wb') as f:
+  f.write("a file that wasn't there before\n")
+with open('testResults_actual/verify_tree/b/just_in_b.txt', 'ab') as f:
+  f.write("an edit that makes the file longer\n")
+with open('testResults_actual/verify_tree/a/just_in_a2.txt', 'r+b') as f:
+  # flip the first byte, as a bad disk might
+  firstByte = f.read(1)
+  f.seek(0)
+  f.write(chr(ord(firstByte) ^ 1))
+setMtime('testResults_actual/verify_tree/a/just_in_a2.txt')
+with open('testResults_actual/verify_tree/a/just_in_a2.txt', 'rb') as f:
+  corruptedHash = hashlib.md5(f.read()).hexdigest()
+runScript('verifyHashes.py',
+          'testResults_actual/verify_tree',
+          'testResults_actual/verify_tree_hashes.txt',
+          'testResults_actual/verify_changed.txt')
+# rows are in hash file order, then new files
+expectedRows = {
+  'testResults_actual/verify_tree/a/just_in_a.txt': lambda row: ["missing", row[3]],
+  'testResults_actual/verify_tree/b/just_in_b.txt': lambda row: ["modified", row[3]],
+  'testResults_actual/verify_tree/a/just_in_a2.txt': lambda row: ["mismatch", row[3], row[0], corruptedHash],
+  }
+with open('testResults_actual/verify_tree_hashes.txt', 'rb') as f:
+  treeRows = list(csv.reader(f, delimiter=' '))
+writeCsvRows('testResults_actual/verify_changed_expected.txt',
+               [expectedRows[row[3]](row) for row in treeRows if row[3] in expectedRows] +
+               [["new", 'testResults_actual/verify_tree/b/added.txt']])
+compareResults('testResults_actual/verify_changed.txt', 'testResults_actual/verify_changed_expected.txt')
+
+sys.stdout.write("testing diffHashFiles.py... ")
+runScript('diffHashFiles.py',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/hashes_jobs.txt',
+          'testResults_actual/diff.txt')
+compareResults('testResults_actual/diff.txt', 'testResults_actual/verify_expected.txt')
+
+sys.stdout.write("testing diffHashFiles.py with changes... ")
+# a tiny --sort-memory, so the sorts go through files on disk
+runScript('diffHashFiles.py',
+          'testData_diffHashFiles/old_hashes.txt',
+          'testData_diffHashFiles/new_hashes.txt',
+          'testResults_actual/diff_changes.txt',
+          '--sort-memory', '2')
+compareResults('testResults_actual/diff_changes.txt', 'testResults_expected/diff.txt')
+
+sys.stdout.write("testing convertHashFile.py... ")
+runScript('convertHashFile.py',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/hashes.bin')
+runScript('convertHashFile.py',
+          'testResults_actual/hashes.bin',
+          'testResults_actual/hashes_converted.txt')
+compareResults('testResults_actual/hashes_converted.txt', 'stuff/testData_findDuplicateFolders_hashes.txt')
+
+sys.stdout.write("testing convertHashFile.py with extra hashes... ")
+runScript('hashFolderContents.py',
+          'testData_findDuplicateFolders',
+          'testResults_actual/hashes_also.txt',
+          '--also-hash', 'sha1')
+runScript('convertHashFile.py',
+          'testResults_actual/hashes_also.txt',
+          'testResults_actual/hashes_also.db',
+          '--to', 'sqlite')
+runScript('convertHashFile.py',
+          'testResults_actual/hashes_also.db',
+          'testResults_actual/hashes_also_converted.txt')
+compareResults('testResults_actual/hashes_also_converted.txt', 'testResults_actual/hashes_also.txt')
+
+sys.stdout.write("testing convertHashFile.py refuses to drop extra hashes... ")
+with open(os.devnull, "w") as fnull:
+  exitCode = subprocess.call([pythonPath, 'convertHashFile.py',
+                              'testResults_actual/hashes_also.txt',
+                              'testResults_actual/hashes_also.bin'],
+                             stdout=fnull, stderr=fnull)
+with open('testResults_actual/convert_refused.txt', 'wb') as f:
+  # and nothing is left behind that looks like a catalog
+  f.write("%s %s\n" % (exitCode != 0, os.path.exists('testResults_actual/hashes_also.bin')))
+with open('testResults_actual/convert_refused_expected.txt', 'wb') as f:
+  f.write("True False\n")
+compareResults('testResults_actual/convert_refused.txt', 'testResults_actual/convert_refused_expected.txt')
+
+sys.stdout.write("testing findDuplicateFiles.py --metrics... ")
+runScript('findDuplicateFiles.py',
+          'stuff/testData_findDuplicateFolders_hashes.txt',
+          'testResults_actual/files_metrics.txt',
+          '--metrics', 'testResults_actual/metrics.json')
+with open('testResults_actual/metrics.json', 'rb') as f:
+  stages = json.load(f)['stages']
+with open('testResults_actual/metrics_stages.txt', 'wb') as f:
+  for stage in stages:
+    f.write("%s %s\n" % (stage['name'], stage['seconds'] is not None))
+with open('testResults_actual/metrics_stages_expected.txt', 'wb') as f:
+  f.write("load True\nreport True\n")
+compareResults('testResults_actual/metrics_stages.txt', 'testResults_actual/metrics_stages_expected.txt')
+
+sys.stdout.write("testing generateTestData.py... ")
+for i in range(2):
+  # the same seed makes the same data
+  runScript('generateTestData.py',
+            'testResults_actual/synthetic%d.txt' % i,
+            '--files', '2000', '--seed', '7')
+compareResults('testResults_actual/synthetic1.txt', 'testResults_actual/synthetic0.txt')
+
+sys.stdout.write("testing generateTestData.py with different seeds... ")
+# data made with different seeds has no files in common
+runScript('generateTestData.py',
+          'testResults_actual/synthetic_seed8.txt',
+          '--files', '2000', '--seed', '8')
+runScript('findDuplicateFiles.py',
+          'testResults_actual/synthetic0.txt',
+          'testResults_actual/synthetic_seeds_duplicates.txt',
+          '--label', 'seed7',
+          '--catalog', 'seed8', 'testResults_actual/synthetic_seed8.txt',
+          '--cross-catalog-only')
+with open('testResults_actual/synthetic_seeds_duplicates_expected.txt', 'wb') as f:
+  pass
+compareResults('testResults_actual/synthetic_seeds_duplicates.txt', 'testResults_actual/synthetic_seeds_duplicates_expected.txt')
+
+sys.stdout.write("testing findDuplicateFolders.py --subtrees... ")
+runScript('hashFolderContents.py',
+          'testData_subtrees',
+          'testResults_actual/subtrees_hashes.txt')
+runScript('findDuplicateFolders.py',
+          'testResults_actual/subtrees_hashes.txt',
+          'testResults_actual/subtrees.txt',
+          '--subtrees')
+compareResults('testResults_actual/subtrees.txt', 'testResults_expected/subtrees.txt')
+
+sys.stdout.write("testing findDuplicateFolders.py --subtrees --ignore-names... ")
+runScript('findDuplicateFolders.py',
+          'testResults_actual/subtrees_hashes.txt',
+          'testResults_actual/subtrees_ignore_names.txt',
+          '--subtrees', '--ignore-names')
+compareResults('testResults_actual/subtrees_ignore_names.txt', 'testResults_expected/subtrees_ignore_names.txt')
+
+sys.stdout.write("testing findDuplicateFolders.py --jobs... ")
+runScript('findDuplicateFolders.py',
+          'testResults_actual/synthetic0.txt',
+          'testResults_actual/synthetic_folders.txt')
+runScript('findDuplicateFolders.py',
+          'testResults_actual/synthetic0.txt',
+          'testResults_actual/synthetic_folders_jobs.txt',
+          '--jobs', '2')
+compareResults('testResults_actual/synthetic_folders_jobs.txt', 'testResults_actual/synthetic_folders.txt')
+
+sys.stdout.write("testing findDuplicateFolders.py --streaming... ")
+runScript('findDuplicateFolders.py',
+          'testResults_actual/synthetic0.txt',
+          'testResults_actual/synthetic_folders_streaming.txt',
+          '--streaming', '--sort-memory', '100', '--partitions', '4')
+compareResults('testResults_actual/synthetic_folders_streaming.txt', 'testResults_actual/synthetic_folders.txt')
+
+sys.stdout.write("testing findDuplicateFolders.py --ignore-common-hashes... ")
+# the same with every way of comparing folders that has it
+for (mode, extraArgs) in [('serial', []),
+                          ('jobs', ['--jobs', '2']),
+                          ('streaming', ['--streaming', '--sort-memory', '100', '--partitions', '4'])]:
+  runScript(*['findDuplicateFolders.py',
+              'testResults_actual/synthetic0.txt',
+              'testResults_actual/synthetic_folders_common_%s.txt' % mode,
+              '--ignore-common-hashes', '2'] + extraArgs)
+with open('testResults_actual/synthetic_folders_common_same.txt', 'wb') as f:
+  f.write("%s %s\n" % (filecmp.cmp('testResults_actual/synthetic_folders_common_jobs.txt',
+                                   'testResults_actual/synthetic_folders_common_serial.txt', shallow=False),
+                       filecmp.cmp('testResults_actual/synthetic_folders_common_streaming.txt',
+                                   'testResults_actual/synthetic_folders_common_serial.txt', shallow=False)))
+with open('testResults_actual/synthetic_folders_common_same_expected.txt', 'wb') as f:
+  f.write("True True\n")
+compareResults('testResults_actual/synthetic_folders_common_same.txt',
+               'testResults_actual/synthetic_folders_common_same_expected.txt')
+
+sys.stdout.write("testing findDuplicateFolders.py --candidates minhash... ")
+# with enough bands of one number each, every pair of folders sharing a file is a
+# candidate. folders that tie can still be paired with a different copy than
+# without minhash, so only compare which folders were paired at all
+runScript('findDuplicateFolders.py',
+          'testResults_actual/synthetic0.txt',
+          'testResults_actual/synthetic_folders_minhash.txt',
+          '--candidates', 'minhash', '--minhash-bands', '256', '--minhash-rows', '1')
+def writePairedPaths(reportPath, outFilePath):
+  with open(reportPath, 'rb') as f:
+    paths = set(row[3] for row in csv.reader(f, delimiter=' ') if row[:1] == ["parent"])
+  with open(outFilePath, 'wb') as f:
+    f.write("".join(path + "\n" for path in sorted(paths)))
+writePairedPaths('testResults_actual/synthetic_folders_minhash.txt', 'testResults_actual/minhash_paired.txt')
+writePairedPaths('testResults_actual/synthetic_folders.txt', 'testResults_actual/minhash_paired_expected.txt')
+compareResults('testResults_actual/minhash_paired.txt', 'testResults_actual/minhash_paired_expected.txt')
+
+sys.stdout.write("testing findDuplicateFolders.py --top... ")
+runScript('findDuplicateFolders.py',
+          'testResults_actual/synthetic0.txt',
+          'testResults_actual/synthetic_folders_top.txt',
+          '--top', '20')
+# the same as the start of the whole report
+with open('testResults_actual/synthetic_folders_top.txt', 'rb') as f:
+  top = f.read()
+with open('testResults_actual/synthetic_folders.txt', 'rb') as f:
+  whole = f.read()
+with open('testResults_actual/synthetic_folders_top_start.txt', 'wb') as f:
+  f.write(whole[:len(top)])
+compareResults('testResults_actual/synthetic_folders_top.txt', 'testResults_actual/synthetic_folders_top_start.txt')
+
+sys.stdout.write("testing findDuplicateFolders.py --clusters... ")
+runScript('findDuplicateFolders.py',
+          'testResults_actual/synthetic0.txt',
+          'testResults_actual/synthetic_clusters.txt',
+          '--clusters')
+# every paired folder is in exactly one cluster
+with open('testResults_actual/synthetic_folders.txt', 'rb') as f:
+  pairedPaths = set(row[3] for row in csv.reader(f, delimiter=' ')
+                    if row[:2] in (["parent", "left"], ["parent", "right"]))
+with open('testResults_actual/synthetic_clusters.txt', 'rb') as f:
+  memberPaths = [row[4] for row in csv.reader(f, delimiter=' ') if row[:1] == ["member"]]
+with open('testResults_actual/clusters_check.txt', 'wb') as f:
+  f.write("%s %s\n" % (pairedPaths.issubset(memberPaths), len(set(memberPaths)) == len(memberPaths)))
+with open('testResults_actual/clusters_check_expected.txt', 'wb') as f:
+  f.write("True True\n")
+compareResults('testResults_actual/clusters_check.txt', 'testResults_actual/clusters_check_expected.txt')
+
+if sys.platform != 'win32':
+  sys.stdout.write("testing catalogServer.py... ")
+  socketPath = 'testResults_actual/catalogServer.sock'
+  with open(os.devnull, "w") as fnull:
+    server = subprocess.Popen([pythonPath, 'catalogServer.py', socketPath, 'serve',
+                               'testResults_actual/synthetic0.txt'], stdout=fnull, stderr=fnull)
+    while not os.path.exists(socketPath) and server.poll() is None:
+      time.sleep(0.1)
+    try:
+      runScript('catalogServer.py', socketPath, 'duplicate-files', 'testResults_actual/synthetic_files_server.txt')
+    finally:
+      runScript('catalogServer.py', socketPath, 'stop')
+      server.wait()
+  runScript('findDuplicateFiles.py',
+            'testResults_actual/synthetic0.txt',
+            'testResults_actual/synthetic_files.txt')
+  compareResults('testResults_actual/synthetic_files_server.txt', 'testResults_actual/synthetic_files.txt')
+
+  sys.stdout.write("testing catalogServer.py reloading a changed catalog... ")
+  runScript('generateTestData.py',
+            'testResults_actual/server_b.txt',
+            '--files', '1000', '--seed', '7')
+  runScript('generateTestData.py',
+            'testResults_actual/server_b_new.txt',
+            '--files', '1500', '--seed', '7')
+  with open(os.devnull, "w") as fnull:
+    server = subprocess.Popen([pythonPath, 'catalogServer.py', socketPath, 'serve',
+                               'testResults_actual/synthetic0.txt', '--label', 'a',
+                               '--catalog', 'b', 'testResults_actual/server_b.txt'], stdout=fnull, stderr=fnull)
+    while not os.path.exists(socketPath) and server.poll() is None:
+      time.sleep(0.1)
+    try:
+      # replaced in one go, the way the server expects
+      os.rename('testResults_actual/server_b_new.txt', 'testResults_actual/server_b.txt')
+      runScript('catalogServer.py', socketPath, 'duplicate-files', 'testResults_actual/server_reloaded_files.txt')
+      runScript('catalogServer.py', socketPath, 'similar-folders', 'testResults_actual/server_reloaded_folders.txt')
+      runScriptToFile('testResults_actual/server_reloaded_copies.txt',
+                      'catalogServer.py', socketPath, 'copies',
+                      'a/root/dir3/dir5/dir14/dir32/dir23/dir26/dir31/dir32/file7.dat')
+    finally:
+      runScript('catalogServer.py', socketPath, 'stop')
+      server.wait()
+  runScript('findDuplicateFiles.py',
+            'testResults_actual/synthetic0.txt',
+            'testResults_actual/server_reloaded_files_expected.txt',
+            '--label', 'a', '--catalog', 'b', 'testResults_actual/server_b.txt')
+  runScript('findDuplicateFolders.py',
+            'testResults_actual/synthetic0.txt',
+            'testResults_actual/server_reloaded_folders_expected.txt',
+            '--label', 'a', '--catalog', 'b', 'testResults_actual/server_b.txt')
+  # the copies are the pile of the same file in the report
+  with open('testResults_actual/server_reloaded_copies.txt', 'rb') as f:
+    copyPaths = sorted(row[3] for row in csv.reader(f, delimiter=' '))
+  with open('testResults_actual/server_reloaded_files_expected.txt', 'rb') as f:
+    piles = [[]]
+    for row in csv.reader(f, delimiter=' '):
+      if row == []:
+        piles.append([])
+      elif row[0] == "duplicate":
+        piles[-1].append(row[1])
+  with open('testResults_actual/server_reloaded_same.txt', 'wb') as f:
+    f.write("%s %s %s\n" % (filecmp.cmp('testResults_actual/server_reloaded_files.txt',
+                                        'testResults_actual/server_reloaded_files_expected.txt', shallow=False),
+                            filecmp.cmp('testResults_actual/server_reloaded_folders.txt',
+                                        'testResults_actual/server_reloaded_folders_expected.txt', shallow=False),
+                            copyPaths in piles))
+  with open('testResults_actual/server_reloaded_same_expected.txt', 'wb') as f:
+    f.write("True True True\n")
+  compareResults('testResults_actual/server_reloaded_same.txt', 'testResults_actual/server_reloaded_same_expected.txt')
+
+  sys.stdout.write("testing catalogServer.py with names that aren't ASCII... ")
+  with open(os.devnull, "w") as fnull:
+    server = subprocess.Popen([pythonPath, 'catalogServer.py', socketPath, 'serve',
+                               'testResults_actual/hashes_nonascii.txt'], stdout=fnull, stderr=fnull)
+    while not os.path.exists(socketPath) and server.poll() is None:
+      time.sleep(0.1)
+    try:
+      runScriptToFile('testResults_actual/server_nonascii.txt',
+                      'catalogServer.py', socketPath, 'copies', nonAsciiDir + '/caf\xe9.txt')
+      with open('testResults_actual/server_nonascii.txt', 'ab') as f:
+        subprocess.check_call([pythonPath, 'catalogServer.py', socketPath, 'sizes', '--under', nonAsciiDir],
+                              stdout=f, stderr=fnull)
+        # a question about a folder that isn't there is answered with an error, and the server keeps going
+        exitCode = subprocess.call([pythonPath, 'catalogServer.py', socketPath, 'sizes', '--under',
+                                    nonAsciiDir + '/n\xe9e'], stdout=fnull, stderr=fnull)
+        f.write("%s\n" % (exitCode != 0))
+    finally:
+      runScript('catalogServer.py', socketPath, 'stop')
+      server.wait()
+  with open('testResults_actual/hashes_nonascii.txt', 'rb') as f:
+    nonAsciiRows = list(csv.reader(f, delimiter=' '))
+  writeCsvRows('testResults_actual/server_nonascii_expected.txt',
+               [row[:4] for row in nonAsciiRows if row[3] == nonAsciiDir + '/caf\xe9.txt'] +
+               [["folder", "22 Bytes", nonAsciiDir + '/sub']])
+  with open('testResults_actual/server_nonascii_expected.txt', 'ab') as f:
+    f.write("True\n")
+  compareResults('testResults_actual/server_nonascii.txt', 'testResults_actual/server_nonascii_expected.txt')
+
+if failedCount > 0:
   sys.exit(1)
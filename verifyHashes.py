@@ -0,0 +1,171 @@
+import sys
+import os
+import argparse
+import nateBackupToolsCommon as common
+import csv
+import json
+
+# see https://docs.python.org/dev/library/argparse.html
+argParser = argparse.ArgumentParser(description=
+"""Checks a directory against the output of \'hashFolderContents.py\' from an
+earlier scan of it, to catch files that went missing or got corrupted.
+Give the directory the same way it was given to \'hashFolderContents.py\',
+so the paths match.
+
+The output file format is csv with space as the delimiter. Each row is
+<status> <path>, where status is one of:
+"missing" - the file is in the hash file but not on disk
+"new" - the file is on disk but not in the hash file
+"modified" - the file's size or modification time changed, so a different
+hash is expected
+"mismatch" - the file's hash changed even though its size and modification
+time didn't, which usually means it got corrupted. The row also has the
+<expected hash> and <actual hash>.
+"unreadable" - the file couldn't be read. The row also has the <error>.
+
+Hashing every file on a big drive takes hours, so --sample-percent or
+--sample-gb only rehash part of the files each run, and the next run with
+the same --state file carries on where the last one stopped. Missing, new
+and resized files are always checked, since that only needs a directory
+listing.""")
+
+argParser.add_argument('dirToScan', help='The directory to check')
+
+argParser.add_argument('hashFilePath',
+  help='The path to the hash file from an earlier scan of dirToScan')
+
+argParser.add_argument('outFilePath',
+  help='The path to the output file to populate with problems found')
+
+argParser.add_argument('--jobs', type=int, default=1,
+  help='The number of files to hash at the same time (default 1)')
+
+argParser.add_argument('--sample-percent', type=float, default=None, metavar='PERCENT',
+  help='Only rehash this percent of the total file size this run')
+
+argParser.add_argument('--sample-gb', type=float, default=None, metavar='GB',
+  help='Only rehash this many gigabytes of files this run')
+
+argParser.add_argument('--state', metavar='STATE_FILE_PATH',
+  help='A file to remember which files to sample next time, so runs rotate '
+       'through the whole hash file (default <hashFilePath>.verify)')
+
+common.addMetricsArgument(argParser)
+
+args = argParser.parse_args()
+metrics = common.Metrics()
+
+if args.sample_percent is not None and args.sample_gb is not None:
+  argParser.error("only one of --sample-percent and --sample-gb can be given")
+isSampled = args.sample_percent is not None or args.sample_gb is not None
+statePath = args.state if args.state is not None else args.hashFilePath + ".verify"
+
+# read the hash file
+rows = [] # (hash, size, path, mtime)
+progress = metrics.progress("load", "\rReading record {0}...")
+for row in common.readHashFile(args.hashFilePath):
+  progress.report()
+  rows.append(row)
+progress.reportDone()
+
+# list what's on disk now
+filesOnDisk = {} # key = path, value = (size, mtime)
+filePathsOnDisk = []
+progress = metrics.progress("walk", "\rFinding file {0}...")
+for (filePath, fileStat) in common.walkFiles(args.dirToScan):
+  progress.report()
+  filesOnDisk[filePath] = (fileStat.st_size, fileStat.st_mtime)
+  filePathsOnDisk.append(filePath)
+progress.reportDone()
+
+# choose which rows to rehash
+rowsToHash = None # None means all of them
+nextRow = 0
+if isSampled and len(rows) > 0:
+  if os.path.exists(statePath):
+    with open(statePath, "rb") as stateFile:
+      nextRow = json.load(stateFile)['nextRow'] % len(rows)
+  totalSize = sum(row[1] for row in rows)
+  if args.sample_percent is not None:
+    budget = totalSize * args.sample_percent / 100
+  else:
+    budget = args.sample_gb * 1024 * 1024 * 1024
+
+  # carry on from where the last run stopped, wrapping around at the end.
+  # missing and resized files are reported without being hashed, so they
+  # don't use up the budget
+  startRow = nextRow
+  rowsToHash = set()
+  sampledSize = 0
+  rowsLookedAt = 0
+  while rowsLookedAt < len(rows) and (len(rowsToHash) == 0 or sampledSize < budget):
+    (fileHash, fileSize, filePath, mtime) = rows[nextRow]
+    fileOnDisk = filesOnDisk.get(filePath)
+    if fileOnDisk is not None and fileOnDisk[0] == fileSize:
+      rowsToHash.add(nextRow)
+      sampledSize += fileSize
+    nextRow = (nextRow + 1) % len(rows)
+    rowsLookedAt += 1
+  print "Sampling %s of %s, starting at row %d" % (common.getHumanReadableSize(sampledSize),
+                                                   common.getHumanReadableSize(totalSize), startRow)
+
+def enumerateRows():
+  for (index, (fileHash, fileSize, filePath, mtime)) in enumerate(rows):
+    yield (fileHash, fileSize, filePath, mtime, filesOnDisk.get(filePath),
+           rowsToHash is None or index in rowsToHash)
+
+def verifyRow(rowInfo):
+  # returns (rowInfo, output row or None if the file is fine, whether it was hashed)
+  (fileHash, fileSize, filePath, mtime, fileOnDisk, shouldHash) = rowInfo
+  if fileOnDisk is None:
+    return (rowInfo, ["missing", filePath], False)
+  (sizeOnDisk, mtimeOnDisk) = fileOnDisk
+  if sizeOnDisk != fileSize:
+    return (rowInfo, ["modified", filePath], False)
+  if not shouldHash:
+    return (rowInfo, None, False)
+
+  try:
+    hashOnDisk = common.getFileHash(filePath, common.getHashAlgorithm(fileHash))
+  except (IOError, OSError) as e:
+    return (rowInfo, ["unreadable", filePath, str(e)], True)
+  if hashOnDisk == fileHash:
+    return (rowInfo, None, True)
+  if mtime is not None and mtime != mtimeOnDisk:
+    return (rowInfo, ["modified", filePath], True)
+  return (rowInfo, ["mismatch", filePath, fileHash, hashOnDisk], True)
+
+counts = {}
+hashedCount = 0
+hashedSize = 0
+progress = metrics.progress("verify", "\rVerifying file {0}...")
+with open(args.outFilePath, "wb") as outFile:
+  csvOut = csv.writer(outFile, delimiter=' ', strict=True)
+  for (rowInfo, outRow, wasHashed) in common.imapOrdered(verifyRow, enumerateRows(), args.jobs):
+    if wasHashed:
+      progress.report(rowInfo[1])
+      hashedCount += 1
+      hashedSize += rowInfo[1]
+    else:
+      progress.report()
+    if outRow is not None:
+      csvOut.writerow(outRow)
+      counts[outRow[0]] = counts.get(outRow[0], 0) + 1
+
+  # files that weren't there when the hash file was made
+  catalogPaths = set(row[2] for row in rows)
+  for filePath in filePathsOnDisk:
+    if filePath not in catalogPaths:
+      csvOut.writerow(["new", filePath])
+      counts["new"] = counts.get("new", 0) + 1
+progress.reportDone()
+
+if isSampled:
+  with open(statePath, "wb") as stateFile:
+    json.dump({'nextRow': nextRow}, stateFile)
+metrics.write(args.metrics)
+
+print "Hashed %d files (%s)" % (hashedCount, common.getHumanReadableSize(hashedSize))
+for status in ["mismatch", "unreadable", "modified", "missing", "new"]:
+  print "%s: %d" % (status, counts.get(status, 0))
+print 'done'